@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025  kaliko <kaliko@azylum.org>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+"""Measures client construction and per command overhead with small commands
+
+python3 ./benchmarks/bench_dispatch.py [--calls 200000]
+"""
+import argparse
+import time
+
+from synthetic import client, OKSocket
+import musicpd
+
+
+def construction(count):
+    start = time.perf_counter()
+    for _ in range(count):
+        musicpd.MPDClient()
+    return time.perf_counter() - start
+
+
+def dispatch(calls):
+    cli = client(OKSocket())
+    start = time.perf_counter()
+    for _ in range(calls):
+        cli.ping()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    elapsed = min(construction(args.calls // 10) for _ in range(args.repeat))
+    print(f'construction: {elapsed / (args.calls // 10) * 1e6:6.2f} µs/client')
+    elapsed = min(dispatch(args.calls) for _ in range(args.repeat))
+    print(f'   ping loop: {elapsed / args.calls * 1e6:6.2f} µs/call')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025  kaliko <kaliko@azylum.org>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+"""Measures memory held by a parsed synthetic listallinfo response
+
+python3 ./benchmarks/bench_memory.py [--songs 100000]
+"""
+import argparse
+import gc
+import pathlib
+import sys
+import tracemalloc
+
+sys.path.insert(0, pathlib.Path(__file__).absolute().parents[1].as_posix())
+import musicpd
+
+from synthetic import client, listallinfo, FakeSocket
+
+
+def measure(data, factory):
+    cli = client(FakeSocket(data), record_factory=factory)
+    gc.collect()
+    tracemalloc.start()
+    objs = cli._fetch_database()
+    cli._rfile = None
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, peak, len(objs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--songs', type=int, default=100000)
+    args = parser.parse_args()
+    data, _ = listallinfo(args.songs)
+    print(f'{args.songs} songs, {len(data)/2**20:.1f} MiB response')
+    for label, factory in (('dict', None), ('SongRecord', musicpd.SongRecord)):
+        current, peak, objs = measure(data, factory)
+        print(f'{label:>12}: {current/2**20:7.1f} MiB held, '
+              f'{peak/2**20:7.1f} MiB peak, {current/objs:5.0f} B/object')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025  kaliko <kaliko@azylum.org>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+"""Compares line by line and bulk parsing of a synthetic listallinfo response
+
+python3 ./benchmarks/bench_parse.py [--songs 100000]
+"""
+import argparse
+import time
+
+from synthetic import client, listallinfo, FakeSocket
+
+
+def run(data, bulk):
+    cli = client(FakeSocket(data), bulk=bulk)
+    start = time.perf_counter()
+    objs = cli._fetch_database()
+    return time.perf_counter() - start, len(objs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--songs', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    data, lines = listallinfo(args.songs)
+    print(f'{args.songs} songs, {lines} lines, {len(data)/2**20:.1f} MiB')
+    for label, bulk in (('line by line', False), ('bulk', True)):
+        elapsed, objs = min(run(data, bulk) for _ in range(args.repeat))
+        print(f'{label:>12}: {elapsed:.3f}s {lines/elapsed:>12,.0f} lines/s ({objs} objects)')
+
+
+if __name__ == '__main__':
+    main()
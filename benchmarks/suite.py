@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2025  kaliko <kaliko@azylum.org>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+"""Runs the client hot paths against synthetic responses
+
+python3 ./benchmarks/suite.py [--scale 1.0] [--json results.json] [--compare previous.json]
+
+Each benchmark reports its best time over --repeat runs, a throughput, the
+peak memory traced by tracemalloc (separate run) and the number of socket
+reads and writes ("syscalls") it took. Results written with --json can be
+compared with those of another version with --compare.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from synthetic import (client, albumart, command_list_responses, listallinfo,
+                       playlistinfo, FakeSocket, OKSocket)
+import musicpd
+
+
+class Benchmark:
+    """A benchmark: setup() returns the argument of run(), run() returns
+    (client, units processed)"""
+
+    def __init__(self, name, unit, setup, run):
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+        self.run = run
+
+
+def listallinfo_bench(songs, bulk):
+    def setup():
+        return listallinfo(songs)[0]
+
+    def run(data):
+        cli = client(FakeSocket(data), bulk=bulk)
+        cli._fetch_database()
+        return cli, len(data)
+    return setup, run
+
+
+def playlistinfo_bench(songs):
+    def setup():
+        return playlistinfo(songs)[0]
+
+    def run(data):
+        cli = client(FakeSocket(data))
+        cli._fetch_songs()
+        return cli, len(data)
+    return setup, run
+
+
+def albumart_bench(size):
+    def setup():
+        return albumart(size)
+
+    def run(data):
+        cli = client(FakeSocket(data))
+        sink = bytearray(size)
+        cli.cover('Artist/Album/01.flac', sink)
+        return cli, size
+    return setup, run
+
+
+def command_list_bench(commands, per_list):
+    def setup():
+        return command_list_responses(commands, per_list)
+
+    def run(data):
+        cli = client(FakeSocket(data))
+        cli.command_batch((('addid', f'Artist/Album/{idx:05d}.flac', idx)
+                           for idx in range(commands)), max_commands=per_list)
+        return cli, commands
+    return setup, run
+
+
+def ping_bench(calls):
+    def setup():
+        return None
+
+    def run(_):
+        cli = client(OKSocket())
+        for _ in range(calls):
+            cli.ping()
+        return cli, calls
+    return setup, run
+
+
+def benchmarks(scale):
+    songs = int(100000 * scale)
+    queue = int(30000 * scale)
+    picture = int(8 * 2**20 * scale) // 256 * 256
+    commands = int(20000 * scale)
+    calls = int(100000 * scale)
+    return [
+        Benchmark(f'listallinfo_{songs}', 'B', *listallinfo_bench(songs, False)),
+        Benchmark(f'listallinfo_{songs}_bulk', 'B', *listallinfo_bench(songs, True)),
+        Benchmark(f'playlistinfo_{queue}', 'B', *playlistinfo_bench(queue)),
+        Benchmark(f'albumart_{picture}', 'B', *albumart_bench(picture)),
+        Benchmark(f'command_batch_addid_{commands}', 'cmd',
+                  *command_list_bench(commands, 1000)),
+        Benchmark(f'ping_{calls}', 'cmd', *ping_bench(calls)),
+    ]
+
+
+def measure(bench, repeat):
+    data = bench.setup()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cli, units = bench.run(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    bench.run(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': best,
+        'unit': bench.unit,
+        'units': units,
+        'throughput': units / best,
+        'peak_memory': peak,
+        'recv_calls': cli._sock.recv_calls,
+        'write_calls': cli._wfile.write_calls,
+        'bytes_written': cli._wfile.written,
+    }
+
+
+def human(value, unit):
+    if unit == 'B':
+        return f'{value / 2**20:8.1f} MiB/s'
+    return f'{value:10,.0f} {unit}/s'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='size of the synthetic data (1.0 is 100k songs)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='run benchmarks whose name contains ONLY')
+    parser.add_argument('--json', help='write results to JSON')
+    parser.add_argument('--compare', help='compare with results from JSON')
+    args = parser.parse_args()
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fd:
+            previous = json.load(fd)['results']
+    results = {}
+    print(f'{"benchmark":<32} {"time":>9} {"throughput":>14} {"peak mem":>10} '
+          f'{"recv":>7} {"write":>7}')
+    for bench in benchmarks(args.scale):
+        if args.only and args.only not in bench.name:
+            continue
+        res = results[bench.name] = measure(bench, args.repeat)
+        line = (f'{bench.name:<32} {res["seconds"]:8.3f}s '
+                f'{human(res["throughput"], res["unit"]):>14} '
+                f'{res["peak_memory"] / 2**20:6.1f} MiB '
+                f'{res["recv_calls"]:7} {res["write_calls"]:7}')
+        if bench.name in previous:
+            ratio = previous[bench.name]['seconds'] / res['seconds']
+            line += f'  x{ratio:.2f}'
+        print(line)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fd:
+            json.dump({'musicpd': musicpd.VERSION,
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                       'argv': sys.argv[1:],
+                       'results': results}, fd, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: 2025  kaliko <kaliko@azylum.org>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+"""Synthetic MPD responses and canned sockets shared by the benchmarks"""
+import io
+import pathlib
+import sys
+
+sys.path.insert(0, pathlib.Path(__file__).absolute().parents[1].as_posix())
+import musicpd
+
+
+class FakeSocket:
+    """Socket sending a canned response, counts recv_into calls"""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+        self.recv_calls = 0
+
+    def recv_into(self, buffer, *args):
+        self.recv_calls += 1
+        return self.stream.readinto(buffer)
+
+
+class OKSocket:
+    """Socket answering OK to every command"""
+
+    def __init__(self):
+        self.recv_calls = 0
+
+    def recv_into(self, buffer, *args):
+        self.recv_calls += 1
+        data = b'OK\n' * (len(buffer) // 3)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class NullFile:
+    """Write file discarding data, counts write calls and bytes"""
+
+    def __init__(self):
+        self.write_calls = 0
+        self.written = 0
+
+    def write(self, data):
+        self.write_calls += 1
+        self.written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def client(sock, **attrs):
+    """MPDClient reading from sock, writing to a NullFile"""
+    cli = musicpd.MPDClient()
+    cli._sock = sock
+    cli._rfile = musicpd._SocketReader(sock)
+    cli._wfile = NullFile()
+    for name, value in attrs.items():
+        setattr(cli, name, value)
+    return cli
+
+
+def song_lines(idx, queue=False):
+    album = idx // 12
+    lines = [
+        f'file: Artist {album // 5}/Album {album}/{idx % 12:02d}-Track {idx}.flac',
+        'Last-Modified: 2024-03-01T10:00:00Z',
+        'Format: 44100:16:2',
+        f'Artist: Artist {album // 5}',
+        f'AlbumArtist: Artist {album // 5}',
+        f'Title: Track {idx}',
+        f'Album: Album {album}',
+        f'Track: {idx % 12 + 1}',
+        'Date: 2001',
+        f'Genre: Genre {album % 20}',
+        f'Time: {200 + idx % 100}',
+        f'duration: {200 + idx % 100}.123',
+    ]
+    if queue:
+        lines += [f'Pos: {idx}', f'Id: {idx + 1}']
+    return lines
+
+
+def listallinfo(songs):
+    """Synthetic listallinfo response, returns (bytes, lines count)"""
+    lines = []
+    for idx in range(songs):
+        album = idx // 12
+        if idx % 12 == 0:
+            lines.append(f'directory: Artist {album // 5}/Album {album}')
+            lines.append('Last-Modified: 2024-03-01T10:00:00Z')
+        lines.extend(song_lines(idx))
+    data = '\n'.join(lines).encode('utf-8') + b'\nOK\n'
+    return data, len(lines)
+
+
+def playlistinfo(songs):
+    """Synthetic playlistinfo response, returns (bytes, lines count)"""
+    lines = []
+    for idx in range(songs):
+        lines.extend(song_lines(idx, queue=True))
+    data = '\n'.join(lines).encode('utf-8') + b'\nOK\n'
+    return data, len(lines)
+
+
+def albumart(size, chunk=8192):
+    """Synthetic albumart responses to successive offsets, returns bytes"""
+    picture = bytes(range(256)) * (size // 256)
+    responses = []
+    for offset in range(0, len(picture), chunk):
+        part = picture[offset:offset + chunk]
+        responses += [f'size: {len(picture)}\nbinary: {len(part)}\n'.encode(),
+                      part, b'\nOK\n']
+    return b''.join(responses)
+
+
+def command_list_responses(commands, per_list):
+    """Responses to commands addid sent by command lists of per_list
+    commands, returns bytes"""
+    responses = []
+    for idx in range(commands):
+        responses.append(f'Id: {idx + 1}\nlist_OK\n'.encode())
+        if idx % per_list == per_list - 1 or idx == commands - 1:
+            responses.append(b'OK\n')
+    return b''.join(responses)
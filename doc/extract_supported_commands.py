@@ -7,13 +7,14 @@ import sys
 sys.path.insert(0,pathlib.Path('.').absolute().as_posix())
 import musicpd
 
-START = 'self._commands = {'
+START = '    _commands = {'
 END = '}'
 LATEST_PROTOCOL = 'https://mpd.readthedocs.io/en/latest/protocol.html'
 TYPE_MAPPING = {
         'fetch_nothing': 'None',
         'fetch_object': 'dict',
         'fetch_list': 'list',
+        'fetch_idle': 'list',
         'fetch_item': 'str',
         'fetch_playlist': 'list',
         'fetch_songs': 'list[dict]',
@@ -42,10 +43,10 @@ def find_start(fd):
 
 def main():
     with open('musicpd.py', 'r', encoding='utf-8') as fd:
-        # fast forward to find self._commands
+        # fast forward to find MPDClient._commands
         find_start(fd)
         cmd_patt = '"(?P<command>.*)":'
-        cmd_patt = r'"(?P<command>.*?)": +self\._(?P<obj>.+?),'
+        cmd_patt = r'"(?P<command>.*?)": +_(?P<obj>.+?),'
         tit_patt = '# (?P<title>[^#]+?) ?# ?(?P<anchor>.+?)$'
         cmd_regex = re.compile(cmd_patt)
         tit_regex = re.compile(tit_patt)
@@ -0,0 +1,44 @@
+"""Monitors several MPD servers from a single thread
+"""
+import logging
+
+import musicpd
+
+HOSTS = ['mpd1.example.org', 'mpd2.example.org', 'mpd3.example.org']
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)-8s %(message)s')
+log = logging.getLogger(__name__)
+
+
+def player_changed(client, subsystem):
+    # The client is out of idle here, commands run directly
+    song = client.currentsong()
+    log.info('%s: %s %s', client.host, subsystem, song.get('title', song.get('file')))
+
+
+def mixer_changed(client, subsystem):
+    log.info('%s: volume %s', client.host, client.getvol().get('volume'))
+
+
+def reconnect(client, err):
+    log.warning('%s: %s, reconnecting', client.host, err)
+    try:
+        client.connect()
+    except musicpd.ConnectionError as conn_err:
+        log.error('%s: %s', client.host, conn_err)
+        return
+    dispatcher.register(client, CALLBACKS)
+
+
+CALLBACKS = {'player': player_changed, 'mixer': mixer_changed}
+dispatcher = musicpd.IdleDispatcher(on_error=reconnect)
+for host in HOSTS:
+    cli = musicpd.MPDClient()
+    cli.connect(host)
+    dispatcher.register(cli, CALLBACKS)
+    # Runs a command between two idles
+    dispatcher.call(cli, lambda client: log.info('%s: %s', client.host, client.status()))
+try:
+    dispatcher.run()
+except KeyboardInterrupt:
+    dispatcher.close()
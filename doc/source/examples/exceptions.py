@@ -33,10 +33,10 @@ class MyClient(musicpd.MPDClient):
         super().__init__()
 
     @wrapext
-    def __getattr__(self, cmd):
+    def _execute(self, command, args):
         """Wrapper around MPDClient calls for abstract overriding"""
-        self.log.debug('cmd: %s', cmd)
-        return super().__getattr__(cmd)
+        self.log.debug('cmd: %s', command)
+        return super()._execute(command, args)
 
 
 if __name__ == '__main__':
@@ -8,10 +8,25 @@
 """Python Music Player Daemon client library"""
 
 
+import bisect
+import copy
+import errno
+import hashlib
 import logging
+import mmap
 import os
+import random
+import selectors
 import socket
-
+import struct
+import threading
+import time
+import types
+
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from functools import wraps
 
 HELLO_PREFIX = "OK MPD "
@@ -25,9 +40,121 @@ VERSION = '0.9.2'
 CONNECTION_TIMEOUT = 30
 #: Socket timeout in second > 0 (Default is :py:obj:`None` for no timeout)
 SOCKET_TIMEOUT = None
+#: Initial size in bytes of the receive buffer (grows as needed)
+READ_BUFFER_SIZE = 64 * 1024
+#: Default size in bytes of command lists sent by
+#: :py:obj:`MPDClient.command_batch` (MPD's ``max_command_list_size``
+#: defaults to 2 MiB)
+COMMAND_LIST_MAX_BYTES = 1024 * 1024
+#: Default number of songs fetched per request by :py:obj:`MPDClient.paginate`
+PAGE_SIZE = 1000
+#: Number of distinct tag values shared within a response before starting over
+INTERN_CACHE_SIZE = 2**16
+#: Seconds before starting a connection to the next address of a host while
+#: the previous attempts are still in progress (RFC 8305)
+CONNECTION_ATTEMPT_DELAY = 0.25
+#: Seconds resolved addresses of a host are kept, 0 disables the cache
+RESOLVER_CACHE_TTL = 30
 
 log = logging.getLogger(__name__)
 
+#: Resolved addresses, (host, port) -> (expiry time, getaddrinfo result)
+_RESOLVER_CACHE = {}
+_RESOLVER_LOCK = threading.Lock()
+
+#: Read-only commands cached by :py:attr:`MPDClient.cache_responses` with the
+#: idle subsystems invalidating them
+_CACHED_COMMANDS = {
+    'status': frozenset(['player', 'mixer', 'options', 'playlist', 'update',
+                         'output', 'partition']),
+    'stats': frozenset(['database', 'player', 'update']),
+    'currentsong': frozenset(['player', 'playlist']),
+    'replay_gain_status': frozenset(['options']),
+    'getvol': frozenset(['mixer']),
+    'outputs': frozenset(['output', 'partition']),
+    'playlistinfo': frozenset(['playlist']),
+    'listplaylists': frozenset(['stored_playlist']),
+    'listplaylist': frozenset(['stored_playlist']),
+    'listplaylistinfo': frozenset(['stored_playlist']),
+    'list': frozenset(['database']),
+    'count': frozenset(['database']),
+    'find': frozenset(['database']),
+    'search': frozenset(['database']),
+    'listall': frozenset(['database']),
+    'listallinfo': frozenset(['database']),
+    'listfiles': frozenset(['database']),
+    'lsinfo': frozenset(['database', 'stored_playlist']),
+    'sticker get': frozenset(['sticker']),
+    'sticker list': frozenset(['sticker']),
+    'listpartitions': frozenset(['partition']),
+}
+#: Commands leaving cached responses untouched
+_CACHE_NEUTRAL = frozenset(['ping', 'idle', 'noidle', 'albumart', 'readpicture'])
+#: Read-only commands retried after a reconnection (cf. MPDClient.reconnect)
+_IDEMPOTENT_COMMANDS = frozenset(_CACHED_COMMANDS) | frozenset([
+    'ping', 'albumart', 'readpicture', 'playlistid', 'playlistfind',
+    'playlistsearch', 'plchanges', 'plchangesposid', 'searchcount',
+    'getfingerprint', 'readcomments', 'sticker find', 'stickernames',
+    'commands', 'notcommands', 'urlhandlers', 'decoders', 'config',
+    'stickertypes', 'stickernamestypes', 'listmounts', 'listneighbors',
+    'channels', 'tagtypes', 'protocol', 'protocol available'])
+#: Commands setting the state of a connection, replayed after a
+#: reconnection in this order of categories
+_SESSION_ORDER = ('password', 'partition', 'binarylimit', 'tagtypes',
+                  'protocol', 'subscribe')
+
+
+def _resolve(host, port):
+    """getaddrinfo for a TCP connection, results are cached
+    :py:obj:`RESOLVER_CACHE_TTL` seconds"""
+    key = (host, str(port))
+    with _RESOLVER_LOCK:
+        cached = _RESOLVER_CACHE.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    try:
+        flags = socket.AI_ADDRCONFIG
+    except AttributeError:
+        flags = 0
+    try:
+        gai = socket.getaddrinfo(host, port, socket.AF_UNSPEC,
+                                 socket.SOCK_STREAM, socket.IPPROTO_TCP,
+                                 flags)
+    except socket.error as gaierr:
+        raise ConnectionError(gaierr) from gaierr
+    if RESOLVER_CACHE_TTL and gai:
+        with _RESOLVER_LOCK:
+            _RESOLVER_CACHE[key] = (time.monotonic() + RESOLVER_CACHE_TTL, gai)
+    return gai
+
+
+def _forget(host, port):
+    """Drops cached addresses of a host no longer reachable"""
+    with _RESOLVER_LOCK:
+        _RESOLVER_CACHE.pop((host, str(port)), None)
+
+
+def clear_resolver_cache():
+    """Drops all addresses cached by the TCP connections (cf.
+    :py:obj:`RESOLVER_CACHE_TTL`)"""
+    with _RESOLVER_LOCK:
+        _RESOLVER_CACHE.clear()
+
+
+def _interleave_families(gai):
+    """Orders getaddrinfo results alternating address families, starting
+    with the family of the first result (RFC 8305 section 4)"""
+    families = OrderedDict()
+    for res in gai:
+        families.setdefault(res[0], deque()).append(res)
+    queues = list(families.values())
+    ordered = deque()
+    while queues:
+        for queue in queues:
+            ordered.append(queue.popleft())
+        queues = [queue for queue in queues if queue]
+    return ordered
+
 
 def iterator_wrapper(func):
     """Decorator handling iterate option"""
@@ -90,32 +217,530 @@ class Range:
     def __repr__(self):
         return f'Range({self.tpl})'
 
-    def _check_element(self, item):
-        if item is None or item == '':
-            return ''
-        try:
-            return str(int(item))
-        except (TypeError, ValueError) as err:
-            raise CommandError(f'Not an integer: "{item}"') from err
-        return item
-
     def _check(self):
         if not isinstance(self.tpl, tuple):
             raise CommandError('Wrong type, provide a tuple')
-        if len(self.tpl) == 0:
-            return
-        if len(self.tpl) == 1:
-            self.lower = self._check_element(self.tpl[0])
-            return
-        if len(self.tpl) != 2:
-            raise CommandError('Range wrong size (0, 1 or 2 allowed)')
-        self.lower = self._check_element(self.tpl[0])
-        self.upper = self._check_element(self.tpl[1])
-        if self.lower == '' and self.upper != '':
-            raise CommandError(f'Integer expected to start the range: {self.tpl}')
-        if self.upper.isdigit() and self.lower.isdigit():
-            if int(self.lower) > int(self.upper):
-                raise CommandError(f'Wrong range: {self.lower} > {self.upper}')
+        self.lower, self.upper = _range_bounds(self.tpl)
+
+
+def _range_element(item):
+    if item is None or item == '':
+        return ''
+    try:
+        return str(int(item))
+    except (TypeError, ValueError) as err:
+        raise CommandError(f'Not an integer: "{item}"') from err
+
+
+def _range_bounds(tpl):
+    """Checks a range tuple, returns its (lower, upper) bounds as strings"""
+    if len(tpl) == 0:
+        return '', ''
+    if len(tpl) == 1:
+        return _range_element(tpl[0]), ''
+    if len(tpl) != 2:
+        raise CommandError('Range wrong size (0, 1 or 2 allowed)')
+    lower = _range_element(tpl[0])
+    upper = _range_element(tpl[1])
+    if lower == '' and upper != '':
+        raise CommandError(f'Integer expected to start the range: {tpl}')
+    if upper.isdigit() and lower.isdigit():
+        if int(lower) > int(upper):
+            raise CommandError(f'Wrong range: {lower} > {upper}')
+    return lower, upper
+
+
+#: Encoded lines of commands sent without arguments
+_ENCODED_COMMANDS = {}
+
+
+def _encode_command(command, args=None):
+    """Returns the command line as UTF-8 bytes, new line included"""
+    if not args:
+        line = _ENCODED_COMMANDS.get(command)
+        if line is None:
+            if '\n' in command:
+                raise CommandError('new line found in the command!')
+            line = f'{command}\n'.encode('utf-8', 'surrogateescape')
+            _ENCODED_COMMANDS[command] = line
+        return line
+    parts = [command]
+    for arg in args:
+        if isinstance(arg, tuple):
+            lower, upper = _range_bounds(arg)
+            parts.append(f'{lower}:{upper}')
+            continue
+        if not isinstance(arg, str):
+            arg = str(arg)
+        if '\n' in arg:
+            raise CommandError('new line found in the command!')
+        if '\\' in arg or '"' in arg:
+            arg = escape(arg)
+        parts.append(f'"{arg}"')
+    if '\n' in command:
+        raise CommandError('new line found in the command!')
+    return f"{' '.join(parts)}\n".encode('utf-8', 'surrogateescape')
+
+
+class _SocketReader:
+    """Single receive buffer reading MPD responses off a socket.
+
+    Data is received with :py:meth:`socket.socket.recv_into` in a reusable
+    :py:obj:`bytearray`, lines are decoded straight from the buffer and binary
+    payloads are copied once to their destination.
+    """
+
+    def __init__(self, sock, bufsize=READ_BUFFER_SIZE):
+        self._sock = sock
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        #: Start of unread data in the buffer
+        self._pos = 0
+        #: End of unread data in the buffer
+        self._end = 0
+
+    @property
+    def buffered(self):
+        """Amount of bytes received but not consumed yet"""
+        return self._end - self._pos
+
+    def _fill(self):
+        """Receives more data, returns the number of bytes received (0 on EOF)
+        """
+        if self._sock is None:
+            return 0
+        if self._pos == self._end:
+            self._pos = self._end = 0
+        elif self._end == len(self._buf):
+            size = self._end - self._pos
+            if self._pos:
+                # Move unread data to the start of the buffer
+                self._buf[:size] = self._buf[self._pos:self._end]
+            else:
+                # Buffer full with a single incomplete line, grow it
+                self._buf = self._buf + bytes(len(self._buf))
+                self._view = memoryview(self._buf)
+            self._pos, self._end = 0, size
+        received = self._sock.recv_into(self._view[self._end:])
+        self._end += received
+        return received
+
+    def readline(self):
+        """Returns next line as :py:obj:`str` without its trailing new line,
+        :py:obj:`None` if the connection is closed before a full line is
+        received."""
+        idx = self._buf.find(b'\n', self._pos, self._end)
+        while idx < 0:
+            scanned = self._end - self._pos
+            if not self._fill():
+                return None
+            idx = self._buf.find(b'\n', self._pos + scanned, self._end)
+        line = str(self._view[self._pos:idx], 'utf-8', 'surrogateescape')
+        self._pos = idx + 1
+        return line
+
+    def readinto(self, buffer):
+        """Reads exactly ``len(buffer)`` bytes into buffer, returns the number
+        of bytes actually read (less on EOF)."""
+        view = memoryview(buffer).cast('B')
+        amount = len(view)
+        got = min(amount, self._end - self._pos)
+        view[:got] = self._view[self._pos:self._pos + got]
+        self._pos += got
+        # Receive the remaining bytes straight into the destination
+        while got < amount:
+            received = self._sock.recv_into(view[got:])
+            if not received:
+                break
+            got += received
+        return got
+
+    def read(self, amount):
+        """Reads exactly amount bytes, returns :py:obj:`bytes` (shorter on
+        EOF)."""
+        if self._end - self._pos >= amount:
+            data = bytes(self._view[self._pos:self._pos + amount])
+            self._pos += amount
+            return data
+        data = bytearray(amount)
+        got = self.readinto(data)
+        return bytes(data[:got]) if got != amount else bytes(data)
+
+    def readblock(self, last):
+        """Reads a whole response up to the *last* line (:py:obj:`SUCCESS` or
+        :py:obj:`NEXT`) or an error line.
+
+        Returns a tuple (text, error), text is the response without its
+        terminating line, error is the error line stripped from
+        :py:obj:`ERROR_PREFIX` or :py:obj:`None`. Returns :py:obj:`None` if the
+        connection is closed before the end of the response."""
+        last = last.encode()
+        error = ERROR_PREFIX.encode()
+        end_mark = b'\n' + last + b'\n'
+        err_mark = b'\n' + error
+        # The response might be limited to its last line
+        idx = self._buf.find(b'\n', self._pos, self._end)
+        while idx < 0:
+            scanned = self._end - self._pos
+            if not self._fill():
+                return None
+            idx = self._buf.find(b'\n', self._pos + scanned, self._end)
+        first = self._view[self._pos:idx]
+        if first == last:
+            self._pos = idx + 1
+            return '', None
+        if first[:len(error)] == error:
+            line = str(first[len(error):], 'utf-8', 'surrogateescape')
+            self._pos = idx + 1
+            return '', line.strip()
+        # Offset, relative to self._pos, to start looking for the end marks
+        scanned = idx - self._pos
+        while True:
+            end = self._buf.find(end_mark, self._pos + scanned, self._end)
+            err = self._buf.find(err_mark, self._pos + scanned, self._end)
+            if err >= 0 and (end < 0 or err < end):
+                eol = self._buf.find(b'\n', err + 1, self._end)
+                if eol >= 0:
+                    text = str(self._view[self._pos:err], 'utf-8', 'surrogateescape')
+                    line = str(self._view[err + len(err_mark):eol], 'utf-8', 'surrogateescape')
+                    self._pos = eol + 1
+                    return text, line.strip()
+                scanned = err - self._pos
+            elif end >= 0:
+                text = str(self._view[self._pos:end], 'utf-8', 'surrogateescape')
+                self._pos = end + len(end_mark)
+                return text, None
+            else:
+                # Marks might be split across two receptions
+                scanned = max(scanned, self._end - self._pos
+                              - max(len(end_mark), len(err_mark)))
+            if not self._fill():
+                return None
+
+    def feed(self, data):
+        """Appends data received by other means to the buffer"""
+        size = self._end - self._pos
+        if len(self._buf) - self._end < len(data):
+            buf = bytearray(max(len(self._buf), size + len(data)))
+            buf[:size] = self._view[self._pos:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+            self._pos, self._end = 0, size
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def close(self):
+        self._sock = None
+        self._pos = self._end = 0
+
+
+class _MeteredReader(_SocketReader):
+    """Receive buffer counting bytes and lines read, takes over the state of
+    an existing reader"""
+
+    def __init__(self, reader):  # pylint: disable=super-init-not-called
+        vars(self).update(vars(reader))
+        self.received = 0
+        self.lines = 0
+        #: time.perf_counter() of the first reception, reset by the client
+        self.first = None
+
+    def _fill(self):
+        received = super()._fill()
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.received += received
+        return received
+
+    def readinto(self, buffer):
+        buffered = self.buffered
+        got = super().readinto(buffer)
+        self.received += max(0, got - buffered)
+        return got
+
+    def readline(self):
+        line = super().readline()
+        if line is not None:
+            self.lines += 1
+        return line
+
+    def readblock(self, last):
+        block = super().readblock(last)
+        if block is not None:
+            # Text lines plus the terminating line
+            self.lines += block[0].count('\n') + 1 + bool(block[0])
+        return block
+
+
+class _MeteredWriter:
+    """File like object counting bytes written to another one"""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self.sent = 0
+
+    def write(self, data):
+        self.sent += len(data)
+        return self._wfile.write(data)
+
+    def __getattr__(self, attr):
+        return getattr(self._wfile, attr)
+
+
+class _RecordingSocket:
+    """Socket proxy recording data received to a :py:obj:`TraceRecorder`"""
+
+    def __init__(self, sock, recorder):
+        self._sock = sock
+        self._recorder = recorder
+
+    def recv_into(self, buffer, nbytes=0):
+        received = self._sock.recv_into(buffer, nbytes)
+        if received:
+            self._recorder.record(b'R', memoryview(buffer).cast('B')[:received])
+        return received
+
+    def __getattr__(self, attr):
+        return getattr(self._sock, attr)
+
+
+class _RecordingWriter:
+    """File like object recording data written to a :py:obj:`TraceRecorder`"""
+
+    def __init__(self, wfile, recorder):
+        self._wfile = wfile
+        self._recorder = recorder
+
+    def write(self, data):
+        self._recorder.record(b'W', data)
+        return self._wfile.write(data)
+
+    def __getattr__(self, attr):
+        return getattr(self._wfile, attr)
+
+
+class SongRecord(MutableMapping):
+    """Compact record for songs, directories and playlists entries.
+
+    Most common tags are stored in slots, others in an overflow dictionary.
+    It behaves like the :py:obj:`dict` it replaces (same lower case keys as
+    in the protocol, ie. ``record['last-modified']``), common tags are also
+    available as attributes (``record.artist``).
+
+    >>> cli.record_factory = musicpd.SongRecord
+    >>> cli.listallinfo()
+    """
+    #: Tags stored in slots, protocol key -> attribute name
+    _tags = {tag: tag.replace('-', '_') for tag in (
+        'file', 'directory', 'playlist', 'last-modified', 'added', 'format',
+        'duration', 'time', 'pos', 'id', 'prio', 'cpos',
+        'artist', 'albumartist', 'title', 'album', 'track', 'disc', 'date',
+        'originaldate', 'genre', 'composer', 'performer', 'label',
+        'musicbrainz_trackid', 'musicbrainz_albumid',
+        'musicbrainz_artistid', 'musicbrainz_albumartistid')}
+    __slots__ = tuple(_tags.values()) + ('_extra',)
+
+    def __init__(self, obj=None):
+        self._extra = None
+        if obj:
+            for key, value in obj.items():
+                self[key] = value
+
+    def __getitem__(self, key):
+        attr = self._tags.get(key)
+        if attr is not None:
+            try:
+                return getattr(self, attr)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        attr = self._tags.get(key)
+        if attr is not None:
+            setattr(self, attr, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        attr = self._tags.get(key)
+        if attr is not None:
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __iter__(self):
+        for key, attr in self._tags.items():
+            if hasattr(self, attr):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __copy__(self):
+        return self.__class__(self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self.items())})'
+
+
+#: Keys as sent by MPD -> lower case keys shared by all parsed objects
+_KEYS = {key: key.lower() for key in (
+    # Songs, directories and playlists
+    'file', 'directory', 'playlist', 'Last-Modified', 'Added', 'Format',
+    'Time', 'duration', 'Range', 'Pos', 'Id', 'Prio', 'cpos',
+    # Tags
+    'Artist', 'ArtistSort', 'Album', 'AlbumSort', 'AlbumArtist',
+    'AlbumArtistSort', 'Title', 'TitleSort', 'Track', 'Name', 'Genre',
+    'Mood', 'Date', 'OriginalDate', 'Composer', 'ComposerSort', 'Performer',
+    'Conductor', 'Work', 'Ensemble', 'Movement', 'MovementNumber',
+    'ShowMovement', 'Location', 'Grouping', 'Comment', 'Disc', 'Label',
+    'MUSICBRAINZ_ARTISTID', 'MUSICBRAINZ_ALBUMID',
+    'MUSICBRAINZ_ALBUMARTISTID', 'MUSICBRAINZ_TRACKID',
+    'MUSICBRAINZ_RELEASETRACKID', 'MUSICBRAINZ_WORKID',
+    'MUSICBRAINZ_RELEASEGROUPID',
+    # Status
+    'volume', 'repeat', 'random', 'single', 'consume', 'partition',
+    'playlistlength', 'mixrampdb', 'state', 'song', 'songid', 'nextsong',
+    'nextsongid', 'time', 'elapsed', 'bitrate', 'audio', 'xfade',
+    'updating_db', 'error', 'lastloadedplaylist',
+    # Outputs
+    'outputid', 'outputname', 'plugin', 'outputenabled', 'attribute')}
+#: Tags whose values are shared within a response (cf. :py:obj:`INTERN_CACHE_SIZE`)
+_INTERNED_TAGS = frozenset((
+    'last-modified', 'added', 'format', 'artist', 'artistsort', 'album',
+    'albumsort', 'albumartist', 'albumartistsort', 'genre', 'mood', 'date',
+    'originaldate', 'composer', 'composersort', 'performer', 'conductor',
+    'ensemble', 'label', 'disc', 'musicbrainz_artistid',
+    'musicbrainz_albumid', 'musicbrainz_albumartistid',
+    'musicbrainz_releasegroupid'))
+
+
+def _copy_response(response):
+    """Copies a cached response so that callers can not alter it"""
+    if isinstance(response, list):
+        return [copy.copy(item) for item in response]
+    return copy.copy(response)
+
+
+def _parse_objects(lines, delimiters):
+    """Builds objects from a list of "key: value" lines, a new object starts
+    with a key in delimiters (cf. :py:meth:`MPDClient._read_objects`)."""
+    objs = []
+    obj = {}
+    interned = {}
+    for line in lines:
+        key, sep, value = line.partition(': ')
+        if not sep:
+            raise ProtocolError(f"Could not parse pair: '{line}'")
+        key = _KEYS.get(key) or key.lower()
+        if key in _INTERNED_TAGS:
+            value = interned.setdefault(value, value)
+        if obj:
+            if key in delimiters:
+                objs.append(obj)
+                obj = {}
+                if len(interned) > INTERN_CACHE_SIZE:
+                    interned.clear()
+            elif key in obj:
+                if not isinstance(obj[key], list):
+                    obj[key] = [obj[key], value]
+                else:
+                    obj[key].append(value)
+                continue
+        obj[key] = value
+    if obj:
+        objs.append(obj)
+    return objs
+
+
+#: Numeric columns: key -> (array typecode, sentinel for missing values)
+_NUMERIC_COLUMNS = {
+    'duration': ('d', float('nan')),
+    'time': ('l', -1),
+    'pos': ('l', -1),
+    'id': ('l', -1),
+    'prio': ('l', -1),
+    'cpos': ('l', -1),
+}
+
+
+def _parse_columns(lines, delimiters, tags=None):
+    """Builds per key columns from a list of "key: value" lines, a new row
+    starts with a key in delimiters (cf. :py:meth:`MPDClient.columns`)."""
+    columns = {}
+    interned = {}
+    row = -1
+    for line in lines:
+        key, sep, value = line.partition(': ')
+        if not sep:
+            raise ProtocolError(f"Could not parse pair: '{line}'")
+        key = _KEYS.get(key) or key.lower()
+        if row < 0:
+            row = 0
+        elif key in delimiters:
+            row += 1
+        if tags is not None and key not in tags:
+            continue
+        column = columns.get(key)
+        numeric = _NUMERIC_COLUMNS.get(key)
+        if column is None:
+            if numeric is None:
+                column = columns[key] = []
+            else:
+                column = columns[key] = array(numeric[0])
+        missing = row - len(column)
+        if missing < 0:
+            # Multiple values for the same key, numeric columns keep the first
+            if numeric is None:
+                if isinstance(column[row], list):
+                    column[row].append(value)
+                else:
+                    column[row] = [column[row], value]
+            continue
+        if numeric is None:
+            if missing:
+                column.extend([None] * missing)
+            if key in _INTERNED_TAGS:
+                value = interned.setdefault(value, value)
+            column.append(value)
+        else:
+            if missing:
+                column.extend([numeric[1]] * missing)
+            try:
+                column.append(int(value) if numeric[0] == 'l' else float(value))
+            except ValueError:
+                column.append(numeric[1])
+    # Pad columns with missing values for the last rows
+    for key, column in columns.items():
+        missing = row + 1 - len(column)
+        if missing:
+            sentinel = _NUMERIC_COLUMNS[key][1] if key in _NUMERIC_COLUMNS else None
+            column.extend([sentinel] * missing)
+    return columns
+
+
+class _CommandTable(dict):
+    """Commands table of a client class, parsers set as bound methods (as
+    with the former per instance table) are stored as plain functions"""
+
+    def __setitem__(self, command, retval):
+        super().__setitem__(command, getattr(retval, '__func__', retval))
+
+    def update(self, *args, **kwargs):
+        for command, retval in dict(*args, **kwargs).items():
+            self[command] = retval
 
 
 class _NotConnected:
@@ -173,7 +798,35 @@ class MPDClient:
     """
 
     def __init__(self):
+        #: Commands returning several objects return iterators instead of
+        #: lists
         self.iterate = False
+        #: Read whole responses at once before parsing objects (faster for
+        #: large listings at the cost of holding the raw response in memory)
+        self.bulk = False
+        #: Callable building songs, directories and playlists entries from
+        #: the parsed :py:obj:`dict` (use :py:obj:`SongRecord` for compact
+        #: records), :py:obj:`None` to keep plain :py:obj:`dict`
+        self.record_factory = None
+        #: Keep read-only commands responses (``status``, ``stats``,
+        #: ``lsinfo``…) until an ``idle`` response or a command from this
+        #: client invalidates them
+        self.cache_responses = False
+        #: Callable receiving a :py:obj:`CommandSample` for each command
+        #: executed (cf. :py:obj:`CommandMetrics`), :py:obj:`None` disables
+        #: instrumentation
+        self.instrument = None
+        #: :py:obj:`TraceRecorder` recording the connections made by the
+        #: client, :py:obj:`None` to disable recording
+        self.recorder = None
+        #: :py:obj:`Backoff` policy to reconnect on connection loss,
+        #: restoring the session state and retrying read-only commands
+        #: (responses are then read whole, :py:attr:`iterate` is ignored),
+        #: :py:obj:`None` disables reconnection
+        self.reconnect = None
+        #: Session state commands (password, partition…) to replay on
+        #: reconnection, category -> list of (command, args)
+        self._session = {}
         #: Socket timeout value in seconds
         self._socket_timeout = SOCKET_TIMEOUT
         #: Current connection timeout value, defaults to
@@ -184,149 +837,6 @@ class MPDClient:
 
         .. note:: This is the version of the protocol spoken, not the real version of the daemon."""
         self._reset()
-        self._commands = {
-            # Querying MPD’s status # querying-mpd-s-status
-            "clearerror":         self._fetch_nothing,
-            "currentsong":        self._fetch_object,
-            "idle":               self._fetch_list,
-            #"noidle":             None,
-            "status":             self._fetch_object,
-            "stats":              self._fetch_object,
-            # Playback Option # playback-options
-            "consume":            self._fetch_nothing,
-            "crossfade":          self._fetch_nothing,
-            "mixrampdb":          self._fetch_nothing,
-            "mixrampdelay":       self._fetch_nothing,
-            "random":             self._fetch_nothing,
-            "repeat":             self._fetch_nothing,
-            "setvol":             self._fetch_nothing,
-            "getvol":             self._fetch_object,
-            "single":             self._fetch_nothing,
-            "replay_gain_mode":   self._fetch_nothing,
-            "replay_gain_status": self._fetch_item,
-            "volume":             self._fetch_nothing,
-            # Controlling playback # controlling-playback
-            "next":               self._fetch_nothing,
-            "pause":              self._fetch_nothing,
-            "play":               self._fetch_nothing,
-            "playid":             self._fetch_nothing,
-            "previous":           self._fetch_nothing,
-            "seek":               self._fetch_nothing,
-            "seekid":             self._fetch_nothing,
-            "seekcur":            self._fetch_nothing,
-            "stop":               self._fetch_nothing,
-            # The Queue # the-queue
-            "add":                self._fetch_nothing,
-            "addid":              self._fetch_item,
-            "clear":              self._fetch_nothing,
-            "delete":             self._fetch_nothing,
-            "deleteid":           self._fetch_nothing,
-            "move":               self._fetch_nothing,
-            "moveid":             self._fetch_nothing,
-            "playlist":           self._fetch_playlist,
-            "playlistfind":       self._fetch_songs,
-            "playlistid":         self._fetch_songs,
-            "playlistinfo":       self._fetch_songs,
-            "playlistsearch":     self._fetch_songs,
-            "plchanges":          self._fetch_songs,
-            "plchangesposid":     self._fetch_changes,
-            "prio":               self._fetch_nothing,
-            "prioid":             self._fetch_nothing,
-            "rangeid":            self._fetch_nothing,
-            "shuffle":            self._fetch_nothing,
-            "swap":               self._fetch_nothing,
-            "swapid":             self._fetch_nothing,
-            "addtagid":           self._fetch_nothing,
-            "cleartagid":         self._fetch_nothing,
-            # Stored playlists # stored-playlists
-            "listplaylist":       self._fetch_list,
-            "listplaylistinfo":   self._fetch_songs,
-            "searchplaylist":     self._fetch_songs,
-            "listplaylists":      self._fetch_playlists,
-            "load":               self._fetch_nothing,
-            "playlistadd":        self._fetch_nothing,
-            "playlistclear":      self._fetch_nothing,
-            "playlistdelete":     self._fetch_nothing,
-            "playlistlength":     self._fetch_object,
-            "playlistmove":       self._fetch_nothing,
-            "rename":             self._fetch_nothing,
-            "rm":                 self._fetch_nothing,
-            "save":               self._fetch_nothing,
-            # The music database # the-music-database
-            "albumart":           self._fetch_composite,
-            "count":              self._fetch_object,
-            "getfingerprint":     self._fetch_object,
-            "find":               self._fetch_songs,
-            "findadd":            self._fetch_nothing,
-            "list":               self._fetch_list,
-            "listall":            self._fetch_database,
-            "listallinfo":        self._fetch_database,
-            "listfiles":          self._fetch_database,
-            "lsinfo":             self._fetch_database,
-            "readcomments":       self._fetch_object,
-            "readpicture":        self._fetch_composite,
-            "search":             self._fetch_songs,
-            "searchadd":          self._fetch_nothing,
-            "searchaddpl":        self._fetch_nothing,
-            "searchcount":        self._fetch_object,
-            "update":             self._fetch_item,
-            "rescan":             self._fetch_item,
-            # Mounts and neighbors # mounts-and-neighbors
-            "mount":              self._fetch_nothing,
-            "unmount":            self._fetch_nothing,
-            "listmounts":         self._fetch_mounts,
-            "listneighbors":      self._fetch_neighbors,
-            # Stickers # stickers
-            "sticker get":        self._fetch_item,
-            "sticker set":        self._fetch_nothing,
-            "sticker delete":     self._fetch_nothing,
-            "sticker list":       self._fetch_list,
-            "sticker find":       self._fetch_songs,
-            "stickernames":       self._fetch_list,
-            "stickertypes":       self._fetch_list,
-            "stickernamestypes":  self._fetch_list,
-            # Connection settings # connection-settings
-            "close":              None,
-            "kill":               None,
-            "password":           self._fetch_nothing,
-            "ping":               self._fetch_nothing,
-            "binarylimit":        self._fetch_nothing,
-            "tagtypes":           self._fetch_list,
-            "tagtypes disable":   self._fetch_nothing,
-            "tagtypes enable":    self._fetch_nothing,
-            "tagtypes clear":     self._fetch_nothing,
-            "tagtypes all":       self._fetch_nothing,
-            "protocol":           self._fetch_list,
-            "protocol disable":   self._fetch_nothing,
-            "protocol enable":    self._fetch_nothing,
-            "protocol clear":     self._fetch_nothing,
-            "protocol all":       self._fetch_nothing,
-            "protocol available": self._fetch_list,
-            # Partition Commands # partition-commands
-            "partition":          self._fetch_nothing,
-            "listpartitions":     self._fetch_list,
-            "newpartition":       self._fetch_nothing,
-            "delpartition":       self._fetch_nothing,
-            "moveoutput":         self._fetch_nothing,
-            # Audio output devices # audio-output-devices
-            "disableoutput":      self._fetch_nothing,
-            "enableoutput":       self._fetch_nothing,
-            "toggleoutput":       self._fetch_nothing,
-            "outputs":            self._fetch_outputs,
-            "outputset":          self._fetch_nothing,
-            # Reflection # reflection
-            "config":             self._fetch_object,
-            "commands":           self._fetch_list,
-            "notcommands":        self._fetch_list,
-            "urlhandlers":        self._fetch_list,
-            "decoders":           self._fetch_plugins,
-            # Client to Client # client-to-client
-            "subscribe":          self._fetch_nothing,
-            "unsubscribe":        self._fetch_nothing,
-            "channels":           self._fetch_list,
-            "readmessages":       self._fetch_messages,
-            "sendmessage":        self._fetch_nothing,
-        }
         #: host used with the current connection (:py:obj:`str`)
         self.host = None
         #: password detected in :envvar:`MPD_HOST` environment variable (:py:obj:`str`)
@@ -376,18 +886,23 @@ class MPDClient:
         else:  # Use CONNECTION_TIMEOUT as default even if MPD_TIMEOUT carries gargage
             self.mpd_timeout = CONNECTION_TIMEOUT
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Picks up parsers overridden by the subclass
+        cls._commands = _CommandTable(
+            (command, getattr(cls, retval.__name__) if retval else None)
+            for command, retval in cls._commands.items())
+        _add_command_methods(cls)
+
     def __getattr__(self, attr):
-        if attr == 'send_noidle':  # have send_noidle to cancel idle as well as noidle
-            return self.noidle
+        # Known commands are methods, only two words commands spelled with a
+        # space and commands added to _commands at runtime end up here
         if attr.startswith("send_"):
-            command = attr.replace("send_", "", 1)
-            wrapper = self._send
+            command, wrapper = attr[5:], self._send
         elif attr.startswith("fetch_"):
-            command = attr.replace("fetch_", "", 1)
-            wrapper = self._fetch
+            command, wrapper = attr[6:], self._fetch
         else:
-            command = attr
-            wrapper = self._execute
+            command, wrapper = attr, self._execute
         if command not in self._commands:
             command = command.replace("_", " ")
             if command not in self._commands:
@@ -399,10 +914,14 @@ class MPDClient:
         if self._command_list is not None:
             raise CommandListError("Cannot use send_%s in a command list" %
                                    command.replace(" ", "_"))
-        self._write_command(command, args)
         retval = self._commands[command]
+        sent = None
+        if self.instrument is not None and self._sock is not None:
+            sent = self._metered_write(command, args)
+        else:
+            self._write_command(command, args)
         if retval is not None:
-            self._pending.append(command)
+            self._pending.append((command, sent))
 
     def _fetch(self, command, args=None):  # pylint: disable=unused-argument
         cmd_fmt = command.replace(" ", "_")
@@ -412,12 +931,14 @@ class MPDClient:
             raise IteratingError(f"Cannot use fetch_{cmd_fmt} while iterating")
         if not self._pending:
             raise PendingCommandError("No pending commands to fetch")
-        if self._pending[0] != command:
+        if self._pending[0][0] != command:
             raise PendingCommandError(f"'{command}' is not the currently pending command")
-        del self._pending[0]
+        _, sent = self._pending.pop(0)
         retval = self._commands[command]
-        if callable(retval):
-            return retval()
+        if retval is not None:
+            if self.instrument is not None and sent is not None:
+                return self._metered_fetch(command, retval, sent)
+            return retval(self)
         return retval
 
     def _execute(self, command, args):  # pylint: disable=unused-argument
@@ -427,54 +948,294 @@ class MPDClient:
             raise PendingCommandError(f"Cannot execute '{command}' with pending commands")
         retval = self._commands[command]
         if self._command_list is not None:
-            if not callable(retval):
+            if retval is None:
                 raise CommandListError(f"'{command}' not allowed in command list")
             self._write_command(command, args)
             self._command_list.append(retval)
         else:
+            key = self._cache_key(command, args)
+            if key in self._cache:
+                return _copy_response(self._cache[key])
+            if self.reconnect is not None:
+                return self._cache_store(
+                    key, self._execute_resilient(command, args, retval))
+            if self.instrument is not None and self._sock is not None:
+                sent = self._metered_write(command, args)
+                if retval is not None:
+                    return self._cache_store(
+                        key, self._metered_fetch(command, retval, sent))
+                return retval
             self._write_command(command, args)
-            if callable(retval):
-                return retval()
+            if retval is not None:
+                return self._cache_store(key, retval(self))
             return retval
         return None
 
+    def _execute_resilient(self, command, args, retval):
+        """Executes a command, reconnects if the connection is lost and
+        retries read-only commands. Responses are read whole (even with
+        :py:attr:`iterate` set) so that a connection lost while reading them
+        is caught here."""
+        delays = None
+        while True:
+            iterate, self.iterate = self.iterate, False
+            try:
+                if self._sock is None:
+                    raise ConnectionError("Not connected")
+                if self.instrument is not None:
+                    sent = self._metered_write(command, args)
+                    result = None
+                    if retval is not None:
+                        result = self._metered_fetch(command, retval, sent)
+                else:
+                    self._write_command(command, args)
+                    result = None if retval is None else retval(self)
+            except (ConnectionError, OSError) as err:
+                if isinstance(err, socket.timeout):
+                    raise
+                if self._sock is not None:
+                    self.disconnect()
+                if delays is None:
+                    delays = self.reconnect.delays()
+                log.debug("'%s' failed (%s), reconnecting", command, err)
+                self._reconnect(delays)
+                if command not in _IDEMPOTENT_COMMANDS:
+                    raise
+                continue
+            finally:
+                self.iterate = iterate
+            self._session_store(command, args)
+            return result
+
+    def _session_store(self, command, args):
+        """Keeps commands setting the session state"""
+        category, _, sub = command.partition(' ')
+        if category not in _SESSION_ORDER and category != 'unsubscribe':
+            return
+        entry = (command, tuple(args))
+        if not sub and args and category in ('tagtypes', 'protocol'):
+            # tagtypes('clear') as well as tagtypes_clear()
+            sub = args[0]
+        if category in ('password', 'partition', 'binarylimit'):
+            self._session[category] = [entry]
+        elif category == 'subscribe':
+            channels = self._session.setdefault('subscribe', [])
+            if entry not in channels:
+                channels.append(entry)
+        elif category == 'unsubscribe':
+            channels = self._session.get('subscribe', [])
+            if ('subscribe', entry[1]) in channels:
+                channels.remove(('subscribe', entry[1]))
+        elif sub in ('clear', 'all'):
+            self._session[category] = [entry]
+        elif sub in ('enable', 'disable'):
+            self._session.setdefault(category, []).append(entry)
+
+    def _reconnect(self, delays):
+        """Connects again and replays the session state, waiting for the
+        delays between attempts"""
+        session = self._session
+        error = None
+        for delay in delays:
+            time.sleep(delay)
+            try:
+                self.connect(self.host, self.port)
+                # Listing responses (tagtypes, protocol) are read right away
+                iterate, self.iterate = self.iterate, False
+                try:
+                    for category in _SESSION_ORDER:
+                        for command, args in session.get(category, []):
+                            self._write_command(command, args)
+                            self._commands[command](self)
+                            self._session_store(command, args)
+                finally:
+                    self.iterate = iterate
+            except (ConnectionError, OSError) as err:
+                error = err
+                if self._sock is not None:
+                    self.disconnect()
+                continue
+            log.debug('Reconnected to %s:%s', self.host, self.port)
+            return
+        self._session = session
+        raise ConnectionError(f"Could not reconnect: {error}")
+
+    def _meters(self):
+        """Returns the metered reader and writer of the connection"""
+        if not isinstance(self._rfile, _MeteredReader):
+            self._rfile = _MeteredReader(self._rfile)
+            self._wfile = _MeteredWriter(self._wfile)
+        return self._rfile, self._wfile
+
+    def _metered_write(self, command, args):
+        """Sends a command, returns the time it took and bytes sent"""
+        writer = self._meters()[1]
+        sent = writer.sent
+        start = time.perf_counter()
+        self._write_command(command, args)
+        return time.perf_counter() - start, writer.sent - sent
+
+    def _metered_fetch(self, command, retval, sent):
+        """Reads a response with retval, reports a :py:obj:`CommandSample`
+        to :py:attr:`instrument`"""
+        reader = self._meters()[0]
+        sample = CommandSample(command, *sent)
+        received, lines = reader.received, reader.lines
+        # Waiting ends with the first reception, unless the response is
+        # already buffered
+        waiting = not reader.buffered
+        reader.first = None
+        start = time.perf_counter()
+
+        def report(error=None):
+            end = time.perf_counter()
+            if waiting and reader.first is not None:
+                sample.wait = reader.first - start
+            sample.parse = end - start - sample.wait
+            sample.bytes_in = reader.received - received
+            sample.lines = reader.lines - lines
+            sample.error = error
+            self.instrument(sample)
+
+        try:
+            result = retval(self)
+        except MPDError as err:
+            report(err)
+            raise
+        if isinstance(result, types.GeneratorType):
+            return self._metered_iterator(result, sample, report)
+        if isinstance(result, (list, tuple)):
+            sample.objects = len(result)
+        elif result is not None:
+            sample.objects = 1 if result or not isinstance(result, dict) else 0
+        report()
+        return result
+
+    @staticmethod
+    def _metered_iterator(result, sample, report):
+        error = None
+        try:
+            for item in result:
+                sample.objects += 1
+                yield item
+        except MPDError as err:
+            error = err
+            raise
+        finally:
+            report(error)
+
+    def _cache_key(self, command, args):
+        """Returns the cache key for a command, None if it is not cached"""
+        if (not self.cache_responses or self.iterate
+                or command not in _CACHED_COMMANDS):
+            return None
+        key = (command, tuple(args))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _cache_store(self, key, response):
+        if key is None:
+            return response
+        self._cache[key] = response
+        return _copy_response(response)
+
+    def _cache_invalidate(self, subsystem):
+        for key in [key for key in self._cache
+                    if subsystem in _CACHED_COMMANDS[key[0]]]:
+            del self._cache[key]
+
+    def clear_cache(self):
+        """Drops responses kept by :py:attr:`cache_responses`"""
+        self._cache.clear()
+
+    def _check_ready(self, feature):
+        """Raises unless feature (columns, cover, command_batch) can run
+        right away: connected, out of command list, not iterating nor waiting
+        for responses"""
+        if self._sock is None:
+            raise ConnectionError("Not connected")
+        if self._command_list is not None:
+            raise CommandListError(f"Cannot use {feature} in a command list")
+        if self._iterating:
+            raise IteratingError(f"Cannot use {feature} while iterating")
+        if self._pending:
+            raise PendingCommandError(f"Cannot use {feature} with pending commands")
+
+    def columns(self, command, *args, tags=None):
+        """Executes a command returning songs or database entries (ie.
+        ``listallinfo``, ``playlistinfo``, ``find``, ``plchanges``…) and
+        returns the response as columns instead of a list of objects.
+
+        :param str command: MPD command, followed by its arguments
+        :param tags: keys to keep (lower case), defaults to all keys
+        :type tags: list or None
+        :return: a :py:obj:`dict` of columns of equal length, one row per
+          object. ``duration`` column is an :py:obj:`array.array` of floats,
+          ``time``, ``pos``, ``id``, ``prio`` and ``cpos`` arrays of integers,
+          others are lists of :py:obj:`str` (or :py:obj:`list` for
+          multivalued tags). Missing values are NaN, -1 or :py:obj:`None`.
+
+        >>> cols = cli.columns('listallinfo', tags=['file', 'duration'])
+        >>> total = sum(d for d in cols['duration'] if d == d)
+        """
+        command, delimiters = self._columns_command(command)
+        self._write_command(command, args)
+        if tags is not None:
+            tags = set(tags)
+        return _parse_columns(self._read_block(), delimiters, tags)
+
+    def _columns_command(self, command):
+        """Checks command can be used with columns, returns the command and
+        its objects delimiters"""
+        if command not in self._commands:
+            command = command.replace("_", " ")
+        retval = self._commands.get(command)
+        delimiters = {
+            '_fetch_songs': ["file"],
+            '_fetch_changes': ["cpos"],
+            '_fetch_database': ["file", "directory", "playlist"],
+        }.get(getattr(retval, '__name__', None))
+        if delimiters is None:
+            raise CommandError(f"'{command}' does not return songs")
+        self._check_ready('columns')
+        return command, delimiters
+
     def _write_line(self, line):
-        self._wfile.write(f"{line!s}\n")
+        """Sends an encoded command line"""
+        if self._command_list is not None:
+            # Sent at once by _flush_command_list
+            self._command_list_lines.append(line)
+            return
+        self._wfile.write(line)
+        self._wfile.flush()
+
+    def _flush_command_list(self):
+        lines, self._command_list_lines = self._command_list_lines, []
+        self._wfile.write(b''.join(lines))
         self._wfile.flush()
 
     def _write_command(self, command, args=None):
-        if args is None:
-            args = []
-        parts = [command]
-        for arg in args:
-            if isinstance(arg, tuple):
-                parts.append(f'{Range(arg)!s}')
-            else:
-                parts.append(f'"{escape(str(arg))}"')
-        if '\n' in ' '.join(parts):
-            raise CommandError('new line found in the command!')
-        self._write_line(" ".join(parts))
+        if (self._cache and command not in _CACHED_COMMANDS
+                and command not in _CACHE_NEUTRAL):
+            # Changes made by this client are notified on the next idle
+            self._cache.clear()
+        self._write_line(_encode_command(command, args))
 
     def _read_binary(self, amount):
-        chunk = bytearray()
-        while amount > 0:
-            result = self._rbfile.read(amount)
-            if len(result) == 0:
-                self.disconnect()
-                raise ConnectionError("Connection lost while reading binary content")
-            chunk.extend(result)
-            amount -= len(result)
-        return bytes(chunk)
+        chunk = self._rfile.read(amount)
+        if len(chunk) != amount:
+            self.disconnect()
+            raise ConnectionError("Connection lost while reading binary content")
+        return chunk
 
-    def _read_line(self, binary=False):
-        if binary:
-            line = self._rbfile.readline().decode('utf-8')
-        else:
-            line = self._rfile.readline()
-        if not line.endswith("\n"):
+    def _read_line(self):
+        line = self._rfile.readline()
+        if line is None:
             self.disconnect()
             raise ConnectionError("Connection lost while reading line")
-        line = line.rstrip("\n")
         if line.startswith(ERROR_PREFIX):
             error = line[len(ERROR_PREFIX):].strip()
             raise CommandError(error)
@@ -487,8 +1248,21 @@ class MPDClient:
             return None
         return line
 
-    def _read_pair(self, separator, binary=False):
-        line = self._read_line(binary=binary)
+    def _read_block(self):
+        last = NEXT if self._command_list is not None else SUCCESS
+        block = self._rfile.readblock(last)
+        if block is None:
+            self.disconnect()
+            raise ConnectionError("Connection lost while reading response")
+        text, error = block
+        if error is not None:
+            raise CommandError(error)
+        if not text:
+            return []
+        return text.split('\n')
+
+    def _read_pair(self, separator):
+        line = self._read_line()
         if line is None:
             return None
         pair = line.split(separator, 1)
@@ -496,11 +1270,11 @@ class MPDClient:
             raise ProtocolError(f"Could not parse pair: '{line}'")
         return pair
 
-    def _read_pairs(self, separator=": ", binary=False):
-        pair = self._read_pair(separator, binary=binary)
+    def _read_pairs(self, separator=": "):
+        pair = self._read_pair(separator)
         while pair:
             yield pair
-            pair = self._read_pair(separator, binary=binary)
+            pair = self._read_pair(separator)
 
     def _read_list(self):
         seen = None
@@ -517,14 +1291,19 @@ class MPDClient:
 
     def _read_objects(self, delimiters=None):
         obj = {}
+        interned = {}
         if delimiters is None:
             delimiters = []
         for key, value in self._read_pairs():
-            key = key.lower()
+            key = _KEYS.get(key) or key.lower()
+            if key in _INTERNED_TAGS:
+                value = interned.setdefault(value, value)
             if obj:
                 if key in delimiters:
                     yield obj
                     obj = {}
+                    if len(interned) > INTERN_CACHE_SIZE:
+                        interned.clear()
                 elif key in obj:
                     if not isinstance(obj[key], list):
                         obj[key] = [obj[key], value]
@@ -538,7 +1317,7 @@ class MPDClient:
     def _read_command_list(self):
         try:
             for retval in self._command_list:
-                yield retval()
+                yield retval(self)
         finally:
             self._command_list = None
         self._fetch_nothing()
@@ -558,6 +1337,12 @@ class MPDClient:
     def _fetch_list(self):
         return self._read_list()
 
+    @iterator_wrapper
+    def _fetch_idle(self):
+        for subsystem in self._read_list():
+            self._cache_invalidate(subsystem)
+            yield subsystem
+
     @iterator_wrapper
     def _fetch_playlist(self):
         return self._read_playlist()
@@ -569,20 +1354,27 @@ class MPDClient:
         return objs[0]
 
     @iterator_wrapper
-    def _fetch_objects(self, delimiters):
-        return self._read_objects(delimiters)
+    def _fetch_objects(self, delimiters, factory=None):
+        if self.bulk:
+            objs = iter(_parse_objects(self._read_block(), delimiters))
+        else:
+            objs = self._read_objects(delimiters)
+        if factory is not None:
+            return map(factory, objs)
+        return objs
 
     def _fetch_changes(self):
-        return self._fetch_objects(["cpos"])
+        return self._fetch_objects(["cpos"], self.record_factory)
 
     def _fetch_songs(self):
-        return self._fetch_objects(["file"])
+        return self._fetch_objects(["file"], self.record_factory)
 
     def _fetch_playlists(self):
         return self._fetch_objects(["playlist"])
 
     def _fetch_database(self):
-        return self._fetch_objects(["file", "directory", "playlist"])
+        return self._fetch_objects(["file", "directory", "playlist"],
+                                   self.record_factory)
 
     def _fetch_outputs(self):
         return self._fetch_objects(["outputid"])
@@ -599,13 +1391,23 @@ class MPDClient:
     def _fetch_neighbors(self):
         return self._fetch_objects(["neighbor"])
 
-    def _fetch_composite(self):
+    def _read_composite_header(self):
         obj = {}
-        for key, value in self._read_pairs(binary=True):
+        for key, value in self._read_pairs():
             key = key.lower()
             obj[key] = value
             if key == 'binary':
                 break
+        return obj
+
+    def _read_composite_end(self):
+        # Fetches trailing new line
+        self._read_line()
+        # Fetches SUCCESS code
+        self._read_line()
+
+    def _fetch_composite(self):
+        obj = self._read_composite_header()
         if not obj:
             # If the song file was recognized, but there is no picture, the
             # response is successful, but is otherwise empty.
@@ -619,21 +1421,166 @@ class MPDClient:
         if data_bytes != amount:  # can we ever get there?
             raise ConnectionError('Error reading binary content: '
                     f'Expects {amount}B, got {data_bytes}')
-        # Fetches trailing new line
-        self._read_line(binary=True)
-        # Fetches SUCCESS code
-        self._read_line(binary=True)
+        self._read_composite_end()
         return obj
 
     @iterator_wrapper
     def _fetch_command_list(self):
         return self._read_command_list()
 
+    #: MPD commands and the method parsing their response (:py:obj:`None` for
+    #: commands closing the connection), commands methods are generated from
+    #: this table once the class is defined (cf. :py:func:`_add_command_methods`),
+    #: commands added later are resolved by :py:meth:`__getattr__`. The table
+    #: is shared by all instances of the class.
+    _commands = {
+        # Querying MPD’s status # querying-mpd-s-status
+        "clearerror":         _fetch_nothing,
+        "currentsong":        _fetch_object,
+        "idle":               _fetch_idle,
+        #"noidle":             None,
+        "status":             _fetch_object,
+        "stats":              _fetch_object,
+        # Playback Option # playback-options
+        "consume":            _fetch_nothing,
+        "crossfade":          _fetch_nothing,
+        "mixrampdb":          _fetch_nothing,
+        "mixrampdelay":       _fetch_nothing,
+        "random":             _fetch_nothing,
+        "repeat":             _fetch_nothing,
+        "setvol":             _fetch_nothing,
+        "getvol":             _fetch_object,
+        "single":             _fetch_nothing,
+        "replay_gain_mode":   _fetch_nothing,
+        "replay_gain_status": _fetch_item,
+        "volume":             _fetch_nothing,
+        # Controlling playback # controlling-playback
+        "next":               _fetch_nothing,
+        "pause":              _fetch_nothing,
+        "play":               _fetch_nothing,
+        "playid":             _fetch_nothing,
+        "previous":           _fetch_nothing,
+        "seek":               _fetch_nothing,
+        "seekid":             _fetch_nothing,
+        "seekcur":            _fetch_nothing,
+        "stop":               _fetch_nothing,
+        # The Queue # the-queue
+        "add":                _fetch_nothing,
+        "addid":              _fetch_item,
+        "clear":              _fetch_nothing,
+        "delete":             _fetch_nothing,
+        "deleteid":           _fetch_nothing,
+        "move":               _fetch_nothing,
+        "moveid":             _fetch_nothing,
+        "playlist":           _fetch_playlist,
+        "playlistfind":       _fetch_songs,
+        "playlistid":         _fetch_songs,
+        "playlistinfo":       _fetch_songs,
+        "playlistsearch":     _fetch_songs,
+        "plchanges":          _fetch_songs,
+        "plchangesposid":     _fetch_changes,
+        "prio":               _fetch_nothing,
+        "prioid":             _fetch_nothing,
+        "rangeid":            _fetch_nothing,
+        "shuffle":            _fetch_nothing,
+        "swap":               _fetch_nothing,
+        "swapid":             _fetch_nothing,
+        "addtagid":           _fetch_nothing,
+        "cleartagid":         _fetch_nothing,
+        # Stored playlists # stored-playlists
+        "listplaylist":       _fetch_list,
+        "listplaylistinfo":   _fetch_songs,
+        "searchplaylist":     _fetch_songs,
+        "listplaylists":      _fetch_playlists,
+        "load":               _fetch_nothing,
+        "playlistadd":        _fetch_nothing,
+        "playlistclear":      _fetch_nothing,
+        "playlistdelete":     _fetch_nothing,
+        "playlistlength":     _fetch_object,
+        "playlistmove":       _fetch_nothing,
+        "rename":             _fetch_nothing,
+        "rm":                 _fetch_nothing,
+        "save":               _fetch_nothing,
+        # The music database # the-music-database
+        "albumart":           _fetch_composite,
+        "count":              _fetch_object,
+        "getfingerprint":     _fetch_object,
+        "find":               _fetch_songs,
+        "findadd":            _fetch_nothing,
+        "list":               _fetch_list,
+        "listall":            _fetch_database,
+        "listallinfo":        _fetch_database,
+        "listfiles":          _fetch_database,
+        "lsinfo":             _fetch_database,
+        "readcomments":       _fetch_object,
+        "readpicture":        _fetch_composite,
+        "search":             _fetch_songs,
+        "searchadd":          _fetch_nothing,
+        "searchaddpl":        _fetch_nothing,
+        "searchcount":        _fetch_object,
+        "update":             _fetch_item,
+        "rescan":             _fetch_item,
+        # Mounts and neighbors # mounts-and-neighbors
+        "mount":              _fetch_nothing,
+        "unmount":            _fetch_nothing,
+        "listmounts":         _fetch_mounts,
+        "listneighbors":      _fetch_neighbors,
+        # Stickers # stickers
+        "sticker get":        _fetch_item,
+        "sticker set":        _fetch_nothing,
+        "sticker delete":     _fetch_nothing,
+        "sticker list":       _fetch_list,
+        "sticker find":       _fetch_songs,
+        "stickernames":       _fetch_list,
+        "stickertypes":       _fetch_list,
+        "stickernamestypes":  _fetch_list,
+        # Connection settings # connection-settings
+        "close":              None,
+        "kill":               None,
+        "password":           _fetch_nothing,
+        "ping":               _fetch_nothing,
+        "binarylimit":        _fetch_nothing,
+        "tagtypes":           _fetch_list,
+        "tagtypes disable":   _fetch_nothing,
+        "tagtypes enable":    _fetch_nothing,
+        "tagtypes clear":     _fetch_nothing,
+        "tagtypes all":       _fetch_nothing,
+        "protocol":           _fetch_list,
+        "protocol disable":   _fetch_nothing,
+        "protocol enable":    _fetch_nothing,
+        "protocol clear":     _fetch_nothing,
+        "protocol all":       _fetch_nothing,
+        "protocol available": _fetch_list,
+        # Partition Commands # partition-commands
+        "partition":          _fetch_nothing,
+        "listpartitions":     _fetch_list,
+        "newpartition":       _fetch_nothing,
+        "delpartition":       _fetch_nothing,
+        "moveoutput":         _fetch_nothing,
+        # Audio output devices # audio-output-devices
+        "disableoutput":      _fetch_nothing,
+        "enableoutput":       _fetch_nothing,
+        "toggleoutput":       _fetch_nothing,
+        "outputs":            _fetch_outputs,
+        "outputset":          _fetch_nothing,
+        # Reflection # reflection
+        "config":             _fetch_object,
+        "commands":           _fetch_list,
+        "notcommands":        _fetch_list,
+        "urlhandlers":        _fetch_list,
+        "decoders":           _fetch_plugins,
+        # Client to Client # client-to-client
+        "subscribe":          _fetch_nothing,
+        "unsubscribe":        _fetch_nothing,
+        "channels":           _fetch_list,
+        "readmessages":       _fetch_messages,
+        "sendmessage":        _fetch_nothing,
+    }
+
     def _hello(self):
         line = self._rfile.readline()
-        if not line.endswith("\n"):
+        if line is None:
             raise ConnectionError("Connection lost while reading MPD hello")
-        line = line.rstrip("\n")
         if not line.startswith(HELLO_PREFIX):
             raise ProtocolError(f"Got invalid MPD hello: '{line}'")
         self.mpd_version = line[len(HELLO_PREFIX):].strip()
@@ -641,11 +1588,15 @@ class MPDClient:
     def _reset(self):
         self.mpd_version = ''
         self._iterating = False
+        #: Commands sent with send_<cmd>, with the send time and bytes when
+        #: instrumented, as (command, sent)
         self._pending = []
         self._command_list = None
+        self._command_list_lines = []
+        #: Responses kept by cache_responses
+        self._cache = {}
         self._sock = None
         self._rfile = _NotConnected()
-        self._rbfile = _NotConnected()
         self._wfile = _NotConnected()
 
     def _connect_unix(self, path):
@@ -664,17 +1615,14 @@ class MPDClient:
         return sock
 
     def _connect_tcp(self, host, port):
-        try:
-            flags = socket.AI_ADDRCONFIG
-        except AttributeError:
-            flags = 0
+        gai = _resolve(host, port)
+        if len(gai) > 1:
+            try:
+                return self._connect_staggered(gai)
+            except ConnectionError:
+                _forget(host, port)
+                raise
         err = None
-        try:
-            gai = socket.getaddrinfo(host, port, socket.AF_UNSPEC,
-                                     socket.SOCK_STREAM, socket.IPPROTO_TCP,
-                                     flags)
-        except socket.error as gaierr:
-            raise ConnectionError(gaierr) from gaierr
         for res in gai:
             af, socktype, proto, _, sa = res
             sock = None
@@ -690,17 +1638,89 @@ class MPDClient:
                 err = socket_err
                 if sock is not None:
                     sock.close()
+        _forget(host, port)
         if err is not None:
             raise ConnectionError(err)
         raise ConnectionError("getaddrinfo returns an empty list")
 
+    def _connect_staggered(self, gai):
+        """Happy Eyeballs (RFC 8305): connects addresses of alternating
+        families in parallel, starting a new attempt every
+        :py:obj:`CONNECTION_ATTEMPT_DELAY` or as soon as one fails, returns
+        the first socket connected"""
+        addresses = _interleave_families(gai)
+        deadline = None
+        if self.mpd_timeout is not None:
+            deadline = time.monotonic() + self.mpd_timeout
+        in_progress = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN,
+                       10035)  # WSAEWOULDBLOCK
+        selector = selectors.DefaultSelector()
+        next_attempt = 0
+        err = None
+        winner = None
+        try:
+            while addresses or selector.get_map():
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    err = socket.timeout('timed out')
+                    break
+                if addresses and (not selector.get_map() or now >= next_attempt):
+                    af, socktype, proto, _, sa = addresses.popleft()
+                    log.debug('opening socket %s', sa)
+                    sock = None
+                    try:
+                        sock = socket.socket(af, socktype, proto)
+                        sock.setblocking(False)
+                        code = sock.connect_ex(sa)
+                        if code not in in_progress:
+                            raise OSError(code, os.strerror(code))
+                    except OSError as exc:
+                        # Unsupported family, unreachable network, etc.
+                        err = exc
+                        log.debug('opening socket %s failed: %s', sa, err)
+                        if sock is not None:
+                            sock.close()
+                        continue
+                    selector.register(sock, selectors.EVENT_WRITE, sa)
+                    next_attempt = now + CONNECTION_ATTEMPT_DELAY
+                    continue
+                timeouts = [deadline - now] if deadline is not None else []
+                if addresses:
+                    timeouts.append(next_attempt - now)
+                for key, _ in selector.select(min(timeouts) if timeouts else None):
+                    sock = key.fileobj
+                    selector.unregister(sock)
+                    code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if not code:
+                        winner = sock
+                        log.debug('connected socket %s', key.data)
+                        winner.settimeout(self.socket_timeout)
+                        return winner
+                    err = OSError(code, os.strerror(code))
+                    log.debug('opening socket %s failed: %s', key.data, err)
+                    sock.close()
+                    # Next address is tried right away
+                    next_attempt = now
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+        raise ConnectionError(err)
+
+    def _connect_socket(self, host, port):
+        if host[0] in ['/', '@']:
+            log.debug('Connecting unix socket %s', host)
+            return self._connect_unix(host)
+        log.debug('Connecting tcp socket %s:%s (timeout: %ss)', host, port, self.mpd_timeout)
+        return self._connect_tcp(host, port)
+
     def noidle(self):
         # noidle's special case
-        if not self._pending or self._pending[0] != 'idle':
+        if not self._pending or self._pending[0][0] != 'idle':
             raise CommandError('cannot send noidle if send_idle was not called')
         del self._pending[0]
         self._write_command("noidle")
-        return self._fetch_list()
+        return self._fetch_idle()
 
     def connect(self, host=None, port=None):
         """Connects the MPD server
@@ -729,20 +1749,18 @@ class MPDClient:
             self.port = port
         if self._sock is not None:
             raise ConnectionError("Already connected")
-        if host[0] in ['/', '@']:
-            log.debug('Connecting unix socket %s', host)
-            self._sock = self._connect_unix(host)
-        else:
-            log.debug('Connecting tcp socket %s:%s (timeout: %ss)', host, port, self.mpd_timeout)
-            self._sock = self._connect_tcp(host, port)
-        self._rfile = self._sock.makefile("r", encoding='utf-8', errors='surrogateescape')
-        self._rbfile = self._sock.makefile("rb")
-        self._wfile = self._sock.makefile("w", encoding='utf-8')
+        self._sock = self._connect_socket(host, port)
+        sock, wfile = self._sock, self._sock.makefile("wb")
+        if self.recorder is not None:
+            sock, wfile = self.recorder._attach(sock, wfile, host, port)
+        self._rfile = _SocketReader(sock)
+        self._wfile = wfile
         try:
             self._hello()
         except:
             self.disconnect()
             raise
+        self._session = {}
         log.debug('Connected')
 
     @property
@@ -774,8 +1792,6 @@ class MPDClient:
         """
         if hasattr(self._rfile, 'close'):
             self._rfile.close()
-        if hasattr(self._rbfile, 'close'):
-            self._rbfile.close()
         if hasattr(self._wfile, 'close'):
             self._wfile.close()
         if hasattr(self._sock, 'close'):
@@ -804,17 +1820,1869 @@ class MPDClient:
             raise IteratingError("Cannot begin command list while iterating")
         if self._pending:
             raise PendingCommandError("Cannot begin command list with pending commands")
-        self._write_command("command_list_ok_begin")
         self._command_list = []
+        self._command_list_lines = []
+        self._write_command("command_list_ok_begin")
 
     def command_list_end(self):
+        if self._command_list is None:
+            raise CommandListError("Not in command list")
+        if self._iterating:
+            raise IteratingError("Already iterating over a command list")
+        if self.instrument is not None and self._sock is not None:
+            writer = self._meters()[1]
+            sent = writer.sent
+            start = time.perf_counter()
+            self._write_command("command_list_end")
+            self._flush_command_list()
+            return self._metered_fetch(
+                "command_list", type(self)._fetch_command_list,
+                (time.perf_counter() - start, writer.sent - sent))
+        self._write_command("command_list_end")
+        self._flush_command_list()
+        return self._fetch_command_list()
+
+    def _page_args(self, command, args, start, page_size):
+        """Returns command arguments to fetch a page"""
+        window = (start, start + page_size)
+        if command in ('find', 'search', 'playlistfind', 'playlistsearch'):
+            if 'window' in args:
+                raise CommandError(f"Cannot paginate '{command}' with a window argument")
+            return args + ('window', window)
+        if command == 'playlistinfo':
+            if args:
+                raise CommandError("Cannot paginate 'playlistinfo' with arguments")
+            return (window,)
+        if command in ('listplaylistinfo', 'plchanges'):
+            if len(args) != 1:
+                raise CommandError(f"'{command}' expects a single argument to paginate")
+            return args + (window,)
+        if command == 'searchplaylist':
+            if len(args) != 2:
+                raise CommandError("'searchplaylist' expects two arguments to paginate")
+            return args + (window,)
+        raise CommandError(f"Cannot paginate '{command}'")
+
+    def paginate(self, command, *args, page_size=PAGE_SIZE):
+        """Generator fetching songs by pages of *page_size* songs, using the
+        window or range argument of the command. It is available for
+        ``find``, ``search``, ``playlistfind``, ``playlistsearch``,
+        ``playlistinfo``, ``listplaylistinfo``, ``plchanges`` and
+        ``searchplaylist``.
+
+        The client is free to run other commands between pages, the results
+        might be inconsistent if the database or queue changes meanwhile.
+
+        >>> for song in cli.paginate('search', '(artist contains "the")', page_size=500):
+        ...     print(song['file'])
+        """
+        start = 0
+        while True:
+            iterate, self.iterate = self.iterate, False
+            try:
+                page = self._execute(command, self._page_args(command, args,
+                                                              start, page_size))
+            finally:
+                self.iterate = iterate
+            yield from page
+            if len(page) < page_size:
+                break
+            start += page_size
+
+    def _cover_responses(self, uri, command, pipeline, receive):
+        """Requests a whole picture by chunks, keeping up to pipeline requests
+        in flight.
+
+        receive(header, offset, amount) is called to read each chunk payload,
+        its return values are yielded."""
+        if command not in ('albumart', 'readpicture'):
+            raise CommandError(f"'{command}' does not return a picture")
+        self._check_ready('cover')
+        in_flight = deque([0])
+        #: Payload left unread by the consumer
+        unread = 0
+        self._iterating = True
+        try:
+            self._write_command(command, (uri, 0))
+            sent = chunk = size = None
+            while in_flight:
+                offset = in_flight.popleft()
+                header = self._read_composite_header()
+                if not header:
+                    # No picture (readpicture)
+                    return
+                amount = unread = int(header['binary'])
+                received = receive(header, offset, amount)
+                unread = 0
+                self._read_composite_end()
+                if size is None:
+                    size, chunk, sent = int(header['size']), amount, amount
+                elif amount != chunk and offset + amount < size:
+                    # Server chunk size changed (binarylimit), drop requests
+                    # in flight and resume right after this chunk
+                    while in_flight:
+                        self._skip_composite(in_flight.popleft())
+                    chunk, sent = amount, offset + amount
+                # Keeps requests in flight while the consumer handles the chunk
+                while amount and len(in_flight) < pipeline and sent < size:
+                    self._write_command(command, (uri, sent))
+                    in_flight.append(sent)
+                    sent += chunk
+                yield received
+        finally:
+            self._iterating = False
+            if self._sock is not None:
+                if unread:
+                    self._rfile.read(unread)
+                    self._read_composite_end()
+                while in_flight:
+                    self._skip_composite(in_flight.popleft())
+
+    def _skip_composite(self, offset):  # pylint: disable=unused-argument
+        try:
+            header = self._read_composite_header()
+        except CommandError:
+            return
+        if header:
+            self._rfile.read(int(header['binary']))
+            self._read_composite_end()
+
+    def cover(self, uri, sink=None, command='albumart', pipeline=4):
+        """Fetches a whole picture with ``albumart`` or ``readpicture``,
+        requesting up to *pipeline* chunks ahead.
+
+        :param str uri: song URI
+        :param sink: file like object to write the picture to, or a writable
+          buffer (:py:obj:`bytearray`, :py:obj:`mmap.mmap`…) of at least the
+          picture size to read it into
+        :param str command: ``albumart`` or ``readpicture``
+        :param int pipeline: number of chunk requests in flight
+        :return: the response header (``size``, ``type`` for
+          ``readpicture``), with the picture as a :py:obj:`bytearray` in
+          ``data`` when no sink is provided. An empty :py:obj:`dict` when
+          ``readpicture`` found no picture.
+
+        >>> with open('/tmp/cover', 'wb') as cover:
+        ...     cli.cover('Steve Reich/1978-Music for 18 Musicians', cover)
+        """
+        result = {}
+        view = buffer = None
+
+        def receive(header, offset, amount):
+            nonlocal view, buffer, result
+            if not result:
+                result = {key: value for key, value in header.items()
+                          if key != 'binary'}
+                size = int(header['size'])
+                if sink is None:
+                    result['data'] = bytearray(size)
+                    view = memoryview(result['data'])
+                else:
+                    try:
+                        view = memoryview(sink).cast('B')
+                    except TypeError:
+                        buffer = memoryview(bytearray(amount))
+                    else:
+                        if len(view) < size:
+                            raise ValueError(f'Buffer too small for a {size}B picture')
+            if view is not None:
+                target = view[offset:offset + amount]
+            else:
+                if amount > len(buffer):
+                    buffer = memoryview(bytearray(amount))
+                target = buffer[:amount]
+            if self._rfile.readinto(target) != amount:
+                self.disconnect()
+                raise ConnectionError("Connection lost while reading binary content")
+            if view is None:
+                sink.write(target)
+
+        for _ in self._cover_responses(uri, command, pipeline, receive):
+            pass
+        return result
+
+    def cover_chunks(self, uri, command='albumart', pipeline=4):
+        """Generator version of :py:obj:`cover`, yields the picture chunks
+        (:py:obj:`bytes`) as they are received. The client can not be used
+        until the generator is exhausted or closed."""
+        yield from self._cover_responses(uri, command, pipeline,
+                                         lambda header, offset, amount:
+                                         self._read_binary(amount))
+
+    def _batch_chunks(self, commands, max_bytes, max_commands):
+        """Splits commands in command lists, yields a tuple (lines, retvals)
+        for each command list"""
+        self._check_ready('command_batch')
+        overhead = len(_encode_command('command_list_ok_begin')
+                       + _encode_command('command_list_end'))
+        lines, retvals, size = [], [], overhead
+        for command, *args in commands:
+            name = command if command in self._commands else command.replace('_', ' ')
+            retval = self._commands.get(name)
+            if not callable(retval):
+                raise CommandListError(f"'{command}' not allowed in command list")
+            if (self._cache and name not in _CACHED_COMMANDS
+                    and name not in _CACHE_NEUTRAL):
+                self._cache.clear()
+            line = _encode_command(name, args)
+            length = len(line)
+            if retvals and (size + length > max_bytes
+                            or max_commands and len(retvals) >= max_commands):
+                yield lines, retvals
+                lines, retvals, size = [], [], overhead
+            lines.append(line)
+            retvals.append(retval)
+            size += length
+        if retvals:
+            yield lines, retvals
+
+    def _send_batch(self, lines):
+        self._command_list_lines = [_encode_command('command_list_ok_begin'), *lines,
+                                    _encode_command('command_list_end')]
+        self._flush_command_list()
+
+    def _read_batch(self, retvals):
+        self._command_list = retvals
+        iterate, self.iterate = self.iterate, False
+        try:
+            return list(self._read_command_list())
+        finally:
+            self.iterate = iterate
+
+    def command_batch(self, commands, max_bytes=COMMAND_LIST_MAX_BYTES,
+                      max_commands=None, pipeline=2):
+        """Executes a long list of commands as successive command lists
+        small enough for MPD's ``max_command_list_size``.
+
+        :param commands: iterable of commands as tuples
+          ``(command, arg1, arg2, …)``
+        :param int max_bytes: maximum size of a single command list
+        :param max_commands: maximum number of commands in a single command
+          list (defaults to no limit)
+        :type max_commands: int or None
+        :param int pipeline: number of command lists sent before reading
+          their results
+        :return: the list of results, in the commands order
+
+        On error MPD stops executing the failing command list and
+        :py:obj:`CommandError` is raised, with a *pipeline* greater than 1 the
+        command lists already sent after the failing one are still executed.
+
+        >>> cli.command_batch(('add', uri) for uri in uris)
+        >>> cli.command_batch([('sticker set', 'song', uri, 'rating', '5'),
+        ...                    ('sticker_delete', 'song', uri, 'played')])
+        """
+        results = []
+        in_flight = deque()
+        try:
+            for lines, retvals in self._batch_chunks(commands, max_bytes, max_commands):
+                self._send_batch(lines)
+                in_flight.append(retvals)
+                if len(in_flight) >= pipeline:
+                    results.extend(self._read_batch(in_flight.popleft()))
+            while in_flight:
+                results.extend(self._read_batch(in_flight.popleft()))
+        finally:
+            # Responses to command lists already sent are read anyway
+            while in_flight:
+                try:
+                    self._read_batch(in_flight.popleft())
+                except MPDError:
+                    pass
+        return results
+
+
+def _add_command_methods(cls):
+    """Adds a method for each MPD command of cls._commands (with *send_* and
+    *fetch_* variants) unless cls already has one"""
+    def execute(command):
+        return lambda self, *args: self._execute(command, args)
+
+    def send(command):
+        return lambda self, *args: self._send(command, args)
+
+    def fetch(command):
+        return lambda self: self._fetch(command)
+
+    for command in cls._commands:
+        # Two words commands with a space are left to __getattr__
+        name = command.replace(' ', '_')
+        for attr, factory in ((name, execute), (f'send_{name}', send),
+                              (f'fetch_{name}', fetch)):
+            if not hasattr(cls, attr):
+                method = factory(command)
+                method.__name__ = method.__qualname__ = attr
+                method.__doc__ = f'MPD ``{command}`` command'
+                setattr(cls, attr, method)
+    if not hasattr(cls, 'send_noidle'):
+        # have send_noidle to cancel idle as well as noidle
+        cls.send_noidle = lambda self: self.noidle()
+
+
+MPDClient._commands = _CommandTable(MPDClient._commands)
+_add_command_methods(MPDClient)
+
+
+class _StreamWriterFile:
+    """File like object writing to an :py:obj:`asyncio.StreamWriter`"""
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def write(self, data):
+        self._writer.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._writer.close()
+
+
+class AsyncMPDClient(MPDClient):
+    """asyncio MPD client.
+
+    Commands are the same as :py:obj:`MPDClient` ones (with the same
+    *send_<CMD>* and *fetch_<CMD>* variants) but are coroutines. Responses are
+    read from the connection asynchronously then parsed with
+    :py:obj:`MPDClient` parsers.
+
+    >>> async def main():
+    ...     async with musicpd.AsyncMPDClient() as cli:
+    ...         print(await cli.status())
+    ...         async for changes in cli.idle_events('player'):
+    ...             print(changes, await cli.currentsong())
+    >>> asyncio.get_event_loop().run_until_complete(main())
+
+    A client must not run commands concurrently from several tasks, the only
+    exception is :py:obj:`AsyncMPDClient.noidle` which can interrupt an
+    ``idle`` command awaited by another task. A command cancelled (for
+    instance by :py:func:`asyncio.wait_for`) or a line longer than
+    :py:attr:`line_limit` while reading its response closes the connection.
+
+    :py:attr:`MPDClient.recorder` is supported, :py:attr:`MPDClient.instrument`
+    and :py:attr:`MPDClient.reconnect` are not (commands raise
+    :py:obj:`MPDError` when they are set).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._reader = None
+        #: Size limit for a single line of a response
+        self.line_limit = 2**20
+
+    def _reset(self):
+        super()._reset()
+        self._reader = None
+        #: An idle response is awaited
+        self._idling = False
+
+    async def _drain(self):
+        await self._wfile._writer.drain()
+
+    def _check_unsupported(self):
+        if self.instrument is not None or self.reconnect is not None:
+            raise MPDError("instrument and reconnect are not supported by "
+                           "AsyncMPDClient")
+
+    def _write_command(self, command, args=None):
+        self._check_unsupported()
+        super()._write_command(command, args)
+
+    def _feed(self, data):
+        if self.recorder is not None:
+            self.recorder.record(b'R', data)
+        self._rfile.feed(data)
+
+    async def _receive(self, retvals):
+        """Reads a whole response and feeds it to the parsers' buffer"""
+        import asyncio
+        binary = self._commands['albumart'] in retvals
+        data = bytearray()
+        try:
+            while True:
+                line = await self._reader.readuntil(b'\n')
+                data += line
+                if line == b'OK\n' or line.startswith(b'ACK '):
+                    break
+                if binary and line.startswith(b'binary: '):
+                    data += await self._reader.readexactly(int(line[8:]) + 1)
+        except asyncio.IncompleteReadError as err:
+            self.disconnect()
+            raise ConnectionError("Connection lost while reading response") from err
+        except (asyncio.CancelledError, asyncio.LimitOverrunError):
+            # The rest of the response is left unread, the connection is out
+            # of sync
+            self.disconnect()
+            raise
+        self._feed(data)
+
+    async def _send(self, command, args):
+        super()._send(command, args)
+        await self._drain()
+
+    async def _fetch(self, command, args=None):
+        if (self._command_list is None and not self._iterating
+                and self._pending and self._pending[0][0] == command):
+            self._idling = command == 'idle'
+            try:
+                await self._receive([self._commands[command]])
+            finally:
+                self._idling = False
+        # Checks are left to MPDClient._fetch
+        return super()._fetch(command, args)
+
+    async def _execute(self, command, args):
+        retval = self._commands[command]
+        if (self._iterating or self._pending or self._command_list is not None
+                or not callable(retval)):
+            # Queues command or raises
+            result = super()._execute(command, args)
+            await self._drain()
+            return result
+        key = self._cache_key(command, args)
+        if key in self._cache:
+            return _copy_response(self._cache[key])
+        self._write_command(command, args)
+        await self._drain()
+        self._idling = command == 'idle'
+        try:
+            await self._receive([retval])
+        finally:
+            self._idling = False
+        return self._cache_store(key, retval(self))
+
+    async def noidle(self):
+        """Cancels ``idle``, it can be awaited while another task awaits the
+        ``idle`` response, which then gets the changes"""
+        if self._idling:
+            # The idle response is going to be read by the task awaiting it
+            self._write_command("noidle")
+            await self._drain()
+            return None
+        if not self._pending or self._pending[0][0] != 'idle':
+            raise CommandError('cannot send noidle if send_idle was not called')
+        del self._pending[0]
+        self._write_command("noidle")
+        await self._drain()
+        await self._receive([self._commands['idle']])
+        return self._fetch_idle()
+
+    async def idle_events(self, *subsystems):
+        """Asynchronous iterator over idle events, yields the list of
+        subsystems which changed.
+
+        :param str subsystems: subsystems to wait for (defaults to all)
+        """
+        while True:
+            yield await self.idle(*subsystems)
+
+    async def columns(self, command, *args, tags=None):
+        """Coroutine version of :py:obj:`MPDClient.columns`"""
+        command, delimiters = self._columns_command(command)
+        self._write_command(command, args)
+        await self._drain()
+        await self._receive([])
+        if tags is not None:
+            tags = set(tags)
+        return _parse_columns(self._read_block(), delimiters, tags)
+
+    async def connect(self, host=None, port=None):
+        """Connects the MPD server, cf. :py:obj:`MPDClient.connect`"""
+        import asyncio
+        if not host:
+            host = self.host
+        else:
+            self.host = host
+        if not port:
+            port = self.port
+        else:
+            self.port = port
+        if self._sock is not None:
+            raise ConnectionError("Already connected")
+        self._check_unsupported()
+        # Connecting is left to MPDClient in the default executor
+        loop = asyncio.get_event_loop()
+        sock = await loop.run_in_executor(None, self._connect_socket, host, port)
+        try:
+            self._reader, writer = await asyncio.open_connection(
+                sock=sock, limit=self.line_limit)
+        except OSError as err:
+            sock.close()
+            raise ConnectionError(err) from err
+        self._sock = writer
+        self._rfile = _SocketReader(None)
+        self._wfile = _StreamWriterFile(writer)
+        if self.recorder is not None:
+            self.recorder.record(b'C', f'{host}:{port}'.encode('utf-8', 'surrogateescape'))
+            self._wfile = _RecordingWriter(self._wfile, self.recorder)
+        try:
+            self._feed(await self._reader.readline())
+            self._hello()
+        except:
+            self.disconnect()
+            raise
+        log.debug('Connected')
+
+    def fileno(self):
+        if self._sock is None:
+            raise ConnectionError("Not connected")
+        return self._sock.get_extra_info('socket').fileno()
+
+    async def command_list_ok_begin(self):
+        super().command_list_ok_begin()
+
+    async def command_list_end(self):
         if self._command_list is None:
             raise CommandListError("Not in command list")
         if self._iterating:
             raise IteratingError("Already iterating over a command list")
         self._write_command("command_list_end")
+        self._flush_command_list()
+        await self._drain()
+        await self._receive(self._command_list)
         return self._fetch_command_list()
 
+    async def paginate(self, command, *args, page_size=PAGE_SIZE):
+        """Asynchronous generator version of :py:obj:`MPDClient.paginate`"""
+        start = 0
+        while True:
+            page = await self._execute(command, self._page_args(command, args,
+                                                                start, page_size))
+            for song in page:
+                yield song
+            if len(page) < page_size:
+                break
+            start += page_size
+
+    async def _cover_data(self, uri, command, pipeline):
+        """Yields (header, offset, data) for each chunk of a picture"""
+        if command not in ('albumart', 'readpicture'):
+            raise CommandError(f"'{command}' does not return a picture")
+        self._check_ready('cover')
+        header = await self._execute(command, (uri, 0))
+        if not header:
+            return
+        size, chunk = int(header['size']), len(header['data'])
+        offset = sent = chunk
+        in_flight = deque()
+        try:
+            yield header, 0, header['data']
+            while chunk and offset < size:
+                while len(in_flight) < pipeline and sent < size:
+                    await self._send(command, (uri, sent))
+                    in_flight.append(sent)
+                    sent += chunk
+                offset = in_flight.popleft()
+                response = await self._fetch(command)
+                data = response['data']
+                yield response, offset, data
+                if not data:
+                    break
+                if len(data) != chunk and offset + len(data) < size:
+                    while in_flight:
+                        in_flight.popleft()
+                        await self._fetch(command)
+                    chunk, sent = len(data), offset + len(data)
+                offset += len(data)
+        finally:
+            while in_flight and self._sock is not None:
+                in_flight.popleft()
+                try:
+                    await self._fetch(command)
+                except CommandError:
+                    pass
+
+    async def cover(self, uri, sink=None, command='albumart', pipeline=4):
+        """Coroutine version of :py:obj:`MPDClient.cover`"""
+        result = {}
+        view = None
+        async for header, offset, data in self._cover_data(uri, command, pipeline):
+            if not result:
+                result = {key: value for key, value in header.items()
+                          if key not in ('binary', 'data')}
+                size = int(header['size'])
+                if sink is None:
+                    result['data'] = bytearray(size)
+                    view = memoryview(result['data'])
+                else:
+                    try:
+                        view = memoryview(sink).cast('B')
+                    except TypeError:
+                        pass
+                    else:
+                        if len(view) < size:
+                            raise ValueError(f'Buffer too small for a {size}B picture')
+            if view is not None:
+                view[offset:offset + len(data)] = data
+            else:
+                sink.write(data)
+        return result
+
+    async def cover_chunks(self, uri, command='albumart', pipeline=4):
+        """Asynchronous generator version of :py:obj:`MPDClient.cover_chunks`"""
+        async for _, _, data in self._cover_data(uri, command, pipeline):
+            yield data
+
+    async def _read_batch(self, retvals):
+        await self._receive(retvals)
+        return super()._read_batch(retvals)
+
+    async def command_batch(self, commands, max_bytes=COMMAND_LIST_MAX_BYTES,
+                            max_commands=None, pipeline=2):
+        """Coroutine version of :py:obj:`MPDClient.command_batch`"""
+        results = []
+        in_flight = deque()
+        try:
+            for lines, retvals in self._batch_chunks(commands, max_bytes, max_commands):
+                self._send_batch(lines)
+                await self._drain()
+                in_flight.append(retvals)
+                if len(in_flight) >= pipeline:
+                    results.extend(await self._read_batch(in_flight.popleft()))
+            while in_flight:
+                results.extend(await self._read_batch(in_flight.popleft()))
+        finally:
+            while in_flight:
+                try:
+                    await self._read_batch(in_flight.popleft())
+                except MPDError:
+                    pass
+        return results
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, exception_traceback):
+        self.disconnect()
+
+
+class MPDClientPool:
+    """Thread safe pool of connected :py:obj:`MPDClient`.
+
+    :param str host: MPD host (defaults to :py:obj:`MPDClient` defaults)
+    :param port: MPD port (defaults to :py:obj:`MPDClient` defaults)
+    :param int size: maximum number of clients
+    :param keepalive: idle clients are pinged so that they never stay idle
+      longer than *keepalive* seconds (keep it below MPD's
+      ``connection_timeout``, 60s by default), :py:obj:`None` to disable
+    :type keepalive: int or None
+    :param setup: callable run with each newly connected client (to send
+      password, select tag types, partition, etc.)
+    :param client_class: class used to create clients
+
+    Clients are handed out exclusively, they are validated with ``ping``
+    before reuse. Clients released while a command is pending, iterating or
+    in a command list are discarded.
+
+    >>> pool = musicpd.MPDClientPool('mpdhost', size=8,
+    ...                              setup=lambda cli: cli.password('secret'))
+    >>> with pool.connection() as cli:
+    ...     cli.status()
+    """
+
+    def __init__(self, host=None, port=None, size=4, keepalive=30,
+                 setup=None, client_class=MPDClient):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.keepalive = keepalive
+        self.setup = setup
+        self.client_class = client_class
+        self._lock = threading.Condition()
+        #: Idle clients with the time they were released, most recent last
+        self._idle = deque()
+        #: Clients handed out or being connected
+        self._in_use = 0
+        self._closed = threading.Event()
+        self._stats = {'created': 0, 'discarded': 0, 'acquired': 0,
+                       'waits': 0, 'wait_time': 0.0, 'max_wait_time': 0.0}
+        self._keeper = None
+        if keepalive:
+            self._keeper = threading.Thread(target=self._keep_alive,
+                                            name='MPDClientPool keepalive',
+                                            daemon=True)
+            self._keeper.start()
+
+    def stats(self):
+        """Returns pool statistics as a :py:obj:`dict`: *size*, *in_use*,
+        *idle* clients count, *created*, *discarded* and *acquired* counters,
+        *waits* (acquisitions that had to wait), total and max *wait_time* in
+        seconds."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(size=self.size, in_use=self._in_use,
+                         idle=len(self._idle))
+        return stats
+
+    def _connect(self):
+        client = self.client_class()
+        client.connect(self.host, self.port)
+        try:
+            if self.setup is not None:
+                self.setup(client)
+        except:
+            client.disconnect()
+            raise
+        with self._lock:
+            self._stats['created'] += 1
+        return client
+
+    def _discard(self, client):
+        try:
+            client.disconnect()
+        except (MPDError, OSError):
+            pass
+        with self._lock:
+            self._stats['discarded'] += 1
+
+    def acquire(self, timeout=None):
+        """Returns a connected client for exclusive use, to be given back with
+        :py:obj:`release`.
+
+        :param timeout: seconds to wait for a client, :py:obj:`None` to wait
+          forever
+        :raises ConnectionError: when no client is available before timeout
+          or the pool is closed
+        """
+        start = time.monotonic()
+        client = None
+        waited = False
+        with self._lock:
+            while True:
+                if self._closed.is_set():
+                    raise ConnectionError("Pool closed")
+                if self._idle:
+                    client, _ = self._idle.pop()
+                    break
+                if self._in_use < self.size:
+                    break
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise ConnectionError("No client available in the pool")
+                self._lock.wait(remaining)
+                waited = True
+            self._in_use += 1
+            self._stats['acquired'] += 1
+            if waited:
+                wait_time = time.monotonic() - start
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += wait_time
+                self._stats['max_wait_time'] = max(wait_time, self._stats['max_wait_time'])
+        try:
+            if client is not None:
+                try:
+                    client.ping()
+                    return client
+                except (MPDError, OSError) as err:
+                    log.debug('discarding pooled client: %s', err)
+                    self._discard(client)
+            return self._connect()
+        except:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, client, discard=False):
+        """Gives back a client acquired with :py:obj:`acquire`.
+
+        :param bool discard: disconnects the client instead of reusing it
+        """
+        discard = (discard or self._closed.is_set() or client._sock is None
+                   or bool(client._pending) or client._iterating
+                   or client._command_list is not None)
+        if discard:
+            self._discard(client)
+        with self._lock:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append((client, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager acquiring and releasing a client. The client is
+        discarded on connection or protocol errors.
+        """
+        client = self.acquire(timeout)
+        try:
+            yield client
+        except (ConnectionError, ProtocolError, OSError):
+            self.release(client, discard=True)
+            raise
+        except BaseException:
+            self.release(client)
+            raise
+        self.release(client)
+
+    def _keep_alive(self):
+        period = self.keepalive / 2
+        while not self._closed.wait(period):
+            with self._lock:
+                limit = time.monotonic() - period
+                stale = [item for item in self._idle if item[1] <= limit]
+                for item in stale:
+                    self._idle.remove(item)
+                self._in_use += len(stale)
+            for client, _ in stale:
+                try:
+                    client.ping()
+                    self.release(client)
+                except (MPDError, OSError) as err:
+                    log.debug('discarding pooled client: %s', err)
+                    self.release(client, discard=True)
+
+    def close(self):
+        """Disconnects idle clients, clients in use are disconnected when
+        released."""
+        self._closed.set()
+        with self._lock:
+            idle = [client for client, _ in self._idle]
+            self._idle.clear()
+            self._lock.notify_all()
+        for client in idle:
+            self._discard(client)
+        if self._keeper is not None and self._keeper is not threading.current_thread():
+            self._keeper.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.close()
+
+
+class MPDGroup:
+    """Runs the same commands on many MPD servers concurrently.
+
+    :param hosts: hosts as :py:obj:`str` or ``(host, port)`` tuples
+    :param timeout: connection and socket timeout in seconds for each host, a
+      host not answering in time gets a :py:obj:`TimeoutError` as result
+      (whole seconds, like :py:attr:`MPDClient.socket_timeout`)
+    :type timeout: int or None
+    :param setup: callable run with each newly connected client (to send
+      password, select partition, etc.)
+    :param client_class: class used to create clients
+
+    One client per host is run from a thread pool, a command sent to the whole
+    group takes about as long as the slowest host. Results are returned per
+    host as a :py:obj:`dict`, with the exception raised instead of the result
+    for failing hosts. A client whose connection failed is connected again on
+    the next command.
+
+    >>> with musicpd.MPDGroup(['kitchen', 'living', ('office', 6601)],
+    ...                       timeout=2) as group:
+    ...     group.run('setvol', 30)
+    ...     for host, status in group.run('status').items():
+    ...         print(host, status)
+    """
+
+    def __init__(self, hosts, timeout=None, setup=None, client_class=MPDClient):
+        from concurrent.futures import ThreadPoolExecutor
+        if timeout is not None and (not isinstance(timeout, int) or timeout <= 0):
+            raise ValueError('timeout expects a non zero positive integer')
+        self.setup = setup
+        #: host -> client
+        self.clients = {}
+        for host in hosts:
+            client = client_class()
+            client.host, client.port = (host if isinstance(host, tuple)
+                                        else (host, client.port))
+            if timeout is not None:
+                client.mpd_timeout = client.socket_timeout = timeout
+            self.clients[host] = client
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self.clients), 1),
+                                            thread_name_prefix='MPDGroup')
+
+    def _call(self, client, func, args):
+        if client._sock is None:
+            client.connect()
+            try:
+                if self.setup is not None:
+                    self.setup(client)
+            except:
+                client.disconnect()
+                raise
+        try:
+            return func(client, *args)
+        except (ConnectionError, OSError):
+            # The connection state is unknown (timeout in the middle of a
+            # response…), starts over next time
+            if client._sock is not None:
+                client.disconnect()
+            raise
+
+    def call(self, func, *args):
+        """Runs ``func(client, *args)`` concurrently for each host.
+
+        :return: host -> func result or the exception raised
+        """
+        futures = {host: self._executor.submit(self._call, client, func, args)
+                   for host, client in self.clients.items()}
+        results = {}
+        for host, future in futures.items():
+            try:
+                results[host] = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                results[host] = err
+        return results
+
+    def run(self, command, *args):
+        """Runs an MPD command concurrently on each host.
+
+        :return: host -> command result or the exception raised
+        """
+        method = command.replace(' ', '_')
+        return self.call(lambda client, *args: getattr(client, method)(*args), *args)
+
+    def connect(self):
+        """Connects all hosts, returns host -> :py:obj:`None` or the
+        exception raised"""
+        return self.call(lambda client: None)
+
+    def close(self):
+        """Disconnects all hosts and stops the threads"""
+        for client in self.clients.values():
+            if client._sock is not None:
+                try:
+                    client.disconnect()
+                except (MPDError, OSError):
+                    pass
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.close()
+
+
+class IdleDispatcher:
+    """Waits for idle events of many :py:obj:`MPDClient` in a single thread.
+
+    Registered clients are kept in ``idle``, their sockets are watched with
+    :py:mod:`selectors`. When a client receives changes, the callbacks
+    registered for the changed subsystems are called with the client (out of
+    idle, commands can be run directly) and the subsystem, then idle is sent
+    again.
+
+    :param on_error: callable run with the client and the exception when a
+      client fails (connection lost, MPD error, raised by a callback or a
+      scheduled call too), the client is unregistered and disconnected first.
+      Defaults to logging the error.
+
+    >>> def player_changed(cli, subsystem):
+    ...     print(cli.host, cli.currentsong())
+    >>> dispatcher = musicpd.IdleDispatcher()
+    >>> for host in hosts:
+    ...     cli = musicpd.MPDClient()
+    ...     cli.connect(host)
+    ...     dispatcher.register(cli, {'player': player_changed})
+    >>> dispatcher.run()
+
+    Commands are run between idles with :py:obj:`call` (which can be used
+    from another thread).
+    """
+
+    def __init__(self, on_error=None):
+        self.on_error = on_error
+        self._selector = selectors.DefaultSelector()
+        #: client -> {subsystem: [callbacks]}
+        self._clients = {}
+        #: client -> file descriptor watched (kept for disconnected clients)
+        self._fds = {}
+        #: Scheduled calls, (client, func, args)
+        self._calls = deque()
+        self._running = False
+        #: Thread running the dispatcher
+        self._thread = None
+        # Wakes up select when calls are scheduled from another thread
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+
+    def register(self, client, callbacks):
+        """Watches idle events of a connected client.
+
+        :param MPDClient client: connected client, without pending command
+        :param dict callbacks: subsystem -> callable (or list of callables)
+          run with the client and the subsystem, idle waits for these
+          subsystems only
+        """
+        if client in self._clients:
+            raise MPDError('Client already registered')
+        self._clients[client] = {
+            subsystem: list(funcs) if isinstance(funcs, (list, tuple)) else [funcs]
+            for subsystem, funcs in callbacks.items()}
+        self._fds[client] = client.fileno()
+        self._selector.register(self._fds[client], selectors.EVENT_READ, client)
+        self._arm(client)
+
+    def unregister(self, client):
+        """Stops watching a client, leaving idle if it is connected"""
+        if self._clients.pop(client, None) is None:
+            return
+        self._selector.unregister(self._fds.pop(client))
+        self._calls = deque(call for call in self._calls if call[0] is not client)
+        if client._sock is not None and [command for command, _ in client._pending] == ['idle']:
+            try:
+                client.noidle()
+            except (MPDError, OSError) as err:
+                log.debug('error leaving idle: %s', err)
+
+    def call(self, client, func, *args):
+        """Schedules ``func(client, *args)`` to be run with client out of idle"""
+        self._calls.append((client, func, args))
+        if threading.current_thread() is not self._thread:
+            self._waker.send(b'\0')
+
+    def _arm(self, client):
+        client.send_idle(*self._clients[client])
+
+    def _rearm(self, client):
+        """Sends idle again if the client is still registered and connected"""
+        if client not in self._clients or client._sock is None:
+            return
+        try:
+            self._arm(client)
+        except (MPDError, OSError) as err:
+            self._failed(client, err)
+
+    def _dispatch(self, client, changes):
+        callbacks = self._clients[client]
+        for subsystem in changes:
+            for callback in callbacks.get(subsystem, ()):
+                callback(client, subsystem)
+
+    def _failed(self, client, err):
+        if self._clients.pop(client, None) is not None:
+            self._selector.unregister(self._fds.pop(client))
+        if client._sock is not None:
+            client.disconnect()
+        if self.on_error is not None:
+            self.on_error(client, err)
+        else:
+            log.error('%s:%s: %s', client.host, client.port, err)
+
+    def _run_calls(self):
+        while self._calls:
+            client, func, args = self._calls.popleft()
+            if client not in self._clients:
+                continue
+            try:
+                changes = client.noidle()
+            except (MPDError, OSError) as err:
+                self._failed(client, err)
+                continue
+            try:
+                self._dispatch(client, changes)
+                func(client, *args)
+            except (MPDError, OSError) as err:
+                self._failed(client, err)
+            finally:
+                self._rearm(client)
+
+    def run_once(self, timeout=None):
+        """Waits for events once and runs their callbacks, then the scheduled
+        calls.
+
+        :param timeout: seconds to wait for events (:py:obj:`None` to wait
+          indefinitely)
+        :return: the number of clients which got changes
+        """
+        ready = [client for client in self._clients if client._rfile.buffered]
+        if not ready and not self._calls:
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wakeup:
+                    try:
+                        while self._wakeup.recv(1024):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    ready.append(key.data)
+        for client in ready:
+            if client not in self._clients:
+                continue
+            try:
+                changes = client.fetch_idle()
+            except (MPDError, OSError) as err:
+                self._failed(client, err)
+                continue
+            try:
+                self._dispatch(client, changes)
+            except (MPDError, OSError) as err:
+                self._failed(client, err)
+            finally:
+                self._rearm(client)
+        self._run_calls()
+        return len(ready)
+
+    def run(self):
+        """Dispatches events until :py:obj:`stop` is called or no client is
+        left"""
+        self._running, self._thread = True, threading.current_thread()
+        try:
+            while self._running and self._clients:
+                self.run_once()
+        finally:
+            self._running = False
+
+    def stop(self):
+        """Stops :py:obj:`run` (can be called from another thread)"""
+        self._running = False
+        self._waker.send(b'\0')
+
+    def close(self):
+        """Unregisters all clients (they are left connected) and releases
+        the selector"""
+        for client in list(self._clients):
+            self.unregister(client)
+        self._selector.close()
+        self._wakeup.close()
+        self._waker.close()
+
+
+class QueueMirror:
+    """Local copy of the queue kept up to date with ``plchanges``.
+
+    :py:obj:`sync` fetches the whole queue once, then only the entries
+    changed since the queue version it holds (``playlist`` in ``status``),
+    the queue is trimmed to ``playlistlength``. Status and changes are fetched
+    in a single command list so that they match. Entries are looked up by
+    position or id in constant time.
+
+    :param bool posid: fetch changes with ``plchangesposid``, only songs new
+      to the queue are fetched with ``playlistid``. Lighter when songs are
+      mostly moved around, but tags changes of songs already in the queue are
+      missed.
+
+    >>> queue = musicpd.QueueMirror()
+    >>> while True:
+    ...     queue.sync(cli)
+    ...     status = cli.status()
+    ...     print(queue[int(status['song'])])
+    ...     cli.idle('playlist', 'player')
+    """
+
+    def __init__(self, posid=False):
+        self.posid = posid
+        #: Queue version mirrored (:py:obj:`None` before the first sync)
+        self.version = None
+        self._songs = []
+        self._ids = {}
+
+    def sync(self, client):
+        """Updates the mirror from a connected :py:obj:`MPDClient`.
+
+        :return: :py:obj:`True` if the queue changed since the last sync
+        """
+        if self.version is None:
+            status, songs = client.command_batch([('status',), ('playlistinfo',)])
+            self._reload(songs)
+        elif self.posid:
+            status, changes = client.command_batch(
+                [('status',), ('plchangesposid', self.version)])
+            if status['playlist'] == self.version:
+                return False
+            if int(status['playlist']) < int(self.version):
+                # MPD restarted
+                self.version = None
+                return self.sync(client)
+            unknown = [change['id'] for change in changes
+                       if change['id'] not in self._ids]
+            songs = {}
+            if unknown:
+                for found in client.command_batch(
+                        [('playlistid', songid) for songid in unknown]):
+                    songs.update((song['id'], song) for song in found)
+            moved = []
+            for change in changes:
+                song = songs.get(change['id']) or self._ids[change['id']]
+                song['pos'] = change['cpos']
+                moved.append(song)
+            self._apply(moved)
+        else:
+            status, songs = client.command_batch(
+                [('status',), ('plchanges', self.version)])
+            if status['playlist'] == self.version:
+                return False
+            if int(status['playlist']) < int(self.version):
+                self.version = None
+                return self.sync(client)
+            self._apply(songs)
+        self._trim(int(status['playlistlength']))
+        self.version = status['playlist']
+        return True
+
+    def _reload(self, songs):
+        self._songs = list(songs)
+        self._ids = {song['id']: song for song in self._songs}
+
+    def _apply(self, songs):
+        entries, ids = self._songs, self._ids
+        #: Ids already moved to their new position
+        placed = set()
+        for song in sorted(songs, key=lambda song: int(song['pos'])):
+            pos = int(song['pos'])
+            if pos < len(entries):
+                old = entries[pos]
+                if (old is not None and old['id'] not in placed
+                        and ids.get(old['id']) is old):
+                    del ids[old['id']]
+                entries[pos] = song
+            else:
+                entries.extend([None] * (pos - len(entries)))
+                entries.append(song)
+            ids[song['id']] = song
+            placed.add(song['id'])
+
+    def _trim(self, length):
+        for old in self._songs[length:]:
+            if old is None or self._ids.get(old['id']) is not old:
+                continue
+            pos = int(old['pos'])
+            # Unless moved within the queue (plchangesposid)
+            if not (pos < length and self._songs[pos] is old):
+                del self._ids[old['id']]
+        del self._songs[length:]
+
+    def __len__(self):
+        return len(self._songs)
+
+    def __iter__(self):
+        return iter(self._songs)
+
+    def __getitem__(self, pos):
+        """Song at position pos"""
+        return self._songs[pos]
+
+    def get_id(self, songid, default=None):
+        """Song with id songid"""
+        return self._ids.get(str(songid), default)
+
+
+class CoverCache:
+    """Persistent cache of pictures fetched with ``albumart`` or
+    ``readpicture``, stored as files in a local directory.
+
+    :param str path: cache directory (created if missing)
+    :param int max_bytes: size budget of the cache, least recently used
+      pictures are removed beyond it
+    :param int max_maps: number of most recently used pictures kept mapped
+      (each map holds a file descriptor)
+
+    ``albumart`` pictures are stored per song directory, ``readpicture`` ones
+    per song, along with the song's ``last-modified`` so that a modified song
+    gets a fresh picture. Missing pictures are downloaded with
+    :py:obj:`MPDClient.cover`, cached ones are served as read-only
+    :py:obj:`mmap.mmap` shared between callers (do not close them), empty
+    pictures as ``b''``. The cache is thread safe and can be shared by clients from a
+    :py:obj:`MPDClientPool`.
+
+    >>> covers = musicpd.CoverCache('~/.cache/mpd-covers', max_bytes=2**28)
+    >>> for song in cli.playlistinfo():
+    ...     picture = covers.get(cli, song)
+    """
+
+    def __init__(self, path, max_bytes=2**27, max_maps=64):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.max_maps = max_maps
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        #: Cached files sizes, least recently used first
+        self._index = OrderedDict()
+        #: Mapped files, least recently used first
+        self._maps = OrderedDict()
+        self._bytes = 0
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if '.' not in entry.name:
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+            elif entry.name.endswith('.tmp') and stat.st_mtime < time.time() - 3600:
+                # Left by an interrupted download (recent ones may still be
+                # written by another process)
+                try:
+                    os.remove(entry.path)
+                except OSError as err:
+                    log.debug('could not remove %s: %s', entry.path, err)
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def _key(uri, last_modified, command):
+        if command == 'albumart':
+            uri = uri.rpartition('/')[0]
+        key = f'{command}\n{uri}\n{last_modified}'
+        return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def get(self, client, song, command='albumart'):
+        """Returns the picture for a song, fetching it with client on a miss.
+
+        :param MPDClient client: connected client
+        :param song: song URI or song object (a ``last-modified`` lookup is
+          saved when it is present)
+        :param str command: ``albumart`` or ``readpicture``
+        :return: the picture or :py:obj:`None` if there is none
+        :rtype: mmap.mmap or bytes
+        """
+        if isinstance(song, str):
+            uri, last_modified = song, None
+        else:
+            uri, last_modified = song['file'], song.get('last-modified')
+        if last_modified is None:
+            found = list(client.lsinfo(uri))
+            last_modified = found[0].get('last-modified') if found else None
+        name = self._key(uri, last_modified, command)
+        with self._lock:
+            if name in self._index:
+                self._index.move_to_end(name)
+                try:
+                    return self._map(name)
+                except FileNotFoundError as err:
+                    # Removed under our feet
+                    log.debug('dropping cached cover %s: %s', name, err)
+                    self._remove(name)
+        return self._fill(client, uri, name, command)
+
+    def _fill(self, client, uri, name, command):
+        filename = os.path.join(self.path, name)
+        tmp = f'{filename}.{os.getpid()}-{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as sink:
+                header = client.cover(uri, sink, command=command)
+            if not header:
+                return None
+            os.replace(tmp, filename)
+        except CommandError as err:
+            if str(err).startswith('[50@'):  # No such file
+                return None
+            raise
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self._lock:
+            if name in self._index:
+                self._bytes -= self._index[name]
+            self._index[name] = int(header['size'])
+            self._index.move_to_end(name)
+            # A map of the replaced file would serve the former picture
+            self._maps.pop(name, None)
+            self._bytes += int(header['size'])
+            self._evict(keep=name)
+            return self._map(name)
+
+    def _map(self, name):
+        if not self._index[name]:
+            # Empty files cannot be mapped
+            os.utime(os.path.join(self.path, name))
+            return b''
+        if name in self._maps:
+            self._maps.move_to_end(name)
+            return self._maps[name]
+        filename = os.path.join(self.path, name)
+        # Refresh the file time for the next start
+        os.utime(filename)
+        with open(filename, 'rb') as picture:
+            picture_map = mmap.mmap(picture.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[name] = picture_map
+        while len(self._maps) > self.max_maps:
+            # Callers may still use the map, it is released once unreferenced
+            self._maps.popitem(last=False)
+        return picture_map
+
+    def _remove(self, name):
+        self._bytes -= self._index.pop(name)
+        # Callers may still use the map, it is released once unreferenced
+        self._maps.pop(name, None)
+        try:
+            os.remove(os.path.join(self.path, name))
+        except OSError as err:
+            log.debug('could not remove cached cover %s: %s', name, err)
+
+    def _evict(self, keep=None):
+        for name in list(self._index):
+            if self._bytes <= self.max_bytes:
+                break
+            if name != keep:
+                self._remove(name)
+
+    def clear(self):
+        """Removes all cached pictures"""
+        with self._lock:
+            while self._index:
+                self._remove(next(iter(self._index)))
+
+    def stats(self):
+        """Returns the number of cached pictures and their size in bytes"""
+        with self._lock:
+            return {'pictures': len(self._index), 'bytes': self._bytes}
+
+
+class LibraryMirror:
+    """Local copy of MPD's database in an SQLite file, to query the library
+    without a connection.
+
+    :param str path: SQLite database file (``:memory:`` for a transient
+      mirror)
+
+    :py:obj:`sync` dumps the database with ``listallinfo`` on first use, later
+    syncs stream it again but only write the songs whose ``last-modified``
+    changed and drop the removed ones. Run it whenever ``idle`` reports a
+    ``database`` change:
+
+    >>> mirror = musicpd.LibraryMirror('~/.cache/mpd-library.sqlite')
+    >>> mirror.sync(cli)
+    >>> mirror.find('artist', 'Amon Tobin')
+    >>> while True:
+    ...     if 'database' in cli.idle('database'):
+    ...         mirror.sync(cli)
+
+    Queries take the same *tag*, *value* pairs as MPD's ``find``, ``search``,
+    ``list`` and ``count`` (``file``, ``base`` and ``any`` included), filter
+    expressions are not supported. Like SQLite connections, a mirror is to be
+    used from a single thread.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS directories (
+            path TEXT PRIMARY KEY, parent TEXT NOT NULL, last_modified TEXT);
+        CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+        CREATE TABLE IF NOT EXISTS songs (
+            id INTEGER PRIMARY KEY, file TEXT UNIQUE NOT NULL,
+            directory TEXT NOT NULL, last_modified TEXT);
+        CREATE INDEX IF NOT EXISTS songs_directory ON songs (directory);
+        CREATE TABLE IF NOT EXISTS tags (
+            song INTEGER NOT NULL REFERENCES songs (id) ON DELETE CASCADE,
+            tag TEXT NOT NULL, value TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS tags_tag_value ON tags (tag, value);
+        CREATE INDEX IF NOT EXISTS tags_song ON tags (song);
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        if path != ':memory:':
+            path = os.path.expanduser(path)
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.create_function('casefold', 1,
+                                 lambda text: None if text is None else text.casefold())
+        with self._db:
+            self._db.executescript(self._schema)
+
+    def close(self):
+        """Closes the SQLite database"""
+        self._db.close()
+
+    @property
+    def db_update(self):
+        """``db_update`` value of MPD's stats at last sync (:py:obj:`None`
+        before the first one)"""
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'db_update'").fetchone()
+        return row[0] if row else None
+
+    def sync(self, client, force=False):
+        """Updates the mirror from a connected :py:obj:`MPDClient`.
+
+        :param bool force: dump the whole database again
+        :return: :py:obj:`True` if MPD's database changed since the last sync
+        """
+        db_update = client.stats().get('db_update')
+        current = self.db_update
+        if not force and current is not None and current == db_update:
+            return False
+        with self._db:
+            if force or current is None:
+                self._dump(client)
+            else:
+                self._update(client)
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('db_update', ?)",
+                             (db_update,))
+        return True
+
+    def _dump(self, client):
+        self._db.execute('DELETE FROM songs')
+        self._db.execute('DELETE FROM directories')
+        iterate, client.iterate = client.iterate, True
+        try:
+            for entry in client.listallinfo():
+                if 'directory' in entry:
+                    self._add_directory(entry)
+                elif 'file' in entry:
+                    self._add_song(entry)
+        finally:
+            client.iterate = iterate
+
+    def _update(self, client):
+        """Streams ``listallinfo``, only writes songs whose ``last-modified``
+        changed and drops the ones gone since last sync"""
+        execute = self._db.execute
+        directories = dict(execute('SELECT path, last_modified FROM directories'))
+        songs = {uri: (song_id, modified) for song_id, uri, modified in
+                 execute('SELECT id, file, last_modified FROM songs')}
+        iterate, client.iterate = client.iterate, True
+        try:
+            for entry in client.listallinfo():
+                if 'directory' in entry:
+                    modified = directories.pop(entry['directory'], None)
+                    if modified is None or modified != entry.get('last-modified'):
+                        self._add_directory(entry)
+                elif 'file' in entry:
+                    known = songs.pop(entry['file'], None)
+                    if known is None or known[1] != entry.get('last-modified'):
+                        self._add_song(entry)
+        finally:
+            client.iterate = iterate
+        self._db.executemany('DELETE FROM directories WHERE path = ?',
+                             ((path,) for path in directories))
+        self._db.executemany('DELETE FROM songs WHERE id = ?',
+                             ((song_id,) for song_id, _ in songs.values()))
+
+    def _add_directory(self, entry):
+        path = entry['directory']
+        self._db.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?)',
+                         (path, path.rpartition('/')[0], entry.get('last-modified')))
+
+    def _add_song(self, song):
+        uri = song['file']
+        self._db.execute('DELETE FROM songs WHERE file = ?', (uri,))
+        cursor = self._db.execute(
+            'INSERT INTO songs (file, directory, last_modified) '
+            'VALUES (?, ?, ?)',
+            (uri, uri.rpartition('/')[0], song.get('last-modified')))
+        song_id = cursor.lastrowid
+        rows = []
+        for key, value in song.items():
+            if key == 'file':
+                continue
+            if isinstance(value, list):
+                rows.extend((song_id, key, item) for item in value)
+            else:
+                rows.append((song_id, key, value))
+        self._db.executemany('INSERT INTO tags VALUES (?, ?, ?)', rows)
+
+    @staticmethod
+    def _where(filters, exact):
+        """Builds the SQL condition on songs matching tag/value pairs"""
+        if len(filters) % 2:
+            raise CommandError('Filters are expected as tag, value pairs')
+        clauses, params = [], []
+        for tag, value in zip(filters[::2], filters[1::2]):
+            tag = tag.lower()
+            if tag == 'base':
+                prefix = value.rstrip('/') + '/'
+                clauses.append('substr(songs.file, 1, ?) = ?')
+                params.extend((len(prefix), prefix))
+                continue
+            if exact:
+                column, condition = 'songs.file = ?', 'tags.value = ?'
+            else:
+                column = 'instr(casefold(songs.file), ?) > 0'
+                condition = 'instr(casefold(tags.value), ?) > 0'
+                value = value.casefold()
+            if tag == 'file':
+                clauses.append(column)
+                params.append(value)
+                continue
+            if tag == 'any':
+                clauses.append('EXISTS (SELECT 1 FROM tags WHERE tags.song = songs.id '
+                               f'AND {condition})')
+                params.append(value)
+            else:
+                clauses.append('EXISTS (SELECT 1 FROM tags WHERE tags.song = songs.id '
+                               f'AND tags.tag = ? AND {condition})')
+                params.extend((tag, value))
+        return ' AND '.join(clauses) or '1', params
+
+    def _songs(self, filters, exact):
+        where, params = self._where(filters, exact)
+        songs = []
+        song, current = None, None
+        for song_id, uri, key, value in self._db.execute(
+                'SELECT songs.id, songs.file, tags.tag, tags.value FROM '
+                f'(SELECT * FROM songs WHERE {where}) AS songs '
+                'LEFT JOIN tags ON tags.song = songs.id '
+                'ORDER BY songs.file, tags.rowid', params):
+            if song_id != current:
+                current, song = song_id, {'file': uri}
+                songs.append(song)
+            if key is None:
+                continue
+            if key not in song:
+                song[key] = value
+            elif isinstance(song[key], list):
+                song[key].append(value)
+            else:
+                song[key] = [song[key], value]
+        return songs
+
+    def find(self, *filters):
+        """Songs exactly matching tag/value pairs, cf. MPD's ``find``"""
+        return self._songs(filters, True)
+
+    def search(self, *filters):
+        """Songs matching tag/value pairs, case insensitive substring match,
+        cf. MPD's ``search``"""
+        return self._songs(filters, False)
+
+    def list(self, tag, *filters):
+        """Sorted unique values of tag among songs exactly matching
+        tag/value pairs, cf. MPD's ``list``"""
+        where, params = self._where(filters, True)
+        tag = tag.lower()
+        if tag == 'file':
+            query = f'SELECT file FROM songs WHERE {where} ORDER BY file'
+        else:
+            query = ('SELECT DISTINCT value FROM tags WHERE tag = ? AND song IN '
+                     f'(SELECT id FROM songs WHERE {where}) ORDER BY value')
+            params = [tag] + params
+        return [value for value, in self._db.execute(query, params)]
+
+    def count(self, *filters):
+        """Number of songs and total playtime of songs exactly matching
+        tag/value pairs, cf. MPD's ``count``"""
+        where, params = self._where(filters, True)
+        songs, playtime = self._db.execute(
+            'SELECT count(*), coalesce(sum(('
+            "SELECT CAST(value AS REAL) FROM tags WHERE tags.song = songs.id "
+            "AND tags.tag = 'duration')), 0) "
+            f'FROM songs WHERE {where}', params).fetchone()
+        return {'songs': str(songs), 'playtime': str(int(playtime))}
+
+
+class Backoff:
+    """Jittered exponential backoff policy of :py:attr:`MPDClient.reconnect`.
+
+    The first attempt is immediate, then the delay starts at *delay* and is
+    multiplied by *factor* up to *max_delay*, each delay is shortened by a
+    random fraction up to *jitter* so clients of a restarting server do not
+    reconnect all at once.
+
+    >>> cli.reconnect = musicpd.Backoff(attempts=10)
+    >>> cli.connect()
+    >>> cli.status()  # survives a restart of MPD
+
+    :param int attempts: connection attempts before giving up
+    :param float delay: first delay in seconds
+    :param float max_delay: longest delay in seconds
+    :param float factor: delay growth factor
+    :param float jitter: fraction of the delay randomly removed (0 to 1)
+    """
+
+    def __init__(self, attempts=10, delay=0.01, max_delay=5.0, factor=2.0,
+                 jitter=0.5):
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+
+    def delays(self):
+        """Yields the delay before each attempt"""
+        for attempt in range(self.attempts):
+            if not attempt:
+                yield 0
+                continue
+            delay = min(self.max_delay, self.delay * self.factor ** (attempt - 1))
+            yield delay * (1 - self.jitter * random.random())
+
+
+class CommandSample:
+    """Measures of a command, reported to :py:attr:`MPDClient.instrument`.
+
+    Times are in seconds: ``send`` encodes and writes the command, ``wait``
+    lasts until the first bytes of the response are received (0 if they
+    were already buffered), ``parse`` reads and parses the rest of the
+    response (up to the end of the iteration with :py:attr:`MPDClient.iterate`).
+    Command lists are reported once as ``command_list``.
+    """
+    __slots__ = ('command', 'send', 'bytes_out', 'wait', 'parse', 'bytes_in',
+                 'lines', 'objects', 'error')
+
+    def __init__(self, command, send=0.0, bytes_out=0):
+        #: Command name
+        self.command = command
+        self.send = send
+        self.bytes_out = bytes_out
+        self.wait = 0.0
+        self.parse = 0.0
+        self.bytes_in = 0
+        #: Response lines read
+        self.lines = 0
+        #: Objects (songs, items, pairs…) returned
+        self.objects = 0
+        #: :py:obj:`MPDError` raised by the command, if any
+        self.error = None
+
+    @property
+    def duration(self):
+        """Wall time of the command"""
+        return self.send + self.wait + self.parse
+
+    def __repr__(self):
+        return (f'<CommandSample {self.command} {self.duration:.6f}s '
+                f'out={self.bytes_out} in={self.bytes_in} lines={self.lines} '
+                f'objects={self.objects}>')
+
+
+class CommandMetrics:
+    """Aggregates :py:obj:`CommandSample` per command: counters and a
+    latency histogram. Instances are thread safe and can be shared by
+    several clients (ie. a :py:obj:`MPDClientPool`).
+
+    >>> metrics = musicpd.CommandMetrics()
+    >>> cli.instrument = metrics
+    >>> cli.status()
+    >>> print(metrics.prometheus())
+
+    :param buckets: upper bounds in seconds of the histogram buckets
+    """
+    #: Default histogram buckets upper bounds in seconds
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+               0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    _counters = ('send', 'wait', 'parse', 'bytes_out', 'bytes_in', 'lines',
+                 'objects')
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(sorted(buckets or self.BUCKETS))
+        self._lock = threading.Lock()
+        self._commands = {}
+
+    def __call__(self, sample):
+        idx = bisect.bisect_left(self.buckets, sample.duration)
+        with self._lock:
+            stats = self._commands.get(sample.command)
+            if stats is None:
+                stats = self._commands[sample.command] = dict.fromkeys(
+                    ('count', 'errors', 'duration') + self._counters, 0)
+                stats['histogram'] = [0] * (len(self.buckets) + 1)
+            stats['count'] += 1
+            stats['errors'] += sample.error is not None
+            stats['duration'] += sample.duration
+            for counter in self._counters:
+                stats[counter] += getattr(sample, counter)
+            stats['histogram'][idx] += 1
+
+    def reset(self):
+        """Drops all measures"""
+        with self._lock:
+            self._commands.clear()
+
+    def as_dict(self):
+        """Returns measures per command: ``count``, ``errors``, total
+        ``duration``, ``send``, ``wait`` and ``parse`` times, ``bytes_out``,
+        ``bytes_in``, ``lines``, ``objects`` and ``histogram``, a list of
+        (upper bound, cumulative count) ending with ``inf``."""
+        with self._lock:
+            commands = {command: dict(stats)
+                        for command, stats in self._commands.items()}
+        for stats in commands.values():
+            histogram, total = [], 0
+            for bound, count in zip(self.buckets + (float('inf'),),
+                                    stats['histogram']):
+                total += count
+                histogram.append((bound, total))
+            stats['histogram'] = histogram
+        return commands
+
+    def prometheus(self, prefix='musicpd'):
+        """Returns measures in Prometheus text exposition format"""
+        commands = self.as_dict()
+        name = f'{prefix}_command_duration_seconds'
+        lines = [f'# HELP {name} Wall time of MPD commands.',
+                 f'# TYPE {name} histogram']
+        for command, stats in sorted(commands.items()):
+            label = command.replace('\\', '\\\\').replace('"', '\\"')
+            for bound, count in stats['histogram']:
+                bound = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{command="{label}",le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{command="{label}"}} {stats["duration"]!r}')
+            lines.append(f'{name}_count{{command="{label}"}} {stats["count"]}')
+        for counter, metric, help_text in (
+                ('send', 'send_seconds', 'Time spent sending commands.'),
+                ('wait', 'wait_seconds', 'Time spent waiting for responses.'),
+                ('parse', 'parse_seconds', 'Time spent reading and parsing responses.'),
+                ('bytes_out', 'sent_bytes', 'Bytes sent.'),
+                ('bytes_in', 'received_bytes', 'Bytes received.'),
+                ('lines', 'lines', 'Response lines read.'),
+                ('objects', 'objects', 'Objects returned.'),
+                ('errors', 'errors', 'Commands failing with an error.')):
+            name = f'{prefix}_command_{metric}_total'
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for command, stats in sorted(commands.items()):
+                label = command.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{name}{{command="{label}"}} {stats[counter]!r}')
+        return '\n'.join(lines) + '\n'
+
+
+class TraceRecorder:
+    """Records the bytes exchanged between clients and MPD to a trace file,
+    set it as :py:attr:`MPDClient.recorder` before connecting. Traces are
+    replayed with ``musicpd_testing.TraceReplayer``.
+
+    The file starts with :py:attr:`TraceRecorder.MAGIC`, followed by records
+    made of a header (kind, seconds since the recorder creation as a double,
+    length of data, cf. :py:attr:`TraceRecorder.HEADER`) and the data. Kinds are ``C`` for a new
+    connection (data is ``host:port``), ``W`` for bytes written by the
+    client and ``R`` for bytes received from MPD.
+
+    >>> with musicpd.TraceRecorder('session.trace') as recorder:
+    ...     cli.recorder = recorder
+    ...     cli.connect()
+    ...     cli.listallinfo()
+    ...     cli.disconnect()
+
+    :param str path: trace file to write
+    """
+    #: Trace file signature and format version
+    MAGIC = b'MPDTRACE 1\n'
+    #: Records header, kind, timestamp and data length
+    HEADER = struct.Struct('<cdI')
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(self.MAGIC)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, kind, data):
+        """Appends a record"""
+        with self._lock:
+            self._file.write(self.HEADER.pack(
+                kind, time.perf_counter() - self._start, len(data)))
+            self._file.write(data)
+
+    def _attach(self, sock, wfile, host, port):
+        """Records a new connection, returns the socket and file to use
+        instead of sock and wfile"""
+        self.record(b'C', f'{host}:{port}'.encode('utf-8', 'surrogateescape'))
+        return _RecordingSocket(sock, self), _RecordingWriter(wfile, self)
+
+    def close(self):
+        """Flushes and closes the trace file"""
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.close()
+
 
 def escape(text):
     return text.replace("\\", "\\\\").replace('"', '\\"')
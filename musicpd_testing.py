@@ -0,0 +1,918 @@
+# -*- coding: utf-8 -*-
+# SPDX-FileCopyrightText: 2025  kaliko <kaliko@azylum.org>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+"""In-process fake MPD server to test and benchmark clients without MPD
+
+>>> with musicpd_testing.FakeMPD(songs=1000) as server:
+...     cli = musicpd.MPDClient()
+...     cli.connect(*server.address)
+...     cli.playlistinfo()
+"""
+
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import types
+
+from collections import deque
+
+import musicpd
+
+log = logging.getLogger(__name__)
+
+#: ACK error codes
+ACK_ERROR_NOT_LIST = 1
+ACK_ERROR_ARG = 2
+ACK_ERROR_PASSWORD = 3
+ACK_ERROR_PERMISSION = 4
+ACK_ERROR_UNKNOWN = 5
+ACK_ERROR_NO_EXIST = 50
+
+
+class Ack(Exception):
+    """Error sent back as an ``ACK`` line"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def split_args(line):
+    """Splits a command line in words, unquoting and unescaping arguments"""
+    args, pos, end = [], 0, len(line)
+    while pos < end:
+        if line[pos] == ' ':
+            pos += 1
+        elif line[pos] == '"':
+            pos += 1
+            word = []
+            while pos < end and line[pos] != '"':
+                if line[pos] == '\\' and pos + 1 < end:
+                    pos += 1
+                word.append(line[pos])
+                pos += 1
+            if pos >= end:
+                raise Ack(ACK_ERROR_ARG, "Missing closing '\"'")
+            pos += 1
+            args.append(''.join(word))
+        else:
+            space = line.find(' ', pos)
+            space = end if space < 0 else space
+            args.append(line[pos:space])
+            pos = space
+    return args
+
+
+def parse_range(arg, length):
+    """Returns (start, end) from a ``START:END`` or ``POS`` argument"""
+    try:
+        if ':' not in arg:
+            start = int(arg)
+            return start, start + 1
+        start, _, end = arg.partition(':')
+        return int(start), int(end) if end else length
+    except ValueError as err:
+        raise Ack(ACK_ERROR_ARG, f'Integer expected: {arg}') from err
+
+
+def synthetic_library(songs):
+    """Songs as lists of (key, value), twelve songs per album, five albums per
+    artist"""
+    library = []
+    for idx in range(songs):
+        album = idx // 12
+        library.append([
+            ('file', f'Artist {album // 5}/Album {album}/{idx % 12:02d}-Track {idx}.flac'),
+            ('Last-Modified', '2024-03-01T10:00:00Z'),
+            ('Format', '44100:16:2'),
+            ('Artist', f'Artist {album // 5}'),
+            ('AlbumArtist', f'Artist {album // 5}'),
+            ('Title', f'Track {idx}'),
+            ('Album', f'Album {album}'),
+            ('Track', str(idx % 12 + 1)),
+            ('Date', '2001'),
+            ('Genre', f'Genre {album % 20}'),
+            ('Time', str(200 + idx % 100)),
+            ('duration', f'{200 + idx % 100}.123'),
+        ])
+    return library
+
+
+class _Connection:
+    """A client connection, run in its own thread"""
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.buffer = bytearray()
+        #: Subsystems changed since the last idle
+        self.changes = set()
+        self.wakeup, self.waker = socket.socketpair()
+        self.commands = 0
+        self.binarylimit = server.binarylimit
+
+    def readline(self, block=True):
+        """Returns the next line (without new line), None on EOF or if no
+        complete line is buffered and block is False"""
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 1]
+                return line.decode('utf-8', 'surrogateescape')
+            if not block:
+                return None
+            data = self.sock.recv(65536)
+            if not data:
+                return None
+            self.buffer += data
+
+    def send(self, data):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        chunk = server.chunk_size or len(data)
+        if server.bandwidth:
+            chunk = min(chunk, max(1, int(server.bandwidth / 20)))
+        for offset in range(0, len(data), chunk):
+            part = data[offset:offset + chunk]
+            self.sock.sendall(part)
+            if server.bandwidth:
+                time.sleep(len(part) / server.bandwidth)
+
+    def serve(self):
+        self.send(f'OK MPD {self.server.version}\n'.encode())
+        while True:
+            line = self.readline()
+            if line is None:
+                break
+            if not self.handle(line):
+                break
+
+    def close(self):
+        self.wakeup.close()
+        self.waker.close()
+
+    def handle(self, line):
+        """Handles a command line, returns False to close the connection"""
+        self.commands += 1
+        if (self.server.disconnect_after is not None
+                and self.commands > self.server.disconnect_after):
+            return False
+        if line in ('command_list_begin', 'command_list_ok_begin'):
+            return self.command_list(line == 'command_list_ok_begin')
+        if line == 'idle' or line.startswith('idle '):
+            return self.idle(split_args(line)[1:])
+        if line == 'close':
+            return False
+        if line == 'noidle':
+            # Ignored out of idle
+            return True
+        try:
+            data = self.execute(line)
+        except Ack as err:
+            self.send(self.ack(err, 0, line).encode())
+        else:
+            self.send(data + b'OK\n')
+        return True
+
+    @staticmethod
+    def ack(err, idx, line):
+        command = line.split(' ', 1)[0]
+        return f'ACK [{err.code}@{idx}] {{{command}}} {err.message}\n'
+
+    def execute(self, line):
+        args = split_args(line)
+        if not args:
+            raise Ack(ACK_ERROR_UNKNOWN, 'No command given')
+        command, args = args[0], args[1:]
+        handler = self.server.handlers.get(command)
+        if handler is None:
+            raise Ack(ACK_ERROR_UNKNOWN, f'unknown command "{command}"')
+        response = handler(self, args)
+        if response is None:
+            return b''
+        if isinstance(response, bytes):
+            return response
+        return ''.join(f'{key}: {value}\n' for key, value in response).encode(
+            'utf-8', 'surrogateescape')
+
+    def command_list(self, list_ok):
+        lines = []
+        while True:
+            line = self.readline()
+            if line is None:
+                return False
+            if line == 'command_list_end':
+                break
+            lines.append(line)
+        response = bytearray()
+        for idx, line in enumerate(lines):
+            try:
+                response += self.execute(line)
+            except Ack as err:
+                response += self.ack(err, idx, line).encode()
+                self.send(bytes(response))
+                return True
+            if list_ok:
+                response += b'list_OK\n'
+        self.send(bytes(response) + b'OK\n')
+        return True
+
+    def idle(self, subsystems):
+        wanted = set(subsystems) or None
+        while True:
+            with self.server.lock:
+                changed = sorted(self.changes if wanted is None
+                                 else self.changes & wanted)
+                if changed:
+                    self.changes.difference_update(changed)
+                    break
+            if self.buffer:
+                line = self.readline(block=False)
+                if line is not None:
+                    if line != 'noidle':
+                        # Any other command while idle closes the connection
+                        return False
+                    break
+            ready, _, _ = select.select([self.sock, self.wakeup], [], [])
+            if self.wakeup in ready:
+                self.wakeup.recv(1024)
+            if self.sock in ready:
+                data = self.sock.recv(65536)
+                if not data:
+                    return False
+                self.buffer += data
+        self.send(''.join(f'changed: {subsystem}\n'
+                          for subsystem in changed).encode() + b'OK\n')
+        return True
+
+    def notify(self, subsystems):
+        self.changes.update(subsystems)
+        self.waker.send(b'\0')
+
+
+class _Listener:
+    """Accepts connections on a TCP port or a unix socket, serves each client
+    from its own thread with :py:meth:`_serve`"""
+
+    def __init__(self, host='127.0.0.1', port=0, path=None):
+        self.lock = threading.RLock()
+        #: Client sockets being served
+        self.clients = []
+        if path is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.bind(path)
+            #: Address to give to :py:obj:`musicpd.MPDClient.connect`
+            self.address = (path, None)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._sock.bind((host, port))
+            self.address = self._sock.getsockname()[:2]
+        self.path = path
+        self._thread = None
+
+    def start(self):
+        """Starts listening and serving clients from threads"""
+        self._sock.listen(16)
+        self._thread = threading.Thread(target=self._accept, daemon=True,
+                                        name=type(self).__name__)
+        self._thread.start()
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                break
+            with self.lock:
+                self.clients.append(sock)
+            threading.Thread(target=self._run, args=(sock,), daemon=True).start()
+
+    def _run(self, sock):
+        try:
+            self._serve(sock)
+        except OSError as err:
+            log.debug('connection error: %s', err)
+        finally:
+            with self.lock:
+                self.clients.remove(sock)
+            sock.close()
+
+    def _serve(self, sock):
+        raise NotImplementedError
+
+    def disconnect_all(self):
+        """Drops all client connections"""
+        with self.lock:
+            for sock in self.clients:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def stop(self):
+        """Stops listening and closes client connections"""
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self.disconnect_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.stop()
+
+
+class FakeMPD(_Listener):
+    """MPD stand-in serving a synthetic library and queue from a thread.
+
+    :param str host: address to listen on (TCP)
+    :param int port: port to listen on, 0 picks a free port
+    :param str path: listen on this unix socket instead of TCP
+    :param int songs: number of songs in the library
+    :param int queue: number of library songs in the queue
+    :param int picture_size: size in bytes of each album picture
+    :param str version: protocol version sent in the hello line
+
+    Attributes below can be changed at any time to inject faults:
+
+    * :py:attr:`latency`: seconds waited before each response
+    * :py:attr:`bandwidth`: bytes per second responses are sent at
+    * :py:attr:`chunk_size`: responses are sent in pieces of this size, to
+      exercise partial reads
+    * :py:attr:`disconnect_after`: connections are closed after this number
+      of commands
+
+    Commands are implemented by the methods of :py:attr:`handlers`, called
+    with the connection and the arguments, returning a list of
+    ``(key, value)`` pairs or raw :py:obj:`bytes` (the final ``OK`` is
+    added), raising :py:obj:`Ack` for errors. Add or replace some to script
+    the server.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, path=None, songs=100, queue=None,
+                 picture_size=100000, version='0.24.0'):
+        self.version = version
+        self.latency = 0
+        self.bandwidth = None
+        self.chunk_size = None
+        self.disconnect_after = None
+        self.binarylimit = 8192
+        self.picture_size = picture_size
+        self.library = synthetic_library(songs)
+        self._files = {dict(song)['file']: song for song in self.library}
+        #: Queue as a list of (song id, song)
+        self.queue = []
+        self.next_id = 1
+        self.playlist_version = 1
+        #: Queue version each position was last changed in
+        self._changed = []
+        self.state = {'volume': '50', 'repeat': '0', 'random': '0', 'single': '0',
+                      'consume': '0', 'state': 'stop'}
+        self.db_update = str(int(time.time()))
+        self.connections = []
+        self.handlers = {name[4:]: getattr(self, name) for name in dir(self)
+                         if name.startswith('cmd_')}
+        self.handlers['sticker'] = self.cmd_sticker
+        super().__init__(host, port, path)
+        for song in self.library[:len(self.library) if queue is None else queue]:
+            self._add(song)
+
+    def _serve(self, sock):
+        conn = _Connection(self, sock)
+        with self.lock:
+            self.connections.append(conn)
+        try:
+            conn.serve()
+        finally:
+            with self.lock:
+                self.connections.remove(conn)
+            conn.close()
+
+    def notify(self, *subsystems):
+        """Sends idle events to all connections"""
+        with self.lock:
+            for conn in self.connections:
+                conn.notify(subsystems)
+
+    # Queue helpers
+    def _add(self, song, pos=None):
+        songid = self.next_id
+        self.next_id += 1
+        if pos is None:
+            pos = len(self.queue)
+        self.queue.insert(pos, (songid, song))
+        self._queue_changed(pos)
+        return songid
+
+    def _queue_changed(self, start):
+        self.playlist_version += 1
+        del self._changed[start:]
+        self._changed += [self.playlist_version] * (len(self.queue) - start)
+
+    def _song(self, uri):
+        song = self._files.get(uri)
+        if song is None:
+            raise Ack(ACK_ERROR_NO_EXIST, 'No such song')
+        return song
+
+    @staticmethod
+    def _queue_entry(pos, songid, song):
+        return song + [('Pos', str(pos)), ('Id', str(songid))]
+
+    @staticmethod
+    def _match(song, filters, exact):
+        for tag, value in filters:
+            tag = tag.lower()
+            values = [val for key, val in song
+                      if tag == 'any' or key.lower() == tag]
+            if exact:
+                if value not in values:
+                    return False
+            elif not any(value.lower() in val.lower() for val in values):
+                return False
+        return True
+
+    @staticmethod
+    def _filters(args):
+        window = None
+        if len(args) >= 2 and args[-2] == 'window':
+            window, args = args[-1], args[:-2]
+        if len(args) % 2:
+            raise Ack(ACK_ERROR_ARG, 'too few arguments')
+        return list(zip(args[::2], args[1::2])), window
+
+    # Status
+    def cmd_ping(self, conn, args):
+        return None
+
+    def cmd_status(self, conn, args):
+        with self.lock:
+            status = list(self.state.items())
+            status += [('partition', 'default'),
+                       ('playlist', str(self.playlist_version)),
+                       ('playlistlength', str(len(self.queue)))]
+            if self.state['state'] != 'stop' and self.queue:
+                status += [('song', '0'), ('songid', str(self.queue[0][0])),
+                           ('elapsed', '1.000')]
+        return status
+
+    def cmd_stats(self, conn, args):
+        artists = {dict(song)['Artist'] for song in self.library}
+        albums = {dict(song)['Album'] for song in self.library}
+        return [('artists', str(len(artists))), ('albums', str(len(albums))),
+                ('songs', str(len(self.library))), ('uptime', '1'),
+                ('db_playtime', str(sum(int(dict(song)['Time'])
+                                        for song in self.library))),
+                ('db_update', self.db_update), ('playtime', '0')]
+
+    def cmd_currentsong(self, conn, args):
+        with self.lock:
+            if self.state['state'] == 'stop' or not self.queue:
+                return None
+            return self._queue_entry(0, *self.queue[0])
+
+    def cmd_commands(self, conn, args):
+        return [('command', name) for name in sorted(self.handlers)]
+
+    def cmd_tagtypes(self, conn, args):
+        return [('tagtype', tag) for tag in ('Artist', 'AlbumArtist', 'Title',
+                                             'Album', 'Track', 'Date', 'Genre')]
+
+    def cmd_binarylimit(self, conn, args):
+        conn.binarylimit = int(args[0])
+
+    def cmd_password(self, conn, args):
+        return None
+
+    # Playback
+    def _set_state(self, state):
+        with self.lock:
+            self.state['state'] = state
+        self.notify('player')
+
+    def cmd_play(self, conn, args):
+        self._set_state('play')
+
+    def cmd_pause(self, conn, args):
+        self._set_state('pause' if not args or args[0] == '1' else 'play')
+
+    def cmd_stop(self, conn, args):
+        self._set_state('stop')
+
+    def cmd_setvol(self, conn, args):
+        with self.lock:
+            self.state['volume'] = args[0]
+        self.notify('mixer')
+
+    def cmd_getvol(self, conn, args):
+        return [('volume', self.state['volume'])]
+
+    # Queue
+    def cmd_add(self, conn, args):
+        with self.lock:
+            uri = args[0]
+            songs = [song for song in self.library
+                     if dict(song)['file'] == uri
+                     or dict(song)['file'].startswith(uri.rstrip('/') + '/')]
+            if not songs:
+                raise Ack(ACK_ERROR_NO_EXIST, 'No such directory')
+            for song in songs:
+                self._add(song)
+        self.notify('playlist')
+
+    def cmd_addid(self, conn, args):
+        with self.lock:
+            song = self._song(args[0])
+            pos = int(args[1]) if len(args) > 1 else None
+            songid = self._add(song, pos)
+        self.notify('playlist')
+        return [('Id', str(songid))]
+
+    def cmd_clear(self, conn, args):
+        with self.lock:
+            self.queue = []
+            self._queue_changed(0)
+        self.notify('playlist')
+
+    def cmd_delete(self, conn, args):
+        with self.lock:
+            start, end = parse_range(args[0], len(self.queue))
+            if start >= len(self.queue):
+                raise Ack(ACK_ERROR_ARG, 'Bad song index')
+            del self.queue[start:end]
+            self._queue_changed(start)
+        self.notify('playlist')
+
+    def cmd_playlistinfo(self, conn, args):
+        with self.lock:
+            start, end = 0, len(self.queue)
+            if args:
+                start, end = parse_range(args[0], len(self.queue))
+                if start >= len(self.queue) and ':' not in args[0]:
+                    raise Ack(ACK_ERROR_ARG, 'Bad song index')
+            response = []
+            for pos in range(start, min(end, len(self.queue))):
+                response += self._queue_entry(pos, *self.queue[pos])
+        return response
+
+    def cmd_playlistid(self, conn, args):
+        with self.lock:
+            for pos, (songid, song) in enumerate(self.queue):
+                if not args or str(songid) == args[0]:
+                    if args:
+                        return self._queue_entry(pos, songid, song)
+            if args:
+                raise Ack(ACK_ERROR_NO_EXIST, 'No such song')
+            return self.cmd_playlistinfo(conn, [])
+
+    def _changes(self, args):
+        version = int(args[0])
+        return [pos for pos, changed in enumerate(self._changed) if changed > version]
+
+    def cmd_plchanges(self, conn, args):
+        with self.lock:
+            response = []
+            for pos in self._changes(args):
+                response += self._queue_entry(pos, *self.queue[pos])
+        return response
+
+    def cmd_plchangesposid(self, conn, args):
+        with self.lock:
+            response = []
+            for pos in self._changes(args):
+                response += [('cpos', str(pos)), ('Id', str(self.queue[pos][0]))]
+        return response
+
+    # Database
+    def _find(self, args, exact):
+        filters, window = self._filters(args)
+        songs = [song for song in self.library if self._match(song, filters, exact)]
+        if window is not None:
+            start, end = parse_range(window, len(songs))
+            songs = songs[start:end]
+        return [pair for song in songs for pair in song]
+
+    def cmd_find(self, conn, args):
+        return self._find(args, True)
+
+    def cmd_search(self, conn, args):
+        return self._find(args, False)
+
+    def cmd_count(self, conn, args):
+        filters, _ = self._filters(args)
+        songs = [song for song in self.library if self._match(song, filters, True)]
+        return [('songs', str(len(songs))),
+                ('playtime', str(sum(int(dict(song)['Time']) for song in songs)))]
+
+    def cmd_list(self, conn, args):
+        if not args:
+            raise Ack(ACK_ERROR_ARG, 'too few arguments')
+        tag, (filters, _) = args[0], self._filters(args[1:])
+        values = set()
+        key = None
+        for song in self.library:
+            if self._match(song, filters, True):
+                for name, value in song:
+                    if name.lower() == tag.lower():
+                        key = name
+                        values.add(value)
+        return [(key, value) for value in sorted(values)]
+
+    def _tree(self, uri, recursive, info):
+        uri = uri.strip('/')
+        prefix = f'{uri}/' if uri else ''
+        response, directories = [], []
+        for song in self.library:
+            path = dict(song)['file']
+            if not path.startswith(prefix):
+                continue
+            parts = path[len(prefix):].split('/')
+            for depth in range(1, len(parts) if recursive else min(len(parts), 2)):
+                directory = prefix + '/'.join(parts[:depth])
+                if directory not in directories:
+                    directories.append(directory)
+                    response += [('directory', directory),
+                                 ('Last-Modified', '2024-03-01T10:00:00Z')]
+            if len(parts) == 1 or recursive:
+                response += song if info else [('file', path)]
+        if uri and not response:
+            raise Ack(ACK_ERROR_NO_EXIST, 'No such directory')
+        return response
+
+    def cmd_lsinfo(self, conn, args):
+        uri = args[0] if args else ''
+        if uri in self._files:
+            return self._files[uri]
+        return self._tree(uri, False, True)
+
+    def cmd_listall(self, conn, args):
+        return self._tree(args[0] if args else '', True, False)
+
+    def cmd_listallinfo(self, conn, args):
+        return self._tree(args[0] if args else '', True, True)
+
+    def cmd_update(self, conn, args):
+        self.db_update = str(int(self.db_update) + 1)
+        self.notify('update', 'database')
+        return [('updating_db', '1')]
+
+    def _picture(self, conn, args, extra):
+        if len(args) != 2:
+            raise Ack(ACK_ERROR_ARG, 'wrong number of arguments')
+        self._song(args[0])
+        offset = int(args[1])
+        picture = bytes(range(256)) * (self.picture_size // 256 + 1)
+        picture = picture[:self.picture_size]
+        chunk = picture[offset:offset + conn.binarylimit]
+        header = f'size: {len(picture)}\n{extra}binary: {len(chunk)}\n'.encode()
+        return header + chunk + b'\n'
+
+    def cmd_albumart(self, conn, args):
+        return self._picture(conn, args, '')
+
+    def cmd_readpicture(self, conn, args):
+        return self._picture(conn, args, 'type: image/png\n')
+
+    def cmd_sticker(self, conn, args):
+        raise Ack(ACK_ERROR_NO_EXIST, 'no such sticker')
+
+    def cmd_outputs(self, conn, args):
+        return [('outputid', '0'), ('outputname', 'null'), ('plugin', 'null'),
+                ('outputenabled', '1')]
+
+
+def read_trace(path):
+    """Reads a :py:obj:`musicpd.TraceRecorder` trace file, returns a list of
+    sessions (one per connection), lists of ``(time, kind, data)`` records
+    with kind ``'W'`` (written by the client) or ``'R'`` (received from MPD).
+    A truncated last record is dropped."""
+    header = musicpd.TraceRecorder.HEADER
+    magic = musicpd.TraceRecorder.MAGIC
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    if not data.startswith(magic):
+        raise ValueError(f'{path}: not a trace file')
+    sessions = []
+    pos = len(magic)
+    while pos + header.size <= len(data):
+        kind, stamp, length = header.unpack_from(data, pos)
+        pos += header.size
+        if pos + length > len(data):
+            break
+        chunk = data[pos:pos + length]
+        pos += length
+        if kind == b'C' or not sessions:
+            sessions.append([])
+        if kind != b'C':
+            sessions[-1].append((stamp, kind.decode(), chunk))
+    return sessions
+
+
+def _recv_exactly(sock, amount):
+    data = bytearray()
+    while len(data) < amount:
+        chunk = sock.recv(amount - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+class TraceReplayer:
+    """Replays the sessions of a trace recorded with
+    :py:obj:`musicpd.TraceRecorder`, either serving MPD's side on a socket
+    (:py:meth:`serve`) or feeding the recorded responses to a client
+    (:py:meth:`run`).
+
+    >>> replayer = musicpd_testing.TraceReplayer('session.trace', speed=None)
+    >>> elapsed = replayer.run(musicpd.MPDClient())
+
+    :param str path: trace file
+    :param float speed: replay speed factor, 1.0 keeps recorded delays,
+      :py:obj:`None` replays as fast as possible
+    :param bool strict: close the connection when the client does not send
+      the recorded bytes (otherwise it is only logged)
+    """
+
+    def __init__(self, path, speed=1.0, strict=False):
+        self.sessions = read_trace(path)
+        self.speed = speed
+        self.strict = strict
+
+    def _wait(self, stamp, previous):
+        if self.speed and previous is not None and stamp > previous:
+            time.sleep((stamp - previous) / self.speed)
+
+    def play(self, sock, session):
+        """Plays MPD's side of a session on a connected socket"""
+        previous = None
+        for stamp, kind, data in session:
+            if kind == 'W':
+                received = _recv_exactly(sock, len(data))
+                if len(received) < len(data):
+                    return
+                if received != data:
+                    log.warning('client sent %r, recorded %r', received, data)
+                    if self.strict:
+                        return
+            else:
+                self._wait(stamp, previous)
+                sock.sendall(data)
+            previous = stamp
+        # Waits for the client to close the connection
+        while sock.recv(65536):
+            pass
+
+    def serve(self, host='127.0.0.1', port=0, path=None):
+        """Returns a server replaying a session to each connection (in the
+        recorded order, looping over them), start it or use it as a
+        context manager like :py:obj:`FakeMPD`"""
+        return _TraceServer(self, host, port, path)
+
+    def run(self, client=None):
+        """Connects the client to a replayed server (over a socket pair) for
+        each session, sends the recorded commands and parses the responses
+        with the client parsers (bypassing its commands methods), returns
+        the elapsed time in seconds"""
+        if client is None:
+            client = musicpd.MPDClient()
+        start = time.perf_counter()
+        for session in self.sessions:
+            server, sock = socket.socketpair()
+            thread = threading.Thread(target=self._play_closing,
+                                      args=(server, session), daemon=True)
+            thread.start()
+            client._connect_socket = lambda host, port: sock
+            try:
+                client.connect('replay', 0)
+            finally:
+                del client._connect_socket
+            try:
+                self._drive(client, session)
+            finally:
+                if client._sock is not None:
+                    client.disconnect()
+                thread.join()
+        return time.perf_counter() - start
+
+    def _play_closing(self, sock, session):
+        try:
+            self.play(sock, session)
+        except OSError as err:
+            log.debug('connection error: %s', err)
+        finally:
+            sock.close()
+
+    @staticmethod
+    def _parser(client, line):
+        """Returns the client parser of a command line response"""
+        words = split_args(line)
+        command = words[0]
+        if len(words) > 1 and f'{command} {words[1]}' in client._commands:
+            command = f'{command} {words[1]}'
+        if command not in client._commands:
+            return lambda cli: list(cli._read_pairs())
+        return client._commands[command]
+
+    def _drive(self, client, session):
+        """Writes the recorded commands and parses each response with the
+        client parsers once it is complete in the recorded stream"""
+        expected = deque()
+        responses = _ResponseCounter()
+        command_list = None
+        previous = None
+        for stamp, kind, data in session:
+            if kind == 'R':
+                previous = stamp
+                for _ in range(responses.feed(data)):
+                    self._parse(client, expected.popleft())
+                continue
+            self._wait(stamp, previous)
+            previous = stamp
+            client._wfile.write(data)
+            client._wfile.flush()
+            for line in data.decode('utf-8', 'surrogateescape').split('\n')[:-1]:
+                if line in ('command_list_begin', 'command_list_ok_begin'):
+                    command_list = []
+                elif line == 'command_list_end':
+                    expected.append(command_list)
+                    command_list = None
+                elif command_list is not None:
+                    command_list.append(self._parser(client, line))
+                elif line not in ('noidle', 'close', 'kill'):
+                    expected.append(self._parser(client, line))
+
+    @staticmethod
+    def _parse(client, parser):
+        try:
+            if isinstance(parser, list):
+                client._command_list = parser
+                client._fetch_command_list()
+            else:
+                result = parser(client)
+                if isinstance(result, types.GeneratorType):
+                    list(result)
+        except musicpd.CommandError:
+            client._command_list = None
+
+
+class _ResponseCounter:
+    """Counts responses ending in a stream received from MPD"""
+
+    def __init__(self):
+        self._line = b''
+        self._skip = 0
+
+    def feed(self, data):
+        """Returns the number of responses ending in data"""
+        ended = 0
+        pos = 0
+        while pos < len(data):
+            if self._skip:
+                skipped = min(self._skip, len(data) - pos)
+                self._skip -= skipped
+                pos += skipped
+                continue
+            eol = data.find(b'\n', pos)
+            if eol < 0:
+                self._line += data[pos:]
+                break
+            line, self._line = self._line + data[pos:eol], b''
+            pos = eol + 1
+            if line.startswith(b'binary: '):
+                # Binary payload and its trailing new line
+                self._skip = int(line[8:]) + 1
+            elif line == b'OK' or line.startswith(b'ACK '):
+                ended += 1
+        return ended
+
+
+class _TraceServer(_Listener):
+
+    def __init__(self, replayer, host, port, path):
+        super().__init__(host, port, path)
+        self.replayer = replayer
+        self._sessions = 0
+
+    def _serve(self, sock):
+        with self.lock:
+            session = self.replayer.sessions[self._sessions % len(self.replayer.sessions)]
+            self._sessions += 1
+        self.replayer.play(sock, session)
+
+# vim: set expandtab shiftwidth=4 softtabstop=4 textwidth=79:
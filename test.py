@@ -10,14 +10,19 @@ Test suite highly borrowed^Wsteal from python-mpd2 [0] project.
 """
 
 
-import itertools
+import asyncio
+import io
 import os
+import socket
+import tempfile
+import time
 import types
 import unittest
 import unittest.mock
 import warnings
 
 import musicpd
+import musicpd_testing
 
 mock = unittest.mock
 
@@ -26,6 +31,21 @@ warnings.simplefilter('default')
 
 
 TEST_MPD_HOST, TEST_MPD_PORT = ('example.com', 10000)
+TEST_MPD_HELLO = b'OK MPD 0.24.0\n'
+
+
+def mock_socket_data(sock, data):
+    """Have sock.recv_into() return data, then as if the socket was
+    disconnected"""
+    stream = io.BytesIO(data)
+    sock.recv_into.side_effect = lambda buf, *args: stream.readinto(buf)
+
+
+def mock_socket(*args, **kwargs):
+    """socket.socket() mock sending MPD hello on connection"""
+    sock = mock.MagicMock(name='socket.socket')
+    mock_socket_data(sock, TEST_MPD_HELLO)
+    return sock
 
 
 class TestEnvVar(unittest.TestCase):
@@ -265,14 +285,12 @@ class TestMPDClient(unittest.TestCase):
         self.socket_mock = self.socket_patch.start()
         self.socket_mock.getaddrinfo.return_value = [range(5)]
 
-        self.socket_mock.socket.side_effect = (
-            lambda *a, **kw:
-            # Create a new socket.socket() mock with default attributes,
-            # each time we are calling it back (otherwise, it keeps set
-            # attributes across calls).
-            # That's probably what we want, since reconnecting is like
-            # reinitializing the entire connection, and so, the mock.
-            mock.MagicMock(name='socket.socket'))
+        # Create a new socket.socket() mock with default attributes, each time
+        # we are calling it back (otherwise, it keeps set attributes across
+        # calls).
+        # That's probably what we want, since reconnecting is like
+        # reinitializing the entire connection, and so, the mock.
+        self.socket_mock.socket.side_effect = mock_socket
 
         self.client = musicpd.MPDClient()
         self.client.connect(TEST_MPD_HOST, TEST_MPD_PORT)
@@ -285,31 +303,16 @@ class TestMPDClient(unittest.TestCase):
     def MPDWillReturn(self, *lines):
         # Return what the caller wants first, then do as if the socket was
         # disconnected.
-        self.client._rfile.readline.side_effect = itertools.chain(
-            lines, itertools.repeat(''))
+        self.MPDWillReturnBinary([line.encode('utf-8') for line in lines])
 
     def MPDWillReturnBinary(self, lines):
-        data = bytearray(b''.join(lines))
-
-        def read(amount):
-            val = bytearray()
-            while amount > 0:
-                amount -= 1
-                # _ = data.pop(0)
-                # print(hex(_))
-                val.append(data.pop(0))
-            return val
-
-        def readline():
-            val = bytearray()
-            while not val.endswith(b'\x0a'):
-                val.append(data.pop(0))
-            return val
-        self.client._rbfile.readline.side_effect = readline
-        self.client._rbfile.read.side_effect = read
+        # Start over with an empty receive buffer
+        self.client._rfile = musicpd._SocketReader(self.client._sock)
+        mock_socket_data(self.client._sock, b''.join(lines))
 
     def assertMPDReceived(self, *lines):
-        self.client._wfile.write.assert_called_with(*lines)
+        self.client._wfile.write.assert_called_with(
+            *[line.encode('utf-8') for line in lines])
 
     def test_metaclass_commands(self):
         """Controls client has at least commands as last synchronized in
@@ -318,6 +321,33 @@ class TestMPDClient(unittest.TestCase):
             self.assertTrue(hasattr(self.client, cmd), msg='cmd "{}" not available!'.format(cmd))
             if ' ' in cmd:
                 self.assertTrue(hasattr(self.client, cmd.replace(' ', '_')))
+                # Not class attributes, which autodoc would pick up
+                self.assertNotIn(cmd, vars(musicpd.MPDClient))
+                self.assertNotIn(f'send_{cmd}', vars(musicpd.MPDClient))
+
+    def test_runtime_commands(self):
+        """Commands added to the table at runtime, with a bound parser"""
+        self.client._commands['new command'] = self.client._fetch_item
+        self.addCleanup(self.client._commands.pop, 'new command')
+        self.MPDWillReturn('value: 42\n', 'OK\n')
+        self.assertEqual(self.client.new_command('arg'), '42')
+        self.assertMPDReceived('new command "arg"\n')
+        self.MPDWillReturn('value: 43\n', 'OK\n')
+        self.client.send_new_command()
+        self.assertEqual(self.client.fetch_new_command(), '43')
+        with self.assertRaises(AttributeError):
+            self.client.missing_command()
+
+        class LoggingClient(musicpd.MPDClient):
+            def __getattr__(self, attr):
+                calls.append(attr)
+                return super().__getattr__(attr)
+        calls = []
+        other = LoggingClient()
+        other._commands['other'] = other._fetch_nothing
+        self.assertNotIn('other', self.client._commands)
+        self.assertTrue(callable(other.other))
+        self.assertEqual(calls, ['other'])
 
     def test_fetch_nothing(self):
         self.MPDWillReturn('OK\n')
@@ -369,6 +399,105 @@ class TestMPDClient(unittest.TestCase):
         self.assertEqual('0', e['pos'])
         self.assertEqual('66', e['id'])
 
+    def test_bulk(self):
+        response = ('directory: foo\n', 'Last-Modified: 2021-01-01\n',
+                    'file: foo/my-song.ogg\n', 'Artist: me\n', 'Artist: you\n',
+                    'file: foo/other.ogg\n', 'Title: ça\n', 'OK\n')
+        self.MPDWillReturn(*response)
+        expected = self.client.lsinfo('foo')
+        self.client.bulk = True
+        self.MPDWillReturn(*response)
+        self.assertEqual(self.client.lsinfo('foo'), expected)
+        self.assertEqual(expected[1]['artist'], ['me', 'you'])
+        self.MPDWillReturn(*response, 'volume: 42\n', 'OK\n')
+        self.client.iterate = True
+        self.assertEqual(list(self.client.lsinfo('foo')), expected)
+        self.assertEqual(self.client.status(), {'volume': '42'})
+        self.client.iterate = False
+        self.MPDWillReturn('OK\n')
+        self.assertEqual(self.client.playlistinfo(), [])
+        self.MPDWillReturn('file: my-song.ogg\n',
+                           'ACK [50@0] {playlistinfo} Bad song index\n')
+        with self.assertRaises(musicpd.CommandError):
+            self.client.playlistinfo()
+        self.MPDWillReturn('file: my-song.ogg\n', 'Pos: 0\n', musicpd.NEXT+'\n',
+                           musicpd.NEXT+'\n', 'OK\n')
+        self.client.command_list_ok_begin()
+        self.client.playlistinfo()
+        self.client.ping()
+        self.assertEqual(self.client.command_list_end(),
+                         [[{'file': 'my-song.ogg', 'pos': '0'}], None])
+        self.MPDWillReturn('file: my-song.ogg\n')
+        with self.assertRaises(musicpd.ConnectionError):
+            self.client.playlistinfo()
+
+    def test_record_factory(self):
+        response = ('directory: foo\n', 'Last-Modified: 2021-01-01\n',
+                    'file: foo/my-song.ogg\n', 'Artist: me\n', 'Artist: you\n',
+                    'MUSICBRAINZ_WORKID: 42\n', 'OK\n')
+        self.MPDWillReturn(*response)
+        expected = self.client.lsinfo('foo')
+        self.client.record_factory = musicpd.SongRecord
+        for bulk in (False, True):
+            self.client.bulk = bulk
+            self.MPDWillReturn(*response)
+            records = self.client.lsinfo('foo')
+            self.assertIsInstance(records[1], musicpd.SongRecord)
+            self.assertEqual(records, expected)
+        song = records[1]
+        self.assertEqual(song.artist, ['me', 'you'])
+        self.assertEqual(song['musicbrainz_workid'], '42')
+        self.assertEqual(records[0]['last-modified'], '2021-01-01')
+        self.assertNotIn('title', song)
+        self.assertIsNone(song.get('title'))
+        with self.assertRaises(KeyError):
+            song['title']
+        self.assertFalse(hasattr(song, '__dict__'))
+        # outputs and others are left untouched
+        self.MPDWillReturn('outputid: 0\n', 'OK\n')
+        self.assertEqual(self.client.outputs(), [{'outputid': '0'}])
+
+    def test_interning(self):
+        response = ('file: a.ogg\n', 'Artist: me\n', 'Title: same\n', 'Foo: x\n',
+                    'file: b.ogg\n', 'Artist: me\n', 'Title: same\n', 'Foo: x\n',
+                    'OK\n')
+        for bulk in (False, True):
+            self.client.bulk = bulk
+            self.MPDWillReturn(*response)
+            first, second = self.client.playlistinfo()
+            self.assertEqual(first, {'file': 'a.ogg', 'artist': 'me',
+                                     'title': 'same', 'foo': 'x'})
+            self.assertIs(first['artist'], second['artist'])
+            keys = [list(first), list(second)]
+            for key, other in zip(*keys):
+                self.assertEqual(key, other)
+            self.assertIs(keys[0][1], keys[1][1])
+
+    def test_columns(self):
+        self.MPDWillReturn('directory: foo\n', 'Last-Modified: 2021-01-01\n',
+                           'file: foo/a.ogg\n', 'Artist: me\n', 'Artist: you\n',
+                           'Time: 42\n', 'duration: 42.5\n',
+                           'file: foo/b.ogg\n', 'Title: b\n', 'OK\n')
+        cols = self.client.columns('lsinfo', 'foo')
+        self.assertMPDReceived('lsinfo "foo"\n')
+        self.assertEqual(cols['directory'], ['foo', None, None])
+        self.assertEqual(cols['file'], [None, 'foo/a.ogg', 'foo/b.ogg'])
+        self.assertEqual(cols['artist'], [None, ['me', 'you'], None])
+        self.assertEqual(cols['title'], [None, None, 'b'])
+        self.assertEqual(cols['time'].tolist(), [-1, 42, -1])
+        self.assertEqual(cols['duration'][1], 42.5)
+        self.assertNotEqual(cols['duration'][0], cols['duration'][0])  # NaN
+        self.MPDWillReturn('file: a.ogg\n', 'Pos: 0\n', 'Id: 66\n', 'Title: a\n',
+                           'file: b.ogg\n', 'Pos: 1\n', 'Id: 67\n', 'OK\n')
+        cols = self.client.columns('playlistinfo', (0, 2), tags=['file', 'id'])
+        self.assertMPDReceived('playlistinfo 0:2\n')
+        self.assertEqual(set(cols), {'file', 'id'})
+        self.assertEqual(cols['id'].tolist(), [66, 67])
+        self.MPDWillReturn('OK\n')
+        self.assertEqual(self.client.columns('find', '(artist == "none")'), {})
+        with self.assertRaises(musicpd.CommandError):
+            self.client.columns('status')
+
     def test_send_and_fetch(self):
         self.MPDWillReturn('volume: 50\n', 'OK\n')
         result = self.client.send_status()
@@ -481,6 +610,22 @@ class TestMPDClient(unittest.TestCase):
         self.client.find('file', 1)
         self.assertMPDReceived('find "file" "1"\n')
 
+    def test_encode_command(self):
+        encode = musicpd._encode_command
+        self.assertEqual(encode('find', ['artist', 'Sigur Rós', 12]),
+                         'find "artist" "Sigur Rós" "12"\n'.encode('utf-8'))
+        self.assertEqual(encode('find', ['file', 'a "b" \\c']),
+                         b'find "file" "a \\"b\\" \\\\c"\n')
+        self.assertEqual(encode('playlistinfo', [(1, 5)]), b'playlistinfo 1:5\n')
+        # Undecodable bytes received from MPD are sent back as is
+        self.assertEqual(encode('lsinfo', [b'caf\xe9'.decode('utf-8', 'surrogateescape')]),
+                         b'lsinfo "caf\xe9"\n')
+        # Commands without arguments are cached
+        self.assertIs(encode('status'), encode('status', []))
+        for args in (['foo\nstatus'], [('1', '\n')]):
+            with self.assertRaises(musicpd.CommandError):
+                encode('find', args)
+
     def test_commands_without_callbacks(self):
         self.MPDWillReturn('\n')
         self.client.close()
@@ -537,6 +682,285 @@ class TestMPDClient(unittest.TestCase):
         res = self.client.readpicture('muse/Raised Fist/2002-Dedication/', 0)
         self.assertEqual(res, {})
 
+    def cover_responses(self, data, chunk):
+        responses = []
+        for offset in range(0, len(data), chunk):
+            part = data[offset:offset + chunk]
+            responses += [f'size: {len(data)}\nbinary: {len(part)}\n'.encode(),
+                          part, b'\nOK\n']
+        return responses
+
+    def test_cover(self):
+        data = bytes(range(256)) * 4
+        # Chunks are requested ahead
+        self.MPDWillReturnBinary(self.cover_responses(data, 300))
+        res = self.client.cover('foo', pipeline=2)
+        self.assertEqual(res, {'size': '1024', 'data': data})
+        self.assertEqual([call[0][0] for call in self.client._wfile.write.call_args_list],
+                         [b'albumart "foo" "0"\n', b'albumart "foo" "300"\n',
+                          b'albumart "foo" "600"\n', b'albumart "foo" "900"\n'])
+        # Read into a buffer
+        self.MPDWillReturnBinary(self.cover_responses(data, 300))
+        buffer = bytearray(2048)
+        self.assertEqual(self.client.cover('foo', buffer), {'size': '1024'})
+        self.assertEqual(buffer[:1024], data)
+        self.MPDWillReturnBinary(self.cover_responses(data, 300))
+        with self.assertRaises(ValueError):
+            self.client.cover('foo', bytearray(10))
+        # Remaining responses were drained
+        self.MPDWillReturn('OK\n')
+        self.assertIsNone(self.client.ping())
+        # Written to a file
+        self.MPDWillReturnBinary(self.cover_responses(data, 1000))
+        sink = io.BytesIO()
+        self.client.cover('foo', sink, command='readpicture')
+        self.assertEqual(sink.getvalue(), data)
+        # No picture
+        self.MPDWillReturnBinary([b'OK\n'])
+        self.assertEqual(self.client.cover('foo', sink, command='readpicture'), {})
+
+    def test_cover_chunks(self):
+        data = bytes(range(256)) * 4
+        self.MPDWillReturnBinary(self.cover_responses(data, 500))
+        self.assertEqual(list(self.client.cover_chunks('foo')),
+                         [data[:500], data[500:1000], data[1000:]])
+        # Closing the generator early drains the pending responses
+        self.MPDWillReturnBinary(self.cover_responses(data, 500) + [b'OK\n'])
+        chunks = self.client.cover_chunks('foo')
+        self.assertEqual(next(chunks), data[:500])
+        with self.assertRaises(musicpd.IteratingError):
+            self.client.ping()
+        chunks.close()
+        self.assertIsNone(self.client.ping())
+
+    def test_cover_cache(self):
+        data = bytes(range(256)) * 4
+        song = {'file': 'album/01.flac', 'last-modified': '2024-03-01T10:00:00Z'}
+        with tempfile.TemporaryDirectory() as path:
+            covers = musicpd.CoverCache(path, max_bytes=2048)
+            self.MPDWillReturnBinary(self.cover_responses(data, 600))
+            self.assertEqual(covers.get(self.client, song)[:], data)
+            self.assertMPDReceived('albumart "album/01.flac" "600"\n')
+            # Served from the cache for the whole directory
+            self.client._wfile.write.reset_mock()
+            other = dict(song, file='album/02.flac')
+            self.assertEqual(covers.get(self.client, other)[:], data)
+            self.client._wfile.write.assert_not_called()
+            # last-modified is looked up with a song URI
+            self.MPDWillReturn('file: album/02.flac\n',
+                               'Last-Modified: 2024-03-01T10:00:00Z\n', 'OK\n')
+            self.assertEqual(covers.get(self.client, 'album/02.flac')[:], data)
+            self.assertMPDReceived('lsinfo "album/02.flac"\n')
+            # No picture
+            self.MPDWillReturnBinary([b'OK\n'])
+            self.assertIsNone(covers.get(self.client, song, command='readpicture'))
+            self.MPDWillReturn('ACK [50@0] {albumart} No file exists\n')
+            self.assertIsNone(covers.get(self.client, dict(song, file='b/01.flac')))
+            # Least recently used picture is evicted
+            self.MPDWillReturnBinary(self.cover_responses(data[:1000], 600))
+            self.assertEqual(covers.get(self.client, dict(song, file='c/01.flac'))[:],
+                             data[:1000])
+            self.MPDWillReturnBinary(self.cover_responses(data[:800], 600))
+            covers.get(self.client, dict(song, file='d/01.flac'))
+            self.assertEqual(covers.stats(), {'pictures': 2, 'bytes': 1800})
+            self.assertEqual(len(os.listdir(path)), 2)
+            # Index is restored from the directory
+            self.assertEqual(musicpd.CoverCache(path).stats(), covers.stats())
+            # Errors other than a missing file keep the cached picture
+            restored = musicpd.CoverCache(path, max_maps=1)
+            with mock.patch('musicpd.mmap.mmap', side_effect=OSError(24, 'EMFILE')):
+                with self.assertRaises(OSError):
+                    restored.get(self.client, dict(song, file='c/01.flac'))
+            self.assertEqual(restored.stats(), covers.stats())
+            # Only the most recently used pictures stay mapped
+            restored.get(self.client, dict(song, file='c/01.flac'))
+            restored.get(self.client, dict(song, file='d/01.flac'))
+            self.assertEqual(len(restored._maps), 1)
+            covers.clear()
+            self.assertEqual(os.listdir(path), [])
+
+    def test_cover_cache_entries(self):
+        data = bytes(range(256)) * 8
+        song = {'file': 'a/01.flac', 'last-modified': '2024-03-01T10:00:00Z'}
+        with tempfile.TemporaryDirectory() as path:
+            # Stale temporary files are removed, recent ones left alone
+            stale, recent = (os.path.join(path, f'{name}.1-2.tmp')
+                             for name in ('stale', 'recent'))
+            for tmp in (stale, recent):
+                with open(tmp, 'wb') as tmp_file:
+                    tmp_file.write(b'partial')
+            os.utime(stale, (time.time() - 7200,) * 2)
+            covers = musicpd.CoverCache(path, max_bytes=2048)
+            self.assertEqual(sorted(os.listdir(path)), ['recent.1-2.tmp'])
+            self.assertEqual(covers.stats(), {'pictures': 0, 'bytes': 0})
+            os.remove(recent)
+            # Refilled pictures become the most recently used
+            self.MPDWillReturnBinary(self.cover_responses(data[:1000], 1000))
+            covers.get(self.client, song)
+            self.MPDWillReturnBinary(self.cover_responses(data[:1000], 1000))
+            covers.get(self.client, dict(song, file='b/01.flac'))
+            name = covers._key(song['file'], song['last-modified'], 'albumart')
+            self.MPDWillReturnBinary(self.cover_responses(data[:1500], 1500))
+            self.assertEqual(covers._fill(self.client, song['file'], name, 'albumart')[:],
+                             data[:1500])
+            self.assertEqual(covers.stats(), {'pictures': 1, 'bytes': 1500})
+            # Empty pictures are not mapped
+            self.MPDWillReturnBinary([b'size: 0\nbinary: 0\n\nOK\n'])
+            self.assertEqual(covers.get(self.client, dict(song, file='c/01.flac')), b'')
+            self.assertEqual(covers.get(self.client, dict(song, file='c/02.flac')), b'')
+            # last-modified lookup while iterating
+            self.client.iterate = True
+            self.MPDWillReturn('file: c/03.flac\n',
+                               'Last-Modified: 2024-03-01T10:00:00Z\n', 'OK\n')
+            self.assertEqual(covers.get(self.client, 'c/03.flac'), b'')
+
+    def test_cache_responses(self):
+        self.client.cache_responses = True
+        self.MPDWillReturn('volume: 42\n', 'OK\n')
+        status = self.client.status()
+        self.assertEqual(status, {'volume': '42'})
+        status['volume'] = '0'
+        # Served from the cache
+        self.client._wfile.write.reset_mock()
+        self.assertEqual(self.client.status(), {'volume': '42'})
+        self.client._wfile.write.assert_not_called()
+        # Cached by arguments
+        self.MPDWillReturn('songs: 2\n', 'OK\n')
+        self.assertEqual(self.client.count('artist', 'foo'), {'songs': '2'})
+        self.assertEqual(self.client.count('artist', 'foo'), {'songs': '2'})
+        self.assertEqual(self.client._wfile.write.call_count, 1)
+        # Invalidated by idle responses naming the command subsystems
+        self.MPDWillReturn('changed: mixer\n', 'OK\n')
+        self.assertEqual(self.client.idle(), ['mixer'])
+        self.assertEqual(list(self.client._cache), [('count', ('artist', 'foo'))])
+        self.MPDWillReturn('changed: database\n', 'OK\n')
+        self.client.send_idle()
+        self.client.noidle()
+        self.assertEqual(self.client._cache, {})
+        # Invalidated by commands changing MPD state
+        self.MPDWillReturn('volume: 42\n', 'OK\n', 'OK\n', 'volume: 10\n', 'OK\n')
+        self.client.status()
+        self.client.setvol(10)
+        self.assertEqual(self.client.status(), {'volume': '10'})
+        # Disabled by default
+        self.client.cache_responses = False
+        self.MPDWillReturn('volume: 5\n', 'OK\n')
+        self.assertEqual(self.client.status(), {'volume': '5'})
+
+    def test_library_mirror(self):
+        mirror = musicpd.LibraryMirror(':memory:')
+        self.MPDWillReturn('db_update: 1\n', 'OK\n',
+                           'directory: a\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'file: a/1.flac\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'Artist: Foo\n', 'Artist: Bar\n', 'Title: One\n',
+                           'duration: 100.5\n',
+                           'directory: b\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'file: b/2.flac\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'Artist: Baz\n', 'Title: Two\n', 'duration: 200\n',
+                           'directory: b/c\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'file: b/c/3.flac\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'Artist: Baz\n', 'Title: Three\n', 'duration: 50\n',
+                           'OK\n')
+        self.assertTrue(mirror.sync(self.client))
+        self.assertMPDReceived('listallinfo\n')
+        self.assertEqual(mirror.db_update, '1')
+        self.assertEqual(mirror.find('artist', 'Foo'),
+                         [{'file': 'a/1.flac', 'last-modified': '2024-01-01T00:00:00Z',
+                           'artist': ['Foo', 'Bar'], 'title': 'One',
+                           'duration': '100.5'}])
+        self.assertEqual([s['file'] for s in mirror.search('any', 'ba')],
+                         ['a/1.flac', 'b/2.flac', 'b/c/3.flac'])
+        self.assertEqual([s['file'] for s in mirror.search('file', 'C/')], ['b/c/3.flac'])
+        self.assertEqual([s['file'] for s in mirror.find('base', 'b', 'title', 'Two')],
+                         ['b/2.flac'])
+        self.assertEqual(mirror.list('artist'), ['Bar', 'Baz', 'Foo'])
+        self.assertEqual(mirror.list('title', 'artist', 'Baz'), ['Three', 'Two'])
+        self.assertEqual(mirror.count('artist', 'Baz'), {'songs': '2', 'playtime': '250'})
+        self.assertEqual(mirror.count(), {'songs': '3', 'playtime': '350'})
+        with self.assertRaises(musicpd.CommandError):
+            mirror.find('artist')
+        # Nothing changed
+        self.MPDWillReturn('db_update: 1\n', 'OK\n')
+        self.assertFalse(mirror.sync(self.client))
+        # Only changed songs are written, b/c was removed
+        self.MPDWillReturn('db_update: 2\n', 'OK\n',
+                           'directory: a\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'file: a/1.flac\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'Artist: Foo\n', 'Artist: Bar\n', 'Title: One\n',
+                           'duration: 100.5\n',
+                           'directory: b\n', 'Last-Modified: 2024-02-01T00:00:00Z\n',
+                           'file: b/2.flac\n', 'Last-Modified: 2024-01-01T00:00:00Z\n',
+                           'Artist: Baz\n', 'Title: Two\n', 'duration: 200\n',
+                           'file: b/4.flac\n', 'Last-Modified: 2024-02-01T00:00:00Z\n',
+                           'Artist: Qux\n', 'Title: Four\n', 'duration: 10\n',
+                           'OK\n')
+        song_id = mirror._db.execute(
+            "SELECT id FROM songs WHERE file = 'a/1.flac'").fetchone()
+        self.assertTrue(mirror.sync(self.client))
+        self.assertMPDReceived('listallinfo\n')
+        self.assertEqual(mirror._db.execute(
+            "SELECT id FROM songs WHERE file = 'a/1.flac'").fetchone(), song_id)
+        self.assertEqual(mirror._db.execute(
+            'SELECT path FROM directories ORDER BY path').fetchall(), [('a',), ('b',)])
+        self.assertEqual(mirror.list('file'), ['a/1.flac', 'b/2.flac', 'b/4.flac'])
+        self.assertEqual(mirror.list('artist'), ['Bar', 'Baz', 'Foo', 'Qux'])
+        self.assertEqual(mirror.db_update, '2')
+        # Tags of removed songs are gone
+        self.assertEqual(mirror._db.execute('SELECT count(*) FROM tags').fetchone(), (13,))
+        mirror.close()
+
+    def test_queue_mirror(self):
+        queue = musicpd.QueueMirror()
+        self.MPDWillReturn('playlist: 4\n', 'playlistlength: 3\n', 'list_OK\n',
+                           'file: a\n', 'Pos: 0\n', 'Id: 1\n',
+                           'file: b\n', 'Pos: 1\n', 'Id: 2\n',
+                           'file: c\n', 'Pos: 2\n', 'Id: 3\n', 'list_OK\n', 'OK\n')
+        self.assertTrue(queue.sync(self.client))
+        self.assertEqual([song['file'] for song in queue], ['a', 'b', 'c'])
+        self.assertEqual(queue.version, '4')
+        # Unchanged
+        self.MPDWillReturn('playlist: 4\n', 'playlistlength: 3\n', 'list_OK\n',
+                           'list_OK\n', 'OK\n')
+        self.assertFalse(queue.sync(self.client))
+        self.assertMPDReceived('command_list_ok_begin\nstatus\nplchanges "4"\n'
+                               'command_list_end\n')
+        # c moved first, a deleted, d added
+        self.MPDWillReturn('playlist: 7\n', 'playlistlength: 3\n', 'list_OK\n',
+                           'file: c\n', 'Pos: 0\n', 'Id: 3\n',
+                           'file: b\n', 'Pos: 1\n', 'Id: 2\n',
+                           'file: d\n', 'Pos: 2\n', 'Id: 4\n', 'list_OK\n', 'OK\n')
+        self.assertTrue(queue.sync(self.client))
+        self.assertEqual([song['file'] for song in queue], ['c', 'b', 'd'])
+        self.assertEqual(queue.get_id(3)['pos'], '0')
+        self.assertIsNone(queue.get_id(1))
+        # Deleted last song
+        self.MPDWillReturn('playlist: 8\n', 'playlistlength: 2\n', 'list_OK\n',
+                           'list_OK\n', 'OK\n')
+        self.assertTrue(queue.sync(self.client))
+        self.assertEqual(len(queue), 2)
+        self.assertIsNone(queue.get_id(4))
+        self.assertEqual(queue[1]['file'], 'b')
+
+    def test_queue_mirror_posid(self):
+        queue = musicpd.QueueMirror(posid=True)
+        self.MPDWillReturn('playlist: 4\n', 'playlistlength: 3\n', 'list_OK\n',
+                           'file: a\n', 'Pos: 0\n', 'Id: 1\n',
+                           'file: b\n', 'Pos: 1\n', 'Id: 2\n',
+                           'file: c\n', 'Pos: 2\n', 'Id: 3\n', 'list_OK\n', 'OK\n')
+        queue.sync(self.client)
+        # c moved to the front, b deleted, new song after a
+        self.MPDWillReturn('playlist: 7\n', 'playlistlength: 3\n', 'list_OK\n',
+                           'cpos: 0\n', 'Id: 3\n', 'cpos: 1\n', 'Id: 1\n',
+                           'cpos: 2\n', 'Id: 5\n', 'list_OK\n', 'OK\n',
+                           'file: e\n', 'Pos: 2\n', 'Id: 5\n', 'list_OK\n', 'OK\n')
+        self.assertTrue(queue.sync(self.client))
+        self.assertMPDReceived('command_list_ok_begin\nplaylistid "5"\n'
+                               'command_list_end\n')
+        self.assertEqual([song['file'] for song in queue], ['c', 'a', 'e'])
+        self.assertEqual([queue.get_id(songid)['pos'] for songid in (3, 1, 5)],
+                         ['0', '1', '2'])
+        self.assertIsNone(queue.get_id(2))
+
     def test_command_list(self):
         self.MPDWillReturn('updating_db: 42\n',
                            f'{musicpd.NEXT}\n',
@@ -549,8 +973,69 @@ class TestMPDClient(unittest.TestCase):
         self.client.update()
         self.client.status()
         self.client.repeat(1)
+        self.client._wfile.write.assert_not_called()
         self.client.command_list_end()
-        self.assertMPDReceived('command_list_end\n')
+        # Command list is sent at once
+        self.assertEqual(1, self.client._wfile.write.call_count)
+        self.assertMPDReceived('command_list_ok_begin\nupdate\nstatus\n'
+                               'repeat "1"\ncommand_list_end\n')
+
+    def test_command_batch(self):
+        self.MPDWillReturn(*['list_OK\n', 'list_OK\n', 'OK\n'] * 2,
+                           'updating_db: 42\n', 'list_OK\n', 'OK\n')
+        uris = ['a', 'b', 'c', 'd']
+        commands = [('add', uri) for uri in uris] + [('update',)]
+        self.assertEqual(self.client.command_batch(commands, max_commands=2),
+                         [None] * 4 + ['42'])
+        self.assertEqual(3, self.client._wfile.write.call_count)
+        self.assertMPDReceived('command_list_ok_begin\nupdate\ncommand_list_end\n')
+        # byte budget
+        self.MPDWillReturn(*['list_OK\n', 'OK\n'] * 2)
+        self.client.command_batch([('sticker_set', 'song', 'a', 'rating', '5'),
+                                   ('sticker set', 'song', 'b', 'rating', '5')],
+                                  max_bytes=80)
+        self.assertMPDReceived('command_list_ok_begin\n'
+                               'sticker set "song" "b" "rating" "5"\n'
+                               'command_list_end\n')
+        # Error in the second command list, the third one is read anyway
+        self.MPDWillReturn('list_OK\n', 'OK\n',
+                           'ACK [50@0] {add} No such directory\n',
+                           'list_OK\n', 'OK\n',
+                           'OK\n')
+        with self.assertRaises(musicpd.CommandError):
+            self.client.command_batch([('add', uri) for uri in uris[:3]],
+                                      max_commands=1)
+        self.assertIsNone(self.client.ping())
+        with self.assertRaises(musicpd.CommandListError):
+            self.client.command_batch([('close',)])
+        # Same guards as columns and cover
+        self.client.send_status()
+        for call in (lambda: self.client.command_batch([('ping',)]),
+                     lambda: self.client.columns('playlistinfo'),
+                     lambda: list(self.client.cover_chunks('foo'))):
+            with self.assertRaises(musicpd.PendingCommandError) as err:
+                call()
+            self.assertRegex(str(err.exception), '^Cannot use .* with pending commands$')
+
+    def test_paginate(self):
+        page = ['file: a\n', 'file: b\n', 'OK\n']
+        self.MPDWillReturn(*page, *page, 'file: c\n', 'OK\n')
+        songs = self.client.paginate('find', '(artist == "me")', 'sort', 'Title',
+                                     page_size=2)
+        self.assertEqual(next(songs), {'file': 'a'})
+        self.assertMPDReceived('find "(artist == \\"me\\")" "sort" "Title" "window" 0:2\n')
+        self.assertEqual(len(list(songs)), 4)
+        self.assertMPDReceived('find "(artist == \\"me\\")" "sort" "Title" "window" 4:6\n')
+        self.MPDWillReturn(*page, 'OK\n')
+        self.assertEqual(len(list(self.client.paginate('playlistinfo', page_size=2))), 2)
+        self.assertMPDReceived('playlistinfo 2:4\n')
+        self.MPDWillReturn('OK\n')
+        list(self.client.paginate('listplaylistinfo', 'foo'))
+        self.assertMPDReceived('listplaylistinfo "foo" 0:1000\n')
+        with self.assertRaises(musicpd.CommandError):
+            list(self.client.paginate('status'))
+        with self.assertRaises(musicpd.CommandError):
+            list(self.client.paginate('search', 'any', 'foo', 'window', (0, 2)))
 
     def test_two_word_commands(self):
         self.MPDWillReturn('OK\n')
@@ -560,11 +1045,64 @@ class TestMPDClient(unittest.TestCase):
         with self.assertRaises(AttributeError):
             self.client.foo_bar()
 
+
+class TestSocketReader(unittest.TestCase):
+
+    def reader(self, data, chunk=3, bufsize=8):
+        # socket receiving at most chunk bytes per recv_into call
+        stream = io.BytesIO(data)
+        sock = mock.MagicMock(name='socket')
+        sock.recv_into.side_effect = lambda buf, *args: stream.readinto(buf[:chunk])
+        return musicpd._SocketReader(sock, bufsize=bufsize)
+
+    def test_readline(self):
+        reader = self.reader(b'file: song.ogg\nArtist: \xc3\xa9t\xc3\xa9\nOK\nunfinished')
+        self.assertEqual(reader.readline(), 'file: song.ogg')
+        self.assertEqual(reader.readline(), 'Artist: été')
+        self.assertEqual(reader.readline(), 'OK')
+        self.assertIsNone(reader.readline())
+
+    def test_mixed_binary(self):
+        payload = bytes(range(256)) * 3
+        data = b'size: 768\nbinary: 768\n' + payload + b'\nOK\n'
+        reader = self.reader(data, chunk=100, bufsize=16)
+        self.assertEqual(reader.readline(), 'size: 768')
+        self.assertEqual(reader.readline(), 'binary: 768')
+        self.assertEqual(reader.read(768), payload)
+        self.assertEqual(reader.readline(), '')
+        self.assertEqual(reader.readline(), 'OK')
+        reader = self.reader(data, chunk=100, bufsize=16)
+        reader.readline()
+        reader.readline()
+        buf = bytearray(768)
+        self.assertEqual(reader.readinto(buf), 768)
+        self.assertEqual(buf, payload)
+        self.assertEqual(reader.readline(), '')
+        self.assertEqual(reader.read(42), b'OK\n')
+
+    def test_readblock(self):
+        data = (b'file: a\nTitle: b\nOK\n'
+                b'OK\n'
+                b'ACK [5@0] {} unknown command "foo"\n'
+                b'file: c\nACK [50@0] {find} error\n'
+                b'file: d\nlist_OK\n')
+        for chunk in (1, 3, 1024):
+            reader = self.reader(data, chunk=chunk, bufsize=4)
+            self.assertEqual(reader.readblock('OK'), ('file: a\nTitle: b', None))
+            self.assertEqual(reader.readblock('OK'), ('', None))
+            self.assertEqual(reader.readblock('OK'),
+                             ('', '[5@0] {} unknown command "foo"'))
+            self.assertEqual(reader.readblock('OK'),
+                             ('file: c', '[50@0] {find} error'))
+            self.assertEqual(reader.readblock('list_OK'), ('file: d', None))
+            self.assertIsNone(reader.readblock('OK'))
+
+
 class TestConnection(unittest.TestCase):
 
     def test_exposing_fileno(self):
         with mock.patch('musicpd.socket') as socket_mock:
-            sock = mock.MagicMock(name='socket')
+            sock = mock_socket()
             socket_mock.socket.return_value = sock
             cli = musicpd.MPDClient()
             cli.connect()
@@ -574,7 +1112,7 @@ class TestConnection(unittest.TestCase):
     def test_connect_abstract(self):
         os.environ['MPD_HOST'] = '@abstract'
         with mock.patch('musicpd.socket') as socket_mock:
-            sock = mock.MagicMock(name='socket')
+            sock = mock_socket()
             socket_mock.socket.return_value = sock
             cli = musicpd.MPDClient()
             cli.connect()
@@ -583,7 +1121,7 @@ class TestConnection(unittest.TestCase):
     def test_connect_unix(self):
         os.environ['MPD_HOST'] = '/run/mpd/socket'
         with mock.patch('musicpd.socket') as socket_mock:
-            sock = mock.MagicMock(name='socket')
+            sock = mock_socket()
             socket_mock.socket.return_value = sock
             cli = musicpd.MPDClient()
             cli.connect()
@@ -591,7 +1129,7 @@ class TestConnection(unittest.TestCase):
 
     def test_sockettimeout(self):
         with mock.patch('musicpd.socket') as socket_mock:
-            sock = mock.MagicMock(name='socket')
+            sock = mock_socket()
             socket_mock.socket.return_value = sock
             cli = musicpd.MPDClient()
             # Default is no socket timeout
@@ -600,6 +1138,7 @@ class TestConnection(unittest.TestCase):
             cli.disconnect()
             # set a socket timeout before connection
             cli.socket_timeout = 10
+            mock_socket_data(sock, TEST_MPD_HELLO)
             cli.connect()
             sock.settimeout.assert_called_with(10)
             # Set socket timeout while already connected
@@ -622,6 +1161,696 @@ class TestConnection(unittest.TestCase):
                 cli.socket_timeout = '-1'
 
 
+class TestAsyncMPDClient(unittest.TestCase):
+
+    responses = {
+        b'status': b'volume: 42\nstate: play\nOK\n',
+        b'ping': b'OK\n',
+        b'playlistinfo': (b'file: a.ogg\nPos: 0\nId: 1\n'
+                          b'file: b.ogg\nPos: 1\nId: 2\nOK\n'),
+        b'playlistinfo 0:5': (b'file: a.ogg\nPos: 0\nId: 1\n'
+                              b'file: b.ogg\nPos: 1\nId: 2\nOK\n'),
+        b'albumart "a" "0"': b'size: 3\nbinary: 3\n\x00\n\x01\nOK\n',
+        b'albumart "b" "0"': b'size: 5\nbinary: 2\n\x00\n\nOK\n',
+        b'albumart "b" "2"': b'size: 5\nbinary: 2\n\x01\n\nOK\n',
+        b'albumart "b" "4"': b'size: 5\nbinary: 1\n\x02\nOK\n',
+        b'find "foo"': b'ACK [2@0] {find} too few arguments for "find"\n',
+        b'idle "player"': b'changed: player\nOK\n',
+        b'config': b'music_directory: /' + b'a' * 100 + b'\nOK\n',
+    }
+
+    async def serve(self, reader, writer):
+        writer.write(TEST_MPD_HELLO)
+        command_list = None
+        while True:
+            line = (await reader.readline()).rstrip(b'\n')
+            if not line:
+                break
+            if line == b'command_list_ok_begin':
+                command_list = []
+            elif line == b'command_list_end':
+                for cmd in command_list:
+                    writer.write(self.responses[cmd][:-3] + b'list_OK\n')
+                writer.write(b'OK\n')
+                command_list = None
+            elif command_list is not None:
+                command_list.append(line)
+            elif line == b'idle':
+                # Waits for noidle
+                await reader.readline()
+                writer.write(b'OK\n')
+            else:
+                writer.write(self.responses[line])
+        writer.close()
+
+    def run_client(self, scenario, cli=None):
+        async def main():
+            server = await asyncio.start_server(self.serve, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                await cli.connect('127.0.0.1', port)
+                await scenario(cli)
+            finally:
+                if cli._sock is not None:
+                    cli.disconnect()
+                await asyncio.sleep(0.01)
+                server.close()
+                await server.wait_closed()
+        if cli is None:
+            cli = musicpd.AsyncMPDClient()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(main())
+        finally:
+            loop.close()
+
+    def test_interrupted_response(self):
+        async def scenario(cli):
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(cli.idle(), 0.05)
+            self.assertIsNone(cli._sock)
+            await cli.connect()
+            with self.assertRaises(asyncio.LimitOverrunError):
+                await cli.config()
+            self.assertIsNone(cli._sock)
+
+        cli = musicpd.AsyncMPDClient()
+        cli.line_limit = 64
+        self.run_client(scenario, cli)
+
+    def test_recorder(self):
+        async def scenario(cli):
+            await cli.ping()
+            await cli.command_list_ok_begin()
+            await cli.status()
+            await cli.command_list_end()
+            cli.instrument = musicpd.CommandMetrics()
+            with self.assertRaises(musicpd.MPDError):
+                await cli.ping()
+            cli.instrument = None
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'async.trace')
+            cli = musicpd.AsyncMPDClient()
+            with musicpd.TraceRecorder(path) as recorder:
+                cli.recorder = recorder
+                self.run_client(scenario, cli)
+            session, = musicpd_testing.read_trace(path)
+            self.assertEqual([(kind, data) for _, kind, data in session], [
+                ('R', TEST_MPD_HELLO), ('W', b'ping\n'), ('R', b'OK\n'),
+                ('W', b'command_list_ok_begin\nstatus\ncommand_list_end\n'),
+                ('R', b'volume: 42\nstate: play\nlist_OK\nOK\n')])
+
+    def test_commands(self):
+        async def scenario(cli):
+            self.assertEqual(cli.mpd_version, '0.24.0')
+            self.assertEqual(await cli.status(), {'volume': '42', 'state': 'play'})
+            self.assertIsNone(await cli.ping())
+            songs = await cli.playlistinfo()
+            self.assertEqual([s['id'] for s in songs], ['1', '2'])
+            await cli.send_status()
+            self.assertEqual((await cli.fetch_status())['volume'], '42')
+            self.assertEqual((await cli.albumart('a', 0))['data'], b'\x00\n\x01')
+            self.assertEqual(await cli.cover('b'), {'size': '5', 'data': b'\x00\n\x01\n\x02'})
+            self.assertEqual([chunk async for chunk in cli.cover_chunks('b', pipeline=1)],
+                             [b'\x00\n', b'\x01\n', b'\x02'])
+            with self.assertRaises(musicpd.CommandError):
+                await cli.find('foo')
+            songs = [song async for song in cli.paginate('playlistinfo', page_size=5)]
+            self.assertEqual(len(songs), 2)
+            cols = await cli.columns('playlistinfo')
+            self.assertEqual(cols['pos'].tolist(), [0, 1])
+            self.assertEqual(await cli.command_batch([('ping',), ('status',), ('ping',)],
+                                                     max_commands=2),
+                             [None, {'volume': '42', 'state': 'play'}, None])
+            await cli.command_list_ok_begin()
+            await cli.ping()
+            await cli.status()
+            self.assertEqual(await cli.command_list_end(),
+                             [None, {'volume': '42', 'state': 'play'}])
+        self.run_client(scenario)
+
+    def test_idle(self):
+        async def scenario(cli):
+            async for changes in cli.idle_events('player'):
+                self.assertEqual(changes, ['player'])
+                break
+            # noidle from another task
+            task = asyncio.ensure_future(cli.idle())
+            await asyncio.sleep(0.05)
+            self.assertIsNone(await cli.noidle())
+            self.assertEqual(await task, [])
+            # noidle after send_idle
+            await cli.send_idle()
+            self.assertEqual(await cli.noidle(), [])
+            self.assertIsNone(await cli.ping())
+        self.run_client(scenario)
+
+
+class TestMPDGroup(unittest.TestCase):
+
+    def setUp(self):
+        self.socket_patch = mock.patch('musicpd.socket')
+        self.socket_mock = self.socket_patch.start()
+        self.socket_mock.getaddrinfo.return_value = [range(5)]
+        self.socket_mock.socket.side_effect = self.pong_socket
+
+    def tearDown(self):
+        self.socket_patch.stop()
+
+    def pong_socket(self, *args, **kwargs):
+        sock = mock_socket()
+        mock_socket_data(sock, TEST_MPD_HELLO + b'OK\n' * 10)
+        return sock
+
+    def test_run(self):
+        class SlowClient(musicpd.MPDClient):
+            def ping(self):
+                if self.host == 'bad':
+                    raise musicpd.ConnectionError('lost')
+                time.sleep(0.2)
+                return self.host
+
+        hosts = ['a', ('b', 6601), 'c', 'bad']
+        # Whole seconds only, as MPDClient.socket_timeout
+        for timeout in (0.5, 0):
+            with self.assertRaises(ValueError):
+                musicpd.MPDGroup(hosts, timeout=timeout)
+        with musicpd.MPDGroup(hosts, timeout=1, client_class=SlowClient) as group:
+            self.assertEqual(group.clients[('b', 6601)].port, 6601)
+            self.assertEqual(group.clients['a'].socket_timeout, 1)
+            start = time.monotonic()
+            results = group.run('ping')
+            # Hosts are queried concurrently
+            self.assertLess(time.monotonic() - start, 0.6)
+            self.assertEqual({host: results[host] for host in hosts[:3]},
+                             {'a': 'a', ('b', 6601): 'b', 'c': 'c'})
+            self.assertIsInstance(results['bad'], musicpd.ConnectionError)
+            # Failing client is disconnected, connected again next time
+            self.assertIsNone(group.clients['bad']._sock)
+            setup = mock.Mock()
+            group.setup = setup
+            self.assertEqual(group.call(lambda cli, arg: arg, 42),
+                             dict.fromkeys(hosts, 42))
+            setup.assert_called_once_with(group.clients['bad'])
+
+
+class TestIdleDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = musicpd.IdleDispatcher(on_error=self.on_error)
+        self.errors = []
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+        self.dispatcher.close()
+
+    def on_error(self, client, err):
+        self.errors.append((client, err))
+
+    def connect(self):
+        """Client connected to a socket pair, returns (client, server end)"""
+        sock, server = socket.socketpair()
+        server.settimeout(1)
+        self.servers.append(server)
+        server.sendall(TEST_MPD_HELLO)
+        client = musicpd.MPDClient()
+        with unittest.mock.patch.object(client, '_connect_socket', return_value=sock):
+            client.connect('localhost')
+        self.addCleanup(lambda: client._sock and client.disconnect())
+        return client, server
+
+    def received(self, server, expected):
+        data = b''
+        while len(data) < len(expected):
+            data += server.recv(1024)
+        self.assertEqual(data, expected)
+
+    def test_dispatch(self):
+        events = []
+        first, server1 = self.connect()
+        second, server2 = self.connect()
+        self.dispatcher.register(first, {'player': lambda cli, sub: events.append((cli, sub)),
+                                         'mixer': lambda cli, sub: events.append(cli.status())})
+        self.dispatcher.register(second, {'database': lambda cli, sub: events.append((cli, sub))})
+        self.received(server1, b'idle "player" "mixer"\n')
+        self.received(server2, b'idle "database"\n')
+        self.assertEqual(self.dispatcher.run_once(0), 0)
+        # Callbacks run out of idle, then idle is sent again
+        server1.sendall(b'changed: player\nchanged: mixer\nOK\nvolume: 42\nOK\n')
+        self.assertEqual(self.dispatcher.run_once(1), 1)
+        self.assertEqual(events, [(first, 'player'), {'volume': '42'}])
+        self.received(server1, b'status\nidle "player" "mixer"\n')
+        # Scheduled calls leave idle, changes received meanwhile are dispatched
+        server2.sendall(b'changed: database\nOK\nOK\n')
+        self.dispatcher.call(second, lambda cli, arg: events.append(cli.ping() or arg), 'pong')
+        self.dispatcher.run_once(1)
+        self.assertEqual(events[2:], [(second, 'database'), 'pong'])
+        self.received(server2, b'noidle\nping\nidle "database"\n')
+        # Lost connection
+        server2.close()
+        self.dispatcher.run_once(1)
+        self.assertEqual([client for client, _ in self.errors], [second])
+        self.assertIsNone(second._sock)
+        # Unregistered client leaves idle
+        server1.sendall(b'OK\n')
+        self.dispatcher.unregister(first)
+        self.received(server1, b'noidle\n')
+        self.assertEqual(first._pending, [])
+
+    def test_callback_error(self):
+        def lost(cli, subsystem):
+            raise musicpd.ConnectionError('lost')
+        first, server1 = self.connect()
+        second, server2 = self.connect()
+        self.dispatcher.register(first, {'player': lost})
+        self.dispatcher.register(second, {'mixer': lambda cli, sub: None})
+        self.received(server1, b'idle "player"\n')
+        server1.sendall(b'changed: player\nOK\n')
+        self.dispatcher.run_once(1)
+        self.assertEqual([(cli, str(err)) for cli, err in self.errors], [(first, 'lost')])
+        self.assertIsNone(first._sock)
+        self.assertNotIn(first, self.dispatcher._clients)
+        # Scheduled calls too, the other client keeps running
+        server2.sendall(b'OK\n')
+        self.dispatcher.call(second, lost, 'mixer')
+        self.dispatcher.run_once(1)
+        self.assertEqual([cli for cli, _ in self.errors], [first, second])
+        self.assertEqual(self.dispatcher._clients, {})
+        # Nothing left to run
+        self.dispatcher.run()
+
+
+class TestMPDClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self.socket_patch = mock.patch('musicpd.socket')
+        self.socket_mock = self.socket_patch.start()
+        self.socket_mock.getaddrinfo.return_value = [range(5)]
+        self.socket_mock.socket.side_effect = self.pong_socket
+        self.pool = musicpd.MPDClientPool(TEST_MPD_HOST, TEST_MPD_PORT, size=2,
+                                          keepalive=None)
+
+    def tearDown(self):
+        self.pool.close()
+        self.socket_patch.stop()
+
+    def pong_socket(self, *args, **kwargs):
+        sock = mock_socket()
+        mock_socket_data(sock, TEST_MPD_HELLO + b'OK\n' * 10)
+        return sock
+
+    def test_acquire_release(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertIsNot(first, second)
+        with self.assertRaises(musicpd.ConnectionError):
+            self.pool.acquire(timeout=0.01)
+        self.pool.release(first)
+        # reused after a ping
+        self.assertIs(self.pool.acquire(timeout=0.01), first)
+        first._wfile.write.assert_called_with(b'ping\n')
+        first.send_status()
+        # pending command, the client is discarded
+        self.pool.release(first)
+        self.assertIsNone(first._sock)
+        with self.pool.connection() as third:
+            self.assertIsNot(third, first)
+        stats = self.pool.stats()
+        self.assertEqual((stats['created'], stats['discarded']), (3, 1))
+        self.assertEqual((stats['in_use'], stats['idle']), (1, 1))
+        self.assertEqual((stats['acquired'], stats['waits']), (4, 0))
+
+    def test_connection_error(self):
+        with self.assertRaises(musicpd.ConnectionError):
+            with self.pool.connection() as cli:
+                raise musicpd.ConnectionError('lost')
+        self.assertIsNone(cli._sock)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+        # Failing ping, a new client is connected
+        with self.pool.connection() as cli:
+            pass
+        cli._rfile = musicpd._SocketReader(cli._sock)
+        mock_socket_data(cli._sock, b'')
+        with self.pool.connection() as other:
+            self.assertIsNot(cli, other)
+
+    def test_keepalive(self):
+        with musicpd.MPDClientPool(TEST_MPD_HOST, TEST_MPD_PORT, size=2,
+                                   keepalive=0.1) as pool:
+            alive, dead = pool.acquire(), pool.acquire()
+            dead._rfile = musicpd._SocketReader(dead._sock)
+            mock_socket_data(dead._sock, b'')
+            alive._wfile.write.reset_mock()
+            pool.release(alive)
+            pool.release(dead)
+            deadline = time.monotonic() + 2
+            while pool.stats()['discarded'] < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # Idle clients are pinged, the dead one is dropped
+            stats = pool.stats()
+            self.assertEqual((stats['discarded'], stats['idle']), (1, 1))
+            self.assertIsNone(dead._sock)
+            alive._wfile.write.assert_called_with(b'ping\n')
+            self.assertIs(pool.acquire(timeout=0.01), alive)
+
+
+class TestFakeMPD(unittest.TestCase):
+    """End to end tests against musicpd_testing.FakeMPD"""
+
+    def setUp(self):
+        self.server = musicpd_testing.FakeMPD(songs=50, queue=20).start()
+        self.client = musicpd.MPDClient()
+        self.client.connect(*self.server.address)
+
+    def tearDown(self):
+        if self.client._sock is not None:
+            self.client.disconnect()
+        self.server.stop()
+
+    def test_commands(self):
+        cli = self.client
+        self.assertEqual(cli.mpd_version, '0.24.0')
+        self.assertEqual(cli.status()['playlistlength'], '20')
+        songs = cli.playlistinfo()
+        self.assertEqual(len(songs), 20)
+        self.assertEqual(cli.playlistinfo('2:4'), songs[2:4])
+        self.assertEqual(len(cli.find('album', 'Album 1')), 12)
+        self.assertEqual(cli.count('album', 'Album 1')['songs'], '12')
+        self.assertEqual(cli.list('album'), [f'Album {idx}' for idx in range(5)])
+        with self.assertRaises(musicpd.CommandError) as err:
+            cli.addid('missing.flac')
+        self.assertEqual(err.exception.args[0],
+                         '[50@0] {addid} No such song')
+
+    def test_command_list(self):
+        cli = self.client
+        uri = cli.playlistinfo('0')[0]['file']
+        cli.command_list_ok_begin()
+        cli.addid(uri)
+        cli.addid('missing.flac')
+        with self.assertRaises(musicpd.CommandError) as err:
+            cli.command_list_end()
+        self.assertEqual(err.exception.args[0],
+                         '[50@1] {addid} No such song')
+        results = cli.command_batch(('addid', uri) for _ in range(25))
+        self.assertEqual(len(results), 25)
+        self.assertEqual(cli.status()['playlistlength'], '46')
+        mirror = musicpd.QueueMirror()
+        mirror.sync(cli)
+        cli.delete('0:10')
+        mirror.sync(cli)
+        self.assertEqual(list(mirror), cli.playlistinfo())
+
+    def test_cover(self):
+        cli = self.client
+        uri = cli.playlistinfo('0')[0]['file']
+        # Partial reads of the binary responses
+        self.server.chunk_size = 1000
+        cover = cli.cover(uri)
+        self.assertEqual(cover['size'], '100000')
+        self.assertEqual(bytes(cover['data'][:256]), bytes(range(256)))
+        self.assertEqual(len(cover['data']), 100000)
+
+    def test_idle(self):
+        cli = self.client
+        other = musicpd.MPDClient()
+        other.connect(*self.server.address)
+        self.addCleanup(other.disconnect)
+        cli.send_idle('player')
+        other.setvol(10)
+        other.play()
+        self.assertEqual(cli.fetch_idle(), ['player'])
+        cli.send_idle()
+        self.assertEqual(cli.noidle(), ['mixer'])
+        cli.send_idle()
+        self.assertEqual(cli.noidle(), [])
+
+    def test_faults(self):
+        cli = self.client
+        cli.socket_timeout = 1
+        self.server.latency = 1.2
+        with self.assertRaises(socket.timeout):
+            cli.ping()
+        cli.disconnect()
+        self.server.latency = 0
+        self.server.bandwidth = 200000
+        cli.connect(*self.server.address)
+        start = time.monotonic()
+        cli.cover(cli.playlistinfo('0')[0]['file'])
+        self.assertGreater(time.monotonic() - start, 0.4)
+        self.server.bandwidth = None
+        self.server.disconnect_after = 1
+        cli.disconnect()
+        cli.connect(*self.server.address)
+        cli.ping()
+        with self.assertRaises(musicpd.ConnectionError):
+            cli.ping()
+
+    def test_instrument(self):
+        cli = self.client
+        samples = []
+        metrics = musicpd.CommandMetrics(buckets=[0.5, 0.001])
+        cli.instrument = lambda sample: (samples.append(sample), metrics(sample))
+        self.assertEqual(len(cli.playlistinfo()), 20)
+        cli.send_status()
+        cli.fetch_status()
+        cli.command_list_ok_begin()
+        cli.ping()
+        cli.status()
+        cli.command_list_end()
+        with self.assertRaises(musicpd.CommandError):
+            cli.find('album')
+        cli.iterate = True
+        self.assertEqual(len(list(cli.playlistinfo())), 20)
+        self.assertEqual([sample.command for sample in samples],
+                         ['playlistinfo', 'status', 'command_list', 'find',
+                          'playlistinfo'])
+        songs = samples[0]
+        self.assertEqual(songs.bytes_out, len(b'playlistinfo\n'))
+        self.assertEqual(songs.objects, 20)
+        self.assertEqual(songs.lines, 20 * 14 + 1)
+        self.assertGreater(songs.bytes_in, 20 * 14 * 10)
+        self.assertGreater(songs.duration, 0)
+        self.assertEqual(samples[-1].objects, 20)
+        self.assertEqual(samples[-1].bytes_in, songs.bytes_in)
+        self.assertEqual(samples[2].objects, 2)
+        self.assertEqual(samples[2].bytes_out,
+                         len(b'command_list_ok_begin\nping\nstatus\ncommand_list_end\n'))
+        self.assertIsInstance(samples[3].error, musicpd.CommandError)
+        stats = metrics.as_dict()
+        self.assertEqual(stats['playlistinfo']['count'], 2)
+        self.assertEqual(stats['playlistinfo']['objects'], 40)
+        self.assertEqual(stats['find']['errors'], 1)
+        self.assertEqual(stats['status']['histogram'][-1], (float('inf'), 1))
+        self.assertEqual([bound for bound, _ in stats['status']['histogram']],
+                         [0.001, 0.5, float('inf')])
+        text = metrics.prometheus()
+        self.assertIn('# TYPE musicpd_command_duration_seconds histogram\n', text)
+        self.assertIn('musicpd_command_duration_seconds_bucket'
+                      '{command="playlistinfo",le="+Inf"} 2\n', text)
+        self.assertIn('musicpd_command_errors_total{command="find"} 1\n', text)
+        metrics.reset()
+        self.assertEqual(metrics.as_dict(), {})
+        # Samples stick to their command when instrument is toggled
+        # between send_ and fetch_
+        del samples[:]
+        cli.iterate = False
+        instrument, cli.instrument = cli.instrument, None
+        cli.send_ping()
+        cli.instrument = instrument
+        cli.send_status()
+        cli.fetch_ping()
+        cli.instrument = None
+        cli.send_stats()
+        cli.instrument = instrument
+        cli.fetch_status()
+        cli.fetch_stats()
+        self.assertEqual([sample.command for sample in samples], ['status'])
+        self.assertEqual(samples[0].bytes_out, len(b'status\n'))
+        cli.send_status()
+        cli.instrument = None
+        cli.fetch_status()
+        self.assertEqual(len(samples), 1)
+
+    def test_trace(self):
+        cli = self.client
+        cli.disconnect()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'session.trace')
+            with musicpd.TraceRecorder(path) as recorder:
+                cli.recorder = recorder
+                cli.connect(*self.server.address)
+                songs = cli.playlistinfo()
+                cli.cover(songs[0]['file'])
+                cli.command_batch([('addid', songs[0]['file'])] * 10,
+                                  max_commands=3)
+                with self.assertRaises(musicpd.CommandError):
+                    cli.find('album')
+                cli.send_idle()
+                cli.noidle()
+                cli.disconnect()
+                cli.connect(*self.server.address)
+                cli.ping()
+                cli.disconnect()
+            sessions = musicpd_testing.read_trace(path)
+            self.assertEqual(len(sessions), 2)
+            self.assertEqual(sessions[1], [
+                (sessions[1][0][0], 'R', b'OK MPD 0.24.0\n'),
+                (sessions[1][1][0], 'W', b'ping\n'),
+                (sessions[1][2][0], 'R', b'OK\n')])
+            replayer = musicpd_testing.TraceReplayer(path, speed=None,
+                                                     strict=True)
+            replayed = musicpd.MPDClient()
+            with self.assertLogs('musicpd_testing', 'DEBUG') as logs:
+                self.assertGreater(replayer.run(replayed), 0)
+                musicpd_testing.log.debug('done')
+            # The client sent the recorded bytes
+            self.assertEqual(logs.output, ['DEBUG:musicpd_testing:done'])
+            self.assertIsNone(replayed._sock)
+            # Serves recorded responses in order
+            with replayer.serve() as server:
+                cli.recorder = None
+                cli.connect(*server.address)
+                self.assertEqual(cli.playlistinfo(), songs)
+                self.assertEqual(len(cli.cover(songs[0]['file'])['data']), 100000)
+                cli.disconnect()
+
+    def test_reconnect(self):
+        cli = self.client
+        calls = []
+        for name in ('password', 'partition', 'subscribe', 'unsubscribe', 'tagtypes'):
+            self.server.handlers[name] = (
+                lambda name: lambda conn, args: calls.append((name, args)))(name)
+        cli.reconnect = musicpd.Backoff(attempts=3, delay=0.01)
+        cli.password('secret')
+        cli.partition('kitchen')
+        cli.tagtypes('clear')
+        cli.tagtypes('enable', 'Artist', 'Title')
+        cli.subscribe('ratings')
+        cli.subscribe('lyrics')
+        cli.unsubscribe('ratings')
+        calls.clear()
+        # Read-only commands are retried
+        self.server.disconnect_all()
+        self.assertEqual(cli.status()['playlistlength'], '20')
+        self.assertEqual(calls, [('password', ['secret']),
+                                 ('partition', ['kitchen']),
+                                 ('tagtypes', ['clear']),
+                                 ('tagtypes', ['enable', 'Artist', 'Title']),
+                                 ('subscribe', ['lyrics'])])
+        # Others raise once reconnected
+        self.server.disconnect_all()
+        with self.assertRaises(musicpd.ConnectionError):
+            cli.clear()
+        self.assertEqual(cli.status()['playlistlength'], '20')
+        self.server.stop()
+        with self.assertRaises(musicpd.ConnectionError) as err:
+            cli.ping()
+        self.assertTrue(err.exception.args[0].startswith('Could not reconnect'))
+        self.assertEqual([delay > 0 for delay in cli.reconnect.delays()],
+                         [False, True, True])
+
+    def test_reconnect_iterate(self):
+        cli = self.client
+        cli.reconnect = musicpd.Backoff(attempts=3, delay=0.01)
+        cli.iterate = True
+        list(cli.tagtypes('clear'))
+        self.server.disconnect_all()
+        # Replayed listings are read, the client is not left iterating
+        self.assertEqual(cli.status()['playlistlength'], '20')
+        self.assertTrue(cli.iterate)
+        self.assertFalse(cli._iterating)
+        # Responses are read whole, a connection lost while reading them is
+        # retried
+        self.server.disconnect_all()
+        self.assertEqual(len(list(cli.playlistinfo())), 20)
+        self.assertFalse(cli._iterating)
+
+    def test_staggered_connect(self):
+        self.client.disconnect()
+        self.addCleanup(musicpd.clear_resolver_cache)
+        # Listener with a full backlog: connection attempts hang
+        stall = socket.socket()
+        stall.bind(('127.0.0.1', 0))
+        stall.listen(0)
+        fillers = []
+        for _ in range(4):
+            filler = socket.socket()
+            filler.setblocking(False)
+            filler.connect_ex(stall.getsockname())
+            fillers.append(filler)
+        refused = socket.socket()
+        refused.bind(('127.0.0.1', 0))
+        self.addCleanup(lambda: [sock.close() for sock in fillers + [stall, refused]])
+        inet = (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '')
+        port = self.server.address[1]
+        cli = musicpd.MPDClient()
+        cli.socket_timeout = 2
+        # Address family the platform does not support
+        unsupported = (9999, socket.SOCK_STREAM, 0, '', ('::1', port))
+        for first, delayed in ((inet + (stall.getsockname(),), True),
+                               (inet + (refused.getsockname(),), False),
+                               (unsupported, False)):
+            gai = [first, inet + (self.server.address,)]
+            with mock.patch.object(musicpd.socket, 'getaddrinfo',
+                                   return_value=gai) as gai_mock:
+                start = time.monotonic()
+                cli.connect('eyeballs.test', port)
+                elapsed = time.monotonic() - start
+                self.assertEqual(cli._sock.getpeername(), self.server.address)
+                self.assertEqual(elapsed >= musicpd.CONNECTION_ATTEMPT_DELAY,
+                                 delayed)
+                self.assertLess(elapsed, 1)
+                cli.ping()
+                cli.disconnect()
+                # Resolved addresses are cached
+                cli.connect('eyeballs.test', port)
+                cli.disconnect()
+                self.assertEqual(gai_mock.call_count, 1)
+            musicpd.clear_resolver_cache()
+
+    def test_interleave_families(self):
+        gai = [(socket.AF_INET6, 'a'), (socket.AF_INET6, 'b'),
+               (socket.AF_INET6, 'c'), (socket.AF_INET, 'd')]
+        self.assertEqual([res[1] for res in musicpd._interleave_families(gai)],
+                         ['a', 'd', 'b', 'c'])
+
+    def test_library_mirror(self):
+        mirror = musicpd.LibraryMirror(':memory:')
+        self.assertTrue(mirror.sync(self.client))
+        self.assertEqual(mirror.count()['songs'], '50')
+        # Nested change: directories above keep their last-modified
+        song = list(self.server.library[0])
+        song[0] = ('file', 'Artist 0/Album 0/13-New.flac')
+        song[5] = ('Title', 'New')
+        self.server.library.append(song)
+        # Retagged in place
+        song = self.server.library[1]
+        song[1] = ('Last-Modified', '2024-04-01T10:00:00Z')
+        song[5] = ('Title', 'Retagged')
+        self.server.cmd_update(None, [])
+        self.assertTrue(mirror.sync(self.client))
+        self.assertEqual(mirror.count()['songs'], '51')
+        self.assertEqual([s['file'] for s in mirror.find('title', 'New')],
+                         ['Artist 0/Album 0/13-New.flac'])
+        self.assertEqual(mirror.find('title', 'Retagged')[0]['file'],
+                         'Artist 0/Album 0/01-Track 1.flac')
+        self.assertEqual(mirror.find('title', 'Track 1'), [])
+        mirror.close()
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'socket')
+            with musicpd_testing.FakeMPD(path=path) as server:
+                cli = musicpd.MPDClient()
+                cli.connect(*server.address)
+                self.assertEqual(cli.stats()['songs'], '100')
+                cli.disconnect()
+
+
 class TestConnectionError(unittest.TestCase):
 
     @mock.patch('socket.socket')
@@ -636,6 +1865,7 @@ class TestConnectionError(unittest.TestCase):
         self.assertEqual('[Errno 42] err 42', str(cme.exception))
 
     def test_non_available_unix_socket(self):
+        self.addCleanup(setattr, musicpd.socket, 'AF_UNIX', musicpd.socket.AF_UNIX)
         delattr(musicpd.socket, 'AF_UNIX')
         os.environ['MPD_HOST'] = '/run/mpd/socket'
         cli = musicpd.MPDClient()
@@ -682,7 +1912,7 @@ class TestCommandErrorException(unittest.TestCase):
     def test_error_on_newline(self):
         os.environ['MPD_HOST'] = '/run/mpd/socket'
         with mock.patch('musicpd.socket') as socket_mock:
-            sock = mock.MagicMock(name='socket')
+            sock = mock_socket()
             socket_mock.socket.return_value = sock
             cli = musicpd.MPDClient()
             cli.connect()
@@ -694,7 +1924,7 @@ class testContextManager(unittest.TestCase):
     def test_enter_exit(self):
         os.environ['MPD_HOST'] = '@abstract'
         with mock.patch('musicpd.socket') as socket_mock:
-            sock = mock.MagicMock(name='socket')
+            sock = mock_socket()
             socket_mock.socket.return_value = sock
             cli = musicpd.MPDClient()
             with cli as c: